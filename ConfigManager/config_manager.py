@@ -158,15 +158,28 @@ class ConfigManager():
         # this method should only be ran once the config has been loaded in
         passed = True
     
-        # check the binaries are executable
+        # check the binaries are executable. Using ISSL, Bowtie2 is only needed
+        # for the guides that are not in the ISSL index, if its index is set
+        uniquenessBinaries = [c['bowtie2']['binary']]
+        if c['offtargetscore'].get('uniqueness', 'bowtie2') == 'issl':
+            uniquenessBinaries = [c['offtargetscore']['exact-binary']]
+            if c['input'].get('bowtie2-index', ''):
+                uniquenessBinaries.append(c['bowtie2']['binary'])
+
         for x in [
             c['offtargetscore']['binary'],
-            c['bowtie2']['binary'],
+            *uniquenessBinaries,
             c['rnafold']['binary']
         ]:
             if not shutil.which(x):
                 passed = False
                 self._sendMsg(f'This binary cannot be executed: {x}')
+
+        # check the ISSL shared library exists, if it is to be used
+        isslLibrary = c['offtargetscore'].get('library', '')
+        if isslLibrary and not os.path.isfile(isslLibrary):
+            passed = False
+            self._sendMsg(f'The ISSL library does not exist: {isslLibrary}')
         
         # check that the 'n' value for the consensus is less than or equal to
         # the number of tools being used
@@ -241,9 +254,6 @@ class ConfigManager():
             c['offtargetscore']['input'] = os.path.join(c['output']['dir'], f'{name}-{fileId}-offtargetscore-input.txt')
             c['offtargetscore']['output'] = os.path.join(c['output']['dir'], f'{name}-{fileId}-offtargetscore-output.txt')
 
-            c['bowtie2']['input'] = os.path.join(c['output']['dir'], f'{name}-bowtie-input.txt')
-            c['bowtie2']['output'] = os.path.join(c['output']['dir'], f'{name}-bowtie-output.txt')
-
             fileId += 1
 
             yield file
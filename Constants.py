@@ -10,6 +10,9 @@ MODULE_CHOPCHOP = 'chopchop'
 MODULE_CONSENSUS = 'consensus'
 MODULE_SPECIFICITY = 'specificity'
 
+# The PAM variants (NGG and NAG) that each guide is checked with for uniqueness
+BOWTIE_PAM_VARIANTS = ['AGG', 'CGG', 'GGG', 'TGG', 'AAG', 'CAG', 'GAG', 'TAG']
+
 DEFAULT_GUIDE_PROPERTIES = {
     'seq'                       : "",
     'header'                    : "",
@@ -7,11 +7,16 @@ Config:
     - See config.ini
 '''
 
-import argparse, ast, csv, joblib, os, re, sys, time, tempfile, psutil
+import argparse, ast, csv, itertools, joblib, os, re, sys, time, tempfile, psutil
 
 from ConfigManager import ConfigManager
 from Paginator import Paginator
 from Batchinator import Batchinator
+from IsslClient import IsslClient
+from IsslCluster import IsslCluster, splitIndexes
+from IsslLibrary import IsslLibrary
+from IsslScores import readIsslScores
+from IsslCache import IsslCache
 from Constants import *
 from Helpers import * 
 
@@ -30,6 +35,56 @@ def Crackling(configMngr):
     lastScaffoldSizeBytes = 0
     totalRunTimeSec = 0
 
+    # Each ISSL thread keeps a flag for every off-target, so ISSL is given no
+    # more threads than there are processors
+    isslThreads = min(int(configMngr['offtargetscore']['threads']), os.cpu_count() or 1)
+
+    # Several ISSL indexes, such as those of a genome and its plasmids, are
+    # scored as one by the ISSL binary
+    offtargetIndexes = configMngr['input']['offtarget-sites'].split()
+
+    # The ISSL library, daemon or workers are reused for every page and batch, if configured
+    isslLibraryPath = configMngr['offtargetscore'].get('library', '')
+    isslLibrary = None
+    isslClient = None
+    workerAddresses = configMngr['offtargetscore'].get('worker-addresses', '').split()
+    workers = int(configMngr['offtargetscore'].get('workers', '0'))
+    if len(offtargetIndexes) > 1 and isslLibraryPath:
+        raise ValueError('Several ISSL indexes can only be scored by the ISSL binary, daemon or workers, not the library')
+
+    if isslLibraryPath:
+        # the library loads the index when it first scores a page, so that the
+        # index is not loaded unless a guide reaches off-target scoring
+        pass
+    elif workerAddresses:
+        # the workers are already running, each with its part of the index
+        isslClient = IsslCluster(workerAddresses, servedIndexes=offtargetIndexes)
+    elif workers > 0:
+        if not configMngr['offtargetscore'].get('daemon-socket', ''):
+            raise ValueError('The ISSL workers listen on daemon-socket, followed by their number, which must be set')
+
+        # each worker is given its share of the shards, and started if it is not running
+        workerIndexes = splitIndexes(offtargetIndexes, workers)
+        isslClient = IsslCluster(
+            [f"{configMngr['offtargetscore']['daemon-socket']}.{i}" for i in range(len(workerIndexes))],
+            configMngr['offtargetscore']['binary'],
+            workerIndexes
+        )
+    elif configMngr['offtargetscore'].get('daemon-socket', ''):
+        isslClient = IsslClient(
+            configMngr['offtargetscore']['daemon-socket'],
+            configMngr['offtargetscore']['binary'],
+            ','.join(offtargetIndexes)
+        )
+
+    # The scores of guides are kept between runs, if configured
+    isslCache = None
+    if configMngr['offtargetscore'].get('cache', ''):
+        isslCache = IsslCache(
+            configMngr['offtargetscore']['cache'],
+            int(configMngr['offtargetscore'].get('cache-size', '10000000'))
+        )
+
     ####################################
     ###     Run-time Optimisation     ##
     ####################################
@@ -131,6 +186,89 @@ def Crackling(configMngr):
             if doAssess:
                 yield target23
     
+    # Checks that each of `guidesToAssess` appears only once in the genome by
+    # aligning it, with each NGG and NAG PAM, using Bowtie2. Returns the number
+    # of guides tested, and of those that failed
+    def bowtieUniqueness(guidesToAssess):
+        nonlocal configMngr
+
+        testedCount = 0
+        failedCount = 0
+
+        pgLength = int(configMngr['bowtie2']['page-length'])
+
+        # Every guide is assessed by a single Bowtie2 process. As 
+        # `--reorder` is used, the records are reported in the same 
+        # order as the queries: eight records per guide. The index is
+        # memory-mapped (`--mm`) so that concurrent runs share the index
+        # pages rather than each loading their own copy.
+        bowtieArgs = [
+            configMngr['bowtie2']['binary'],
+            '-x', configMngr['input']['bowtie2-index'],
+            '-p', configMngr['bowtie2']['threads'],
+            '--reorder', '--no-hd', '-t', '-r', '--mm',
+            '-U', '-',
+        ]
+
+        bowtieOutput = streamer(
+            bowtieArgs,
+            (f'{target23[0:20]}{pam}\n' for target23 in guidesToAssess for pam in BOWTIE_PAM_VARIANTS)
+        )
+
+        for pgIdx, pageCandidateGuides in Paginator(guidesToAssess, pgLength):
+
+            if pgLength > 0:
+                printer(f'\tProcessing page {(pgIdx+1)} ({pgLength} per page).')
+
+            guidesInPage = 0
+            for target23 in pageCandidateGuides:
+                testedCount += 1
+                nb_occurences = 0
+
+                records = []
+                for line in itertools.islice(bowtieOutput, len(BOWTIE_PAM_VARIANTS)):
+                    records.append(line.rstrip('\n').split('\t'))
+
+                if len(records) < len(BOWTIE_PAM_VARIANTS):
+                    raise RuntimeError(f'Bowtie2 output ended before {target23} was reported')
+
+                # the record for the PAM of the guide gives its position
+                record = records[BOWTIE_PAM_VARIANTS.index(target23[20:23])]
+                candidateGuides[target23]['bowtieChr'] = record[2]
+                candidateGuides[target23]['bowtieStart'] = int(record[3])
+                candidateGuides[target23]['bowtieEnd'] = int(record[3]) + 22
+
+                # we count how many of the eight reads for this target have a perfect alignment
+                for record in records:
+
+                    # http://bowtie-bio.sourceforge.net/bowtie2/manual.shtml#sam-output
+                    # XM:i:<N>    The number of mismatches in the alignment. Only present if SAM record is for an aligned read.
+                    # XS:i:<N>    Alignment score for the best-scoring alignment found other than the alignment reported.
+                    tags = record[11:]
+
+                    if 'XM:i:0' in tags:
+                        nb_occurences += 1
+
+                        # we also check whether this perfect alignment also happens elsewhere
+                        if 'XS:i:0' in tags:
+                            nb_occurences += 1
+
+                # if that number is at least two, the target is removed
+                if nb_occurences > 1:
+                    candidateGuides[target23]['passedBowtie'] = CODE_REJECTED
+                    failedCount += 1
+                else:
+                    candidateGuides[target23]['passedBowtie'] = CODE_ACCEPTED
+
+                guidesInPage += 1
+
+            printer(f'\t\t{guidesInPage} guides in this page.')
+
+        if next(bowtieOutput, None) is not None:
+            raise RuntimeError('Bowtie2 output reported more records than were queried')
+
+        return testedCount, failedCount
+
     def processSequence(sequence):
         # Patterns for guide matching
         pattern_forward = r'(?=([ATCG]{21}GG))'
@@ -578,127 +716,95 @@ def Crackling(configMngr):
         printer(f'\t{failedCount} of {testedCount} failed here.')
 
         if (configMngr['offtargetscore'].getboolean('enabled')):
-            ###############################################
-            ##         Using Bowtie for positioning      ##
-            ###############################################
-            printer('Bowtie analysis.')
+            guidesToAssess = list(filterCandidateGuides(candidateGuides, MODULE_SPECIFICITY))
 
-            testedCount = 0
-            failedCount = 0
+            if configMngr['offtargetscore'].get('uniqueness', 'bowtie2') == 'issl':
+                ###############################################
+                ##     Using ISSL for exact-match counts     ##
+                ###############################################
+                printer('ISSL exact-match analysis.')
 
-            pgLength = int(configMngr['bowtie2']['page-length'])
+                testedCount = 0
+                failedCount = 0
+                notIndexedGuides = []
 
-            for pgIdx, pageCandidateGuides in Paginator(
-                filterCandidateGuides(candidateGuides, MODULE_SPECIFICITY), 
-                pgLength
-            ):
+                pgLength = int(configMngr['offtargetscore']['page-length'])
 
-                if pgLength > 0:
-                    printer(f'\tProcessing page {(pgIdx+1)} ({pgLength} per page).')
-                
-                if os.path.exists(configMngr['bowtie2']['output']):
-                    os.remove(configMngr['bowtie2']['output'])
+                # Every guide is looked up in the ISSL indexes, and any companion
+                # indexes, by a single process. The off-targets in the index 
+                # carry an NGG or NAG PAM so the count is the number of perfect
+                # matches that Bowtie2 would find for the eight PAM variants.
+                exactArgs = [
+                    configMngr['offtargetscore']['exact-binary'],
+                    offtargetIndexes[0],
+                    '-',
+                ] + offtargetIndexes[1:] + configMngr['input'].get('offtarget-sites-nag', '').split()
+
+                exactOutput = streamer(
+                    exactArgs,
+                    (f'{target23[0:20]}\n' for target23 in guidesToAssess)
+                )
 
-                printer('\tConstructing the Bowtie input file.')
-                
-                tempTargetDict_offset = {}
-                guidesInPage = 0
-                with open(configMngr['bowtie2']['input'], 'w') as fWriteBowtie:
+                for pgIdx, pageCandidateGuides in Paginator(guidesToAssess, pgLength):
+
+                    if pgLength > 0:
+                        printer(f'\tProcessing page {(pgIdx+1)} ({pgLength} per page).')
+
+                    guidesInPage = 0
                     for target23 in pageCandidateGuides:
                         testedCount += 1
-                        similarTargets = [
-                            target23[0:20] + 'AGG', 
-                            target23[0:20] + 'CGG', 
-                            target23[0:20] + 'GGG', 
-                            target23[0:20] + 'TGG', 
-                            target23[0:20] + 'AAG', 
-                            target23[0:20] + 'CAG', 
-                            target23[0:20] + 'GAG', 
-                            target23[0:20] + 'TAG'
-                        ]
-                        
-                        for seq in similarTargets:
-                            fWriteBowtie.write(seq + '\n')
-                            tempTargetDict_offset[seq] = target23
-                            
+
+                        line = next(exactOutput, None)
+                        if line is None or line.split('\t')[0] != target23[0:20]:
+                            raise RuntimeError(f'ISSL output did not report {target23}')
+
+                        nb_occurences = int(line.split('\t')[1])
+
+                        # the guide itself is not in the index (e.g., it has a
+                        # leading T, which extractOfftargets.py does not keep)
+                        if nb_occurences == 0:
+                            notIndexedGuides.append(target23)
+                        # if that number is at least two, the target is removed
+                        elif nb_occurences > 1:
+                            candidateGuides[target23]['passedBowtie'] = CODE_REJECTED
+                            failedCount += 1
+                        else:
+                            candidateGuides[target23]['passedBowtie'] = CODE_ACCEPTED
+
                         guidesInPage += 1
 
-                printer(f'\t\t{guidesInPage} guides in this page.')
+                    printer(f'\t\t{guidesInPage} guides in this page.')
 
-                runner('{} -x {} -p {} --reorder --no-hd -t -r -U {} -S {}'.format(
-                        configMngr['bowtie2']['binary'],
-                        configMngr['input']['bowtie2-index'],
-                        configMngr['bowtie2']['threads'],
-                        configMngr['bowtie2']['input'],
-                        configMngr['bowtie2']['output']
-                    ),
-                    shell=True,
-                    check=True
-                )       
-                
-                printer('\tStarting to process the Bowtie results.')
-                
-                inFile = open(configMngr['bowtie2']['output'], 'r')
-                bowtieLines = inFile.readlines()
-                inFile.close()
-
-                i=0
-                while i<len(bowtieLines):
-                    nb_occurences = 0
-                    # we extract the read and use the dictionary to find the corresponding target
-                    line = bowtieLines[i].rstrip().split('\t')
-                    chr = line[2]
-                    pos = ast.literal_eval(line[3])
-                    read = line[9]
-                    seq = ''
-                    
-                    if read in tempTargetDict_offset:
-                        seq = tempTargetDict_offset[read]
-                    elif rc(read) in tempTargetDict_offset:
-                        seq = tempTargetDict_offset[rc(read)]
-                    else:
-                        print('Problem? '+read)
-                
-                    if seq[:-2] == 'GG':
-                        candidateGuides[seq]['bowtieChr'] = chr
-                        candidateGuides[seq]['bowtieStart'] = pos
-                        candidateGuides[seq]['bowtieEnd'] = pos + 22
-                    elif rc(seq)[:2] == 'CC':
-                        candidateGuides[seq]['bowtieChr'] = chr
-                        candidateGuides[seq]['bowtieStart'] = pos
-                        candidateGuides[seq]['bowtieEnd'] = pos + 22
-                    else:
-                        print('Error? '+seq)
-                        quit()  
-                        
-                    # we count how many of the eight reads for this target have a perfect alignment
-                    for j in range(i,i+8):
-                    
-                        # http://bowtie-bio.sourceforge.net/bowtie2/manual.shtml#sam-output
-                        # XM:i:<N>    The number of mismatches in the alignment. Only present if SAM record is for an aligned read.
-                        # XS:i:<N>    Alignment score for the best-scoring alignment found other than the alignment reported.
-                        
-                        if 'XM:i:0' in bowtieLines[j]:
-                            nb_occurences += 1
-                            
-                            # we also check whether this perfect alignment also happens elsewhere
-                            if 'XS:i:0'  in bowtieLines[j]:
-                                nb_occurences += 1
-
-                    # if that number is at least two, the target is removed
-                    if nb_occurences > 1:
-                        candidateGuides[seq]['passedBowtie'] = CODE_REJECTED
-                        failedCount += 1
+                if next(exactOutput, None) is not None:
+                    raise RuntimeError('ISSL output reported more guides than were assessed')
+
+                # The exact matches of a guide that is not in the index cannot be
+                # counted, so it is aligned using Bowtie2, if its index is set, or
+                # else rejected, as it cannot be shown to be unique
+                if len(notIndexedGuides) > 0:
+                    printer(f'\t{len(notIndexedGuides)} of {testedCount} were not found in the ISSL index.')
+
+                    if configMngr['input'].get('bowtie2-index', ''):
+                        printer('Bowtie analysis of the guides not found in the ISSL index.')
+                        failedCount += bowtieUniqueness(notIndexedGuides)[1]
                     else:
-                        candidateGuides[seq]['passedBowtie'] = CODE_ACCEPTED
-                        
-                    # we continue with the next target
-                    i+=8
-                
-                # we can remove the dictionary
-                del tempTargetDict_offset
-            
-            printer(f'\t{failedCount} of {testedCount} failed here.')
+                        for target23 in notIndexedGuides:
+                            candidateGuides[target23]['passedBowtie'] = CODE_REJECTED
+                        failedCount += len(notIndexedGuides)
+
+                del notIndexedGuides
+
+                printer(f'\t{failedCount} of {testedCount} failed here.')
+
+            else:
+                ###############################################
+                ##         Using Bowtie for positioning      ##
+                ###############################################
+                printer('Bowtie analysis.')
+                testedCount, failedCount = bowtieUniqueness(guidesToAssess)
+                printer(f'\t{failedCount} of {testedCount} failed here.')
+
+            del guidesToAssess
 
             #########################################
             ##      Begin off-target scoring       ##
@@ -710,64 +816,210 @@ def Crackling(configMngr):
                 
                 pgLength = int(configMngr['offtargetscore']['page-length'])
 
-                for pgIdx, pageCandidateGuides in Paginator(
-                    filterCandidateGuides(candidateGuides, MODULE_SPECIFICITY), 
-                    pgLength
-                ):
+                guidesToScore = list(filterCandidateGuides(candidateGuides, MODULE_SPECIFICITY))
 
-                    if pgLength > 0:
-                        printer(f'\tProcessing page {(pgIdx+1)} ({pgLength} per page).')
-                    
-                    # prepare the list of candidate guides to score
-                    with open(configMngr['offtargetscore']['input'], 'w') as fTargetsToScore:
-                        for target23 in pageCandidateGuides:
-                            target = target23[0:20]
-                            fTargetsToScore.write(target+'\n')
-                            testedCount += 1
-                    
-                    # Convert line endings (Windows)
-                    if os.name == 'nt':
-                        runner('dos2unix {}'.format(
-                                configMngr['offtargetscore']['input']
-                            ),
-                            shell=True,
-                            check=True
-                        )
-                    
-                    # call the scoring method
-                    runner('{} {} {} {} {} {} > {}'.format(
-                            configMngr['offtargetscore']['binary'],
-                            configMngr['input']['offtarget-sites'],
-                            configMngr['offtargetscore']['input'],
-                            str(configMngr['offtargetscore']['max-distance']),
-                            str(configMngr['offtargetscore']['score-threshold']),
-                            str(configMngr['offtargetscore']['method']),
-                            configMngr['offtargetscore']['output'],
-                        ),
-                        shell=True,
-                        check=True
-                    )
-                    
-                    targetsScored = {}
-                    with open(configMngr['offtargetscore']['output'], 'r') as fTargetsScored:
-                        for targetScored in [x.split('\t') for x in fTargetsScored.readlines()]:
-                            if len(targetScored) == 2:
-                                targetsScored[targetScored[0]] = float(targetScored[1].strip())
-                    
+                # Guides that share a 20-mer, such as those with another PAM,
+                # are scored once
+                guidesBy20mer = {}
+                for target23 in guidesToScore:
+                    guidesBy20mer.setdefault(target23[0:20], []).append(target23)
+
+                def assignScores(targetsScored):
+                    '''Records the scores of each guide of each target scored,
+                    returning the number that failed'''
                     failedCount = 0
-                    for target23 in pageCandidateGuides:
-                        if target23[0:20] in targetsScored:
-                            score = targetsScored[target23[0:20]]
+                    for target, (mit, cfd) in targetsScored.items():
+                        score = offtargetScore(mit, cfd, configMngr['offtargetscore']['method'])
+                        for target23 in guidesBy20mer.get(target, []):
                             candidateGuides[target23]['offtargetscore'] = score
-                            
+
                             if score < float(configMngr['offtargetscore']['score-threshold']):
                                 candidateGuides[target23]['passedOffTargetScore'] = CODE_REJECTED
                                 failedCount += 1
                             else:
                                 candidateGuides[target23]['passedOffTargetScore'] = CODE_ACCEPTED
+                    return failedCount
+
+                # Guides scored by an earlier run, against the same indexes and
+                # with the same settings, are not scored again. The scoring mode
+                # decides where a guide that fails exits early, and so its score:
+                # the library and a daemon score each guide in turn, scanning
+                # the slices in a fixed order, the workers each exit early alone
+                targetsToScore = list(guidesBy20mer)
+                if isslCache is not None:
+                    if isslLibraryPath or isinstance(isslClient, IsslClient):
+                        scoringMode = 'queries fixed'
+                    elif isslClient is not None:
+                        scoringMode = f'{len(isslClient.workers)} workers'
+                    else:
+                        scoringMode = '{} {}'.format(
+                            configMngr['offtargetscore'].get('schedule', 'queries'),
+                            configMngr['offtargetscore'].get('slice-order', 'fixed')
+                        )
+
+                    cacheKey = isslCache.fingerprint(
+                        offtargetIndexes,
+                        configMngr['offtargetscore']['max-distance'],
+                        configMngr['offtargetscore']['method'],
+                        configMngr['offtargetscore']['score-threshold'],
+                        configMngr['offtargetscore'].get('pam', 'NGG'),
+                        scoringMode
+                    )
+                    targetsCached = isslCache.lookup(cacheKey, targetsToScore)
+                    targetsToScore = [target for target in targetsToScore if target not in targetsCached]
+
+                    failedCount = assignScores(targetsCached)
+                    testedCount += sum(len(guidesBy20mer[target]) for target in targetsCached)
+                    printer(f'\t{len(targetsCached)} of {len(guidesBy20mer)} guides were scored by an earlier run, {failedCount} of which failed.')
+
+                # Every guide is scored by a single ISSL process, which reads
+                # the guides and reports their scores a chunk at a time, while
+                # the pages below consume them
+                isslOutput = None
+                chunkLength = int(configMngr['offtargetscore'].get('chunk-length', '0'))
+                if not isslLibraryPath and isslClient is None and chunkLength > 0:
+                    isslOutput = streamer(
+                        [
+                            configMngr['offtargetscore']['binary'],
+                            ','.join(offtargetIndexes),
+                            '-',
+                            str(configMngr['offtargetscore']['max-distance']),
+                            str(configMngr['offtargetscore']['score-threshold']),
+                            str(configMngr['offtargetscore']['method']),
+                            str(configMngr['offtargetscore'].get('pam', 'NGG')),
+                            str(isslThreads),
+                            f"--schedule={configMngr['offtargetscore'].get('schedule', 'queries')}",
+                            f"--slice-order={configMngr['offtargetscore'].get('slice-order', 'fixed')}",
+                            f'--chunk-size={chunkLength}',
+                        ],
+                        (f'{target}\n' for target in targetsToScore)
+                    )
+
+                for pgIdx, pageTargets in Paginator(targetsToScore, pgLength):
+                    if not pageTargets:
+                        continue
+
+                    if pgLength > 0:
+                        printer(f'\tProcessing page {(pgIdx+1)} ({pgLength} per page).')
                     
+                    scoredLines = None
+                    if isslLibraryPath:
+                        # score the page in-process, the index is loaded by the first page
+                        if isslLibrary is None:
+                            isslLibrary = IsslLibrary(isslLibraryPath, offtargetIndexes[0])
+
+                        testedCount += sum(len(guidesBy20mer[target]) for target in pageTargets)
+
+                        printer(f'\tScoring {len(pageTargets)} guides using the ISSL library.')
+
+                        mitScores, cfdScores = isslLibrary.score(
+                            isslLibrary.encode(pageTargets),
+                            configMngr['offtargetscore']['max-distance'],
+                            configMngr['offtargetscore']['score-threshold'],
+                            configMngr['offtargetscore']['method'],
+                            configMngr['offtargetscore'].get('pam', 'NGG'),
+                            isslThreads
+                        )
+
+                        targetsScored = {}
+                        for target, mit, cfd in zip(pageTargets, mitScores.tolist(), cfdScores.tolist()):
+                            targetsScored[target] = (mit, cfd)
+
+                        printer('\tFinished scoring.')
+                    elif isslClient is not None:
+                        # score the page using the daemon, which has the index loaded already
+                        testedCount += sum(len(guidesBy20mer[target]) for target in pageTargets)
+
+                        printer(f'\tScoring {len(pageTargets)} guides using the ISSL daemon.')
+
+                        scoredLines = isslClient.score(
+                            pageTargets,
+                            configMngr['offtargetscore']['max-distance'],
+                            configMngr['offtargetscore']['score-threshold'],
+                            configMngr['offtargetscore']['method'],
+                            configMngr['offtargetscore'].get('pam', 'NGG'),
+                            isslThreads
+                        )
+
+                        printer('\tFinished scoring.')
+                    elif isslOutput is not None:
+                        # read the scores of the page as the ISSL process reports them
+                        testedCount += sum(len(guidesBy20mer[target]) for target in pageTargets)
+
+                        scoredLines = []
+                        for target in pageTargets:
+                            line = next(isslOutput, None)
+                            if line is None or line.split('\t')[0] != target:
+                                raise RuntimeError(f'ISSL output did not report {target}')
+                            scoredLines.append(line)
+                    else:
+                        outputFormat = configMngr['offtargetscore'].get('output-format', 'text')
+
+                        # prepare the list of candidate guides to score
+                        with open(configMngr['offtargetscore']['input'], 'w') as fTargetsToScore:
+                            for target in pageTargets:
+                                fTargetsToScore.write(target+'\n')
+                                testedCount += len(guidesBy20mer[target])
+                        
+                        # Convert line endings (Windows)
+                        if os.name == 'nt':
+                            runner('dos2unix {}'.format(
+                                    configMngr['offtargetscore']['input']
+                                ),
+                                shell=True,
+                                check=True
+                            )
+                        
+                        # call the scoring method
+                        runner('{} {} {} {} {} {} {} {} {} {} {} > {}'.format(
+                                configMngr['offtargetscore']['binary'],
+                                ','.join(offtargetIndexes),
+                                configMngr['offtargetscore']['input'],
+                                str(configMngr['offtargetscore']['max-distance']),
+                                str(configMngr['offtargetscore']['score-threshold']),
+                                str(configMngr['offtargetscore']['method']),
+                                str(configMngr['offtargetscore'].get('pam', 'NGG')),
+                                isslThreads,
+                                f"--schedule={configMngr['offtargetscore'].get('schedule', 'queries')}",
+                                f"--slice-order={configMngr['offtargetscore'].get('slice-order', 'fixed')}",
+                                f'--output-format={outputFormat}',
+                                configMngr['offtargetscore']['output'],
+                            ),
+                            shell=True,
+                            check=True
+                        )
+
+                        if outputFormat == 'text':
+                            with open(configMngr['offtargetscore']['output'], 'r') as fTargetsScored:
+                                scoredLines = fTargetsScored.readlines()
+                        else:
+                            # the scores are in the order of the input file
+                            mitScores, cfdScores = readIsslScores(configMngr['offtargetscore']['output'])
+
+                            targetsScored = {}
+                            for target, mit, cfd in zip(pageTargets, mitScores.tolist(), cfdScores.tolist()):
+                                targetsScored[target] = (mit, cfd)
+
+                    # each line reports the MIT and CFD scores of a target, followed
+                    # by those against each index alone when there are several
+                    if scoredLines is not None:
+                        targetsScored = {}
+                        for targetScored in [x.split('\t') for x in scoredLines]:
+                            if len(targetScored) >= 3:
+                                targetsScored[targetScored[0]] = (
+                                    float(targetScored[1]),
+                                    float(targetScored[2])
+                                )
+
+                    if isslCache is not None:
+                        isslCache.store(cacheKey, targetsScored)
+
+                    failedCount = assignScores(targetsScored)
                     printer(f'\t{failedCount} of {testedCount} failed here.')
 
+                if isslOutput is not None and next(isslOutput, None) is not None:
+                    raise RuntimeError('ISSL output reported more guides than were scored')
+
             #########################################
             ##           Begin output              ##
             #########################################   
@@ -792,8 +1044,6 @@ def Crackling(configMngr):
             configMngr['rnafold']['output'],
             configMngr['offtargetscore']['input'],
             configMngr['offtargetscore']['output'],
-            configMngr['bowtie2']['input'],
-            configMngr['bowtie2']['output'],
         ]:
             try:
                 os.remove(f)
@@ -815,6 +1065,12 @@ def Crackling(configMngr):
         lastRunTimeSec = time.time() - start_time
         totalRunTimeSec += lastRunTimeSec
     
+    if isslClient is not None:
+        isslClient.close()
+
+    if isslCache is not None:
+        isslCache.close()
+
     printer('Total run time (dd hh:mm:ss) {} or {} seconds'.format(
         time.strftime('%d %H:%M:%S', time.gmtime(totalRunTimeSec)), 
         totalRunTimeSec
@@ -1,4 +1,5 @@
-from subprocess import run
+from subprocess import run, Popen, PIPE, CalledProcessError
+from threading import Thread
 from datetime import datetime
 
 # Function that returns the reverse-complement of a given sequence
@@ -25,6 +26,27 @@ def AT_percentage(seq):
     return 100.0*total/length
 
 
+# Function that gives the off-target score of a guide from its MIT and CFD scores,
+# following how `method` is used by ISSL to stop scoring early
+def offtargetScore(mit, cfd, method):
+    if method == 'mit':
+        return mit
+    if method == 'cfd':
+        return cfd
+    if method == 'and':
+        # the guide is rejected only once both scores are below the threshold
+        return max(mit, cfd)
+    if method == 'or':
+        # the guide is rejected once either score is below the threshold
+        return min(mit, cfd)
+    if method == 'avg':
+        # the guide is rejected once the average of the sums of the local MIT
+        # and CFD scores is past that of the threshold, which is once the
+        # harmonic mean of the scores is below the threshold
+        return 2.0 / (1.0 / mit + 1.0 / cfd)
+    raise ValueError(f'Unknown off-target scoring method: {method}')
+
+
 # Function that formats provided text with time stamp
 def printer(stringFormat):
     print('>>> {}:\t{}\n'.format(
@@ -38,3 +60,34 @@ def runner(*args, **kwargs):
     printer(f"| Calling: {args}")
     run(*args, **kwargs)
     printer(f"| Finished")
+
+
+# Function that runs given external call, writing `lines` to its stdin from a separate
+# thread and yielding the lines of its stdout as they are reported
+def streamer(args, lines):
+    printer(f"| Calling: {args}")
+    proc = Popen(args, stdin=PIPE, stdout=PIPE, universal_newlines=True)
+
+    def writeLines():
+        try:
+            for line in lines:
+                proc.stdin.write(line)
+            proc.stdin.close()
+        except BrokenPipeError:
+            # the process has exited early, this is reported below
+            pass
+
+    writer = Thread(target=writeLines, daemon=True)
+    writer.start()
+
+    try:
+        yield from proc.stdout
+    except GeneratorExit:
+        proc.kill()
+        raise
+
+    writer.join()
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise CalledProcessError(proc.returncode, args)
+    printer(f"| Finished")
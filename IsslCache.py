@@ -0,0 +1,161 @@
+'''
+IsslCache
+
+- Keeps the MIT and CFD scores of guides between runs of Crackling, so that a
+  guide scored against the same index, with the same settings, is not scored
+  again
+- The scores are kept in an SQLite database, keyed by a fingerprint of the
+  indexes and the scoring settings, and by the 20-mer of the guide
+- The fingerprint of an index is a hash of its contents, so a rebuilt index
+  is not mistaken for the old one. The hash is remembered against the size and
+  modification time of the file, so an index is only read in full once
+- The scores are stored as reported by the scorer. A daemon, or worker, left
+  running by an earlier run is checked to serve the index it is given before
+  it scores any guide (see IsslClient.py), so its scores are of that index
+- The settings are `max-distance`, `method`, `score-threshold` and the PAM,
+  which the scores depend on, and the scoring mode. The guides that pass, and
+  their scores, are the same in any mode, but a guide that fails exits early
+  at an off-target that depends on how it was scored, and its score with it.
+  The mode is any string that names how the guides are scored, such as the
+  schedule and slice order of the ISSL binary, or the number of workers
+- The cache holds at most `maxEntries` guides. Once full, the guides least
+  recently scored or looked up are evicted. The guides are counted by
+  triggers as they are stored and evicted, so that the cache is not counted
+  in full each time, even when it is shared by concurrent runs
+'''
+
+import hashlib, os, sqlite3, time
+
+from IsslCluster import readIsslShardSet
+
+# The hash of an index is read this many bytes at a time
+FINGERPRINT_BLOCK_BYTES = 1 << 24
+
+# The guides looked up, or stored, per statement
+CACHE_BATCH_SIZE = 500
+
+
+class IsslCache:
+    def __init__(self, path, maxEntries=10000000):
+        self.maxEntries = maxEntries
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS scores (
+                fingerprint TEXT NOT NULL,
+                target TEXT NOT NULL,
+                mit REAL NOT NULL,
+                cfd REAL NOT NULL,
+                used REAL NOT NULL,
+                PRIMARY KEY (fingerprint, target)
+            );
+            CREATE INDEX IF NOT EXISTS scoresUsed ON scores (used);
+            CREATE TABLE IF NOT EXISTS counts (
+                name TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS scoresInserted AFTER INSERT ON scores BEGIN
+                UPDATE counts SET count = count + 1 WHERE name = 'scores';
+            END;
+            CREATE TRIGGER IF NOT EXISTS scoresDeleted AFTER DELETE ON scores BEGIN
+                UPDATE counts SET count = count - 1 WHERE name = 'scores';
+            END;
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            );
+        ''')
+
+        # the guides replaced by `INSERT OR REPLACE` are only counted out by the
+        # delete trigger with recursive triggers enabled
+        self.db.execute('PRAGMA recursive_triggers = ON')
+
+        # a cache created before the guides were counted is counted once
+        if self.db.execute('SELECT count FROM counts WHERE name = ?', ('scores',)).fetchone() is None:
+            self.db.execute('INSERT INTO counts (name, count) SELECT ?, COUNT(*) FROM scores', ('scores',))
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _fileDigest(self, path):
+        '''Returns the hash of the contents of the file `path`'''
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        row = self.db.execute(
+            'SELECT digest FROM files WHERE path = ? AND size = ? AND mtime = ?',
+            (path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(FINGERPRINT_BLOCK_BYTES), b''):
+                digest.update(block)
+
+        self.db.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime, digest) VALUES (?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        )
+        self.db.commit()
+        return digest.hexdigest()
+
+    def fingerprint(self, indexes, maxDist, method, threshold, pam='NGG', scoringMode='queries fixed'):
+        '''Returns the key of the scores against `indexes`, which are scored as
+        one, with these settings, in `scoringMode`. A shard set is
+        fingerprinted by its shards'''
+        digest = hashlib.blake2b(digest_size=20)
+        for index in indexes:
+            for path in readIsslShardSet(index) or [index]:
+                digest.update(self._fileDigest(path).encode())
+        digest.update(f'{int(maxDist)} {method} {float(threshold)} {pam} {scoringMode}'.encode())
+        return digest.hexdigest()
+
+    def lookup(self, fingerprint, targets):
+        '''Returns the (MIT, CFD) scores of each of `targets` that is cached'''
+        targets = list(targets)
+        found = {}
+        for i in range(0, len(targets), CACHE_BATCH_SIZE):
+            batch = targets[i:i + CACHE_BATCH_SIZE]
+            rows = self.db.execute(
+                'SELECT target, mit, cfd FROM scores WHERE fingerprint = ? AND target IN ({})'.format(','.join('?' * len(batch))),
+                [fingerprint] + batch
+            )
+            for target, mit, cfd in rows:
+                found[target] = (mit, cfd)
+
+        # the guides looked up are the last to be evicted
+        now = time.time()
+        self.db.executemany(
+            'UPDATE scores SET used = ? WHERE fingerprint = ? AND target = ?',
+            ((now, fingerprint, target) for target in found)
+        )
+        self.db.commit()
+        return found
+
+    def store(self, fingerprint, scores):
+        '''Caches the (MIT, CFD) scores of each target of `scores`, evicting the
+        least recently used guides beyond `maxEntries`'''
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO scores (fingerprint, target, mit, cfd, used) VALUES (?, ?, ?, ?, ?)',
+            ((fingerprint, target, mit, cfd, now) for target, (mit, cfd) in scores.items())
+        )
+
+        excess = self.db.execute('SELECT count FROM counts WHERE name = ?', ('scores',)).fetchone()[0] - self.maxEntries
+        if excess > 0:
+            self.db.execute(
+                'DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores ORDER BY used LIMIT ?)',
+                (excess,)
+            )
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+        self.db = None
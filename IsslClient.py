@@ -0,0 +1,251 @@
+'''
+IsslClient
+
+- Scores candidate guides using an isslScoreOfftargets daemon
+- The daemon loads the ISSL index once and keeps it resident, so that it can
+  be reused across pages, batches and concurrent runs of Crackling
+- Requests are sent over a Unix domain socket, or to a TCP port given as
+  `host:port`. See isslScoreOfftargets.cpp for the protocol
+- If no daemon is serving the socket, one is started and left running for
+  later runs. To stop it:
+
+    python IsslClient.py --stop <socket>
+
+- A daemon left running may serve another index, or one that has since been
+  rebuilt, so on connecting it is asked which index files it serves (`INFO`),
+  which must be those of the index it was given. A file is recognised by its
+  path, size and modification time or, such as when the daemon runs on
+  another host, by its size and the CRC-32 of its contents. A file that is not
+  on this host is recognised by its name alone
+'''
+
+import argparse, os, socket, subprocess, time, zlib
+
+# The CRC-32 of an index file is calculated this many bytes at a time
+CHECKSUM_BLOCK_BYTES = 1 << 24
+
+
+def indexFiles(indexes):
+    '''Returns the paths of the index files of `indexes`, with each shard set
+    replaced by its shards'''
+    from IsslCluster import readIsslShardSet
+
+    paths = []
+    for index in indexes:
+        paths += readIsslShardSet(index) or [index]
+    return paths
+
+
+def fileCrc32(path):
+    '''Returns the CRC-32 of the contents of the file `path`, as the daemon reports it'''
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_BYTES), b''):
+            crc = zlib.crc32(block, crc)
+    return f'{crc:08x}'
+
+
+def servesIndexes(daemons, indexes):
+    '''Whether the `daemons`, between them, serve each index file of `indexes`
+    once, and no others'''
+    served = [(daemon, info) for daemon in daemons for info in daemon.info()]
+
+    # The files that are unchanged since the daemon loaded them
+    unmatched = []
+    for path in indexFiles(indexes):
+        path = os.path.realpath(path)
+        stat = os.stat(path) if os.path.isfile(path) else None
+        match = next((
+            (daemon, info) for daemon, info in served
+            if stat is not None and info == (path, stat.st_size, stat.st_mtime_ns)
+        ), None)
+        if match is not None:
+            served.remove(match)
+        else:
+            unmatched.append((path, stat))
+
+    if not unmatched or not served:
+        return not unmatched and not served
+
+    # Otherwise, the files served by another path, or on another host
+    checksums = {}
+    for daemon in set(daemon for daemon, _ in served):
+        for path, size, mtimeNs, checksum in daemon.info(checksums=True):
+            checksums[daemon, path] = checksum
+
+    for path, stat in unmatched:
+        if stat is not None:
+            checksum = fileCrc32(path)
+            match = next((
+                (daemon, info) for daemon, info in served
+                if info[1] == stat.st_size and checksums[daemon, info[0]] == checksum
+            ), None)
+        else:
+            match = next((
+                (daemon, info) for daemon, info in served
+                if os.path.basename(info[0]) == os.path.basename(path)
+            ), None)
+        if match is None:
+            return False
+        served.remove(match)
+
+    return not served
+
+
+class IsslClient:
+    def __init__(self, socketPath, binary=None, index=None):
+        self.socketPath = socketPath
+        self.binary = binary
+        self.index = index
+        self.sock = None
+        self.sockFile = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _isTcp(self):
+        return ':' in self.socketPath and '/' not in self.socketPath
+
+    def _tryConnect(self):
+        if self._isTcp():
+            host, port = self.socketPath.rsplit(':', 1)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host or 'localhost', int(port))
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.socketPath
+        try:
+            sock.connect(address)
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            return False
+        self.sock = sock
+        self.sockFile = sock.makefile('rw', newline='\n')
+        return True
+
+    def connect(self, pollIntervalSec=1):
+        if self.sock is not None:
+            return
+
+        if not self._tryConnect():
+            self._startDaemon(pollIntervalSec)
+
+        if self.index is not None and not servesIndexes([self], self.index.split(',')):
+            self.close()
+            raise RuntimeError(
+                f'The ISSL daemon serving {self.socketPath} does not serve {self.index}. '
+                f'To stop it: python IsslClient.py --stop {self.socketPath}'
+            )
+
+    def _startDaemon(self, pollIntervalSec):
+        if self.binary is None or self.index is None:
+            raise ConnectionError(f'No ISSL daemon is serving {self.socketPath}')
+
+        # Start the daemon in its own session so that it outlives this run
+        daemon = subprocess.Popen(
+            [self.binary, '--daemon', self.index, self.socketPath],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+        # Wait for the index to load. An exit code of 2 indicates that another
+        # daemon, started concurrently, is serving the socket instead.
+        while not self._tryConnect():
+            if daemon.poll() not in [None, 2]:
+                raise ConnectionError(f'The ISSL daemon exited with code {daemon.returncode}')
+            time.sleep(pollIntervalSec)
+
+    def _request(self, line):
+        self.sockFile.write(line)
+        self.sockFile.flush()
+
+    def _readStatus(self):
+        status = self.sockFile.readline().rstrip('\n')
+        if not status:
+            raise ConnectionError(f'The ISSL daemon serving {self.socketPath} disconnected')
+        if not status.startswith('OK '):
+            raise RuntimeError(f'The ISSL daemon could not complete the request: {status}')
+        return int(status.split(' ')[1])
+
+    def score(self, targets, maxDist, threshold, method, pam='NGG', threads=0):
+        '''Returns the lines reported by the daemon, one per target, formatted
+        as per the output of isslScoreOfftargets'''
+        self.connect()
+
+        self._request(''.join(
+            [f'SCORE {maxDist} {threshold} {method} {len(targets)} {pam} {threads}\n'] +
+            [f'{target}\n' for target in targets]
+        ))
+
+        count = self._readStatus()
+        return [self.sockFile.readline() for _ in range(count)]
+
+    def info(self, checksums=False):
+        '''Returns the path, size and modification time in nanoseconds of each
+        index file the daemon serves, as when it was loaded, and the CRC-32 of
+        its contents if `checksums`'''
+        self._request('INFO checksums\n' if checksums else 'INFO\n')
+
+        count = self._readStatus()
+        files = []
+        for _ in range(count):
+            fields = self.sockFile.readline().rstrip('\n').split('\t')
+            files.append((fields[0], int(fields[1]), int(fields[2])) + tuple(fields[3:]))
+        return files
+
+    def requestPartialScores(self, targets, maxDist, threshold, method, pam='NGG', threads=0):
+        '''Asks the daemon for the sums of the local scores of each target,
+        without waiting for them, see `readPartialScores`'''
+        self.connect()
+
+        self._request(''.join(
+            [f'PARTIAL {maxDist} {threshold} {method} {len(targets)} {pam} {threads}\n'] +
+            [f'{target}\n' for target in targets]
+        ))
+
+    def readPartialScores(self, targets):
+        '''Returns the sums of the local MIT and CFD scores of each target, as
+        lists, and whether the daemon exited it early, as requested by
+        `requestPartialScores`'''
+        count = self._readStatus()
+        if count != len(targets):
+            raise RuntimeError(f'The ISSL daemon reported {count} of {len(targets)} targets')
+
+        mitSums, cfdSums, exited = [], [], []
+        for target in targets:
+            line = self.sockFile.readline()
+            if not line:
+                raise ConnectionError(f'The ISSL daemon serving {self.socketPath} disconnected')
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4 or fields[0] != target:
+                raise RuntimeError(f'The ISSL daemon did not report {target}')
+            mitSums.append(float(fields[1]))
+            cfdSums.append(float(fields[2]))
+            exited.append(fields[3] == '1')
+        return mitSums, cfdSums, exited
+
+    def stop(self):
+        self.connect()
+        self._request('SHUTDOWN\n')
+        self._readStatus()
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sockFile.close()
+            self.sock.close()
+        self.sock = None
+        self.sockFile = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stop', metavar='socket', required=True, help="Stop the ISSL daemon serving this socket")
+    args = parser.parse_args()
+
+    IsslClient(args.stop).stop()
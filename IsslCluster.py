@@ -0,0 +1,163 @@
+'''
+IsslCluster
+
+- Scores candidate guides using several isslScoreOfftargets daemons, or
+  workers, each of which holds part of the ISSL index, so that no one host
+  needs to hold all of it
+- The index is split by building it as shards (`isslCreateIndex shards`),
+  and giving each worker some of them. See isslIndex.h for the shard set
+- Each page is sent to every worker, which reports the sums of the local
+  scores of its off-targets. The sums are added, and the global scores
+  calculated from them, as a single daemon would. A worker exits a guide
+  early once its own sums cross the threshold, as the sums over every worker
+  can only be larger, so the guides that pass are scored in full
+- A worker that disconnects mid-page, such as when it is restarted, is
+  reconnected and sent the page again. Workers started by the cluster are
+  restarted if they exit
+- Each worker started by the cluster must serve the shards it was given, and
+  the workers that are already running must serve the shards of the index
+  between them, each once (see `servesIndexes`)
+'''
+
+import os, time
+
+from IsslClient import IsslClient, servesIndexes
+
+ISSL_SHARDS_HEADER = 'ISSL shards'
+
+
+def readIsslShardSet(path):
+    '''Returns the paths of the shards of the shard set `path`, or None if it
+    is an index rather than a shard set'''
+    with open(path, 'rb') as f:
+        if f.read(len(ISSL_SHARDS_HEADER)) != ISSL_SHARDS_HEADER.encode():
+            return None
+
+    directory = os.path.dirname(path)
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f.readlines()[1:]]
+    return [
+        os.path.join(directory, line)
+        for line in lines
+        if line and not line.startswith('#')
+    ]
+
+
+def splitIndexes(paths, workers):
+    '''Splits the indexes, and the shards of the shard sets, of `paths` between
+    at most `workers` workers, as evenly as possible. Returns the indexes of
+    each worker, separated by commas, as isslScoreOfftargets takes them'''
+    indexes = []
+    for path in paths:
+        indexes += readIsslShardSet(path) or [path]
+
+    workers = min(workers, len(indexes))
+    return [','.join(indexes[i::workers]) for i in range(workers)]
+
+
+class IsslCluster:
+    def __init__(self, addresses, binary=None, indexes=None, retries=5, retryIntervalSec=1, servedIndexes=None):
+        '''
+        addresses:      the socket path, or `host:port`, of each worker
+        binary:         the ISSL binary, to start any worker that is not running
+        indexes:        the indexes of each worker, see `splitIndexes`, to start it with
+        servedIndexes:  the indexes, or shard sets, that the workers serve between them
+        '''
+        self.workers = [
+            IsslClient(address, binary, None if indexes is None else indexes[i])
+            for i, address in enumerate(addresses)
+        ]
+        self.retries = retries
+        self.retryIntervalSec = retryIntervalSec
+        self.servedIndexes = servedIndexes
+        self.servedChecked = False
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        for worker in self.workers:
+            worker.connect()
+
+        if self.servedIndexes is not None and not self.servedChecked:
+            if not servesIndexes(self.workers, self.servedIndexes):
+                self.close()
+                raise RuntimeError(
+                    'The ISSL workers {} do not serve {} between them'.format(
+                        ' '.join(worker.socketPath for worker in self.workers),
+                        ' '.join(self.servedIndexes)
+                    )
+                )
+            self.servedChecked = True
+
+    def _request(self, worker, args):
+        '''Sends the page to `worker`, reconnecting as needed'''
+        for attempt in range(self.retries + 1):
+            try:
+                worker.requestPartialScores(*args)
+                return
+            except ConnectionError:
+                worker.close()
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retryIntervalSec)
+
+    def _read(self, worker, targets, args):
+        '''Reads the sums of `worker`, sending it the page again if it disconnected'''
+        for attempt in range(self.retries + 1):
+            try:
+                return worker.readPartialScores(targets)
+            except ConnectionError:
+                worker.close()
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retryIntervalSec)
+                self._request(worker, args)
+
+    def partialScores(self, targets, maxDist, threshold, method, pam='NGG', threads=0):
+        '''Returns the sums of the local MIT and CFD scores of each target,
+        over every worker'''
+        args = (targets, maxDist, threshold, method, pam, threads)
+        self.connect()
+
+        # Every worker scores the page at once
+        for worker in self.workers:
+            self._request(worker, args)
+
+        mitSums = [0.0] * len(targets)
+        cfdSums = [0.0] * len(targets)
+        for worker in self.workers:
+            workerMitSums, workerCfdSums, _ = self._read(worker, targets, args)
+            for i in range(len(targets)):
+                mitSums[i] += workerMitSums[i]
+                cfdSums[i] += workerCfdSums[i]
+
+        return mitSums, cfdSums
+
+    def score(self, targets, maxDist, threshold, method, pam='NGG', threads=0):
+        '''Returns a line per target, formatted as per the output of
+        isslScoreOfftargets'''
+        mitSums, cfdSums = self.partialScores(targets, maxDist, threshold, method, pam, threads)
+
+        calcMit = method in ['mit', 'and', 'or', 'avg']
+        calcCfd = method in ['cfd', 'and', 'or', 'avg']
+        return [
+            '{}\t{}\t{}\n'.format(
+                target,
+                f'{10000.0 / (100.0 + mitSum):f}' if calcMit else '-1',
+                f'{10000.0 / (100.0 + cfdSum):f}' if calcCfd else '-1'
+            )
+            for target, mitSum, cfdSum in zip(targets, mitSums, cfdSums)
+        ]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
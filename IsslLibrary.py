@@ -0,0 +1,111 @@
+'''
+IsslLibrary
+
+- Scores candidate guides in-process using the ISSL shared library (libissl.so)
+- Guides are passed to, and scores returned from, the library as NumPy arrays,
+  so that no files are written and no text is parsed
+- Each index is loaded once per process and shared by every IsslLibrary that
+  uses it
+- The GIL is released whilst the library is scoring, so other Python threads
+  can continue. See libissl.cpp for the interface
+'''
+
+import ctypes, os, threading
+import numpy as np
+
+# Nucleotide to 2-bit code, as per the encoding used by ISSL
+NUCLEOTIDE_INDEX = np.zeros(256, dtype=np.uint64)
+for i, nucleotide in enumerate('ACGT'):
+    NUCLEOTIDE_INDEX[ord(nucleotide)] = i
+
+_libraries = {}
+_indexes = {}
+_loadLock = threading.Lock()
+
+
+def _loadLibrary(path):
+    if path not in _libraries:
+        lib = ctypes.CDLL(path)
+
+        lib.issl_load_index.argtypes = [ctypes.c_char_p]
+        lib.issl_load_index.restype = ctypes.c_void_p
+
+        lib.issl_free_index.argtypes = [ctypes.c_void_p]
+        lib.issl_free_index.restype = None
+
+        lib.issl_seq_length.argtypes = [ctypes.c_void_p]
+        lib.issl_seq_length.restype = ctypes.c_size_t
+
+        lib.issl_score.argtypes = [
+            ctypes.c_void_p,
+            np.ctypeslib.ndpointer(dtype=np.uint64, flags='C_CONTIGUOUS'),
+            ctypes.c_size_t,
+            ctypes.c_int,
+            ctypes.c_double,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+            np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS'),
+            np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS'),
+            ctypes.c_int,
+        ]
+        lib.issl_score.restype = ctypes.c_int
+
+        _libraries[path] = lib
+    return _libraries[path]
+
+
+class IsslLibrary:
+    def __init__(self, library, index):
+        library = os.path.abspath(library)
+        index = os.path.abspath(index)
+
+        with _loadLock:
+            self.lib = _loadLibrary(library)
+            if (library, index) not in _indexes:
+                handle = self.lib.issl_load_index(index.encode())
+                if not handle:
+                    raise RuntimeError(f'The ISSL library could not load {index}')
+                _indexes[(library, index)] = handle
+
+        self.handle = _indexes[(library, index)]
+        self.seqLength = self.lib.issl_seq_length(self.handle)
+
+    def encode(self, targets):
+        '''Returns the binary encoded signature of each target, as a uint64 array'''
+        if len(targets) == 0:
+            return np.zeros(0, dtype=np.uint64)
+
+        data = ''.join(targets).encode('ascii')
+        if len(data) != len(targets) * self.seqLength:
+            raise ValueError(f'Every target must be of length {self.seqLength}')
+
+        codes = NUCLEOTIDE_INDEX[np.frombuffer(data, dtype=np.uint8).reshape(-1, self.seqLength)]
+        shifts = np.arange(self.seqLength, dtype=np.uint64) * np.uint64(2)
+        return np.bitwise_or.reduce(codes << shifts, axis=1)
+
+    def score(self, signatures, maxDist, threshold, method, pam='NGG', threads=0):
+        '''Returns the MIT and CFD scores of each signature, as float64 arrays.
+        A score that is not calculated by `method` is -1. Scored using
+        `threads` threads, or all if zero'''
+        signatures = np.ascontiguousarray(signatures, dtype=np.uint64)
+        mitScores = np.empty(len(signatures), dtype=np.float64)
+        cfdScores = np.empty(len(signatures), dtype=np.float64)
+
+        status = self.lib.issl_score(
+            self.handle,
+            signatures,
+            len(signatures),
+            int(maxDist),
+            float(threshold),
+            method.encode(),
+            pam.encode(),
+            mitScores,
+            cfdScores,
+            int(threads)
+        )
+        if status == 2:
+            raise ValueError(f'A max distance of {maxDist} is not less than the slices of the index')
+        if status != 0:
+            raise ValueError(f'Invalid score method or PAM: {method}, {pam}')
+
+        return mitScores, cfdScores
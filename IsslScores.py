@@ -0,0 +1,93 @@
+'''
+IsslScores
+
+- Reads the scores written by isslScoreOfftargets with an output format of
+  float64 or float32
+- The file is memory-mapped and the scores are read as NumPy arrays, in the
+  order of the query file, so that no text is parsed. See
+  isslScoreOfftargets.cpp for the format
+- A file written in chunks, by a streaming scorer, holds a header and the
+  scores of each chunk in turn
+- When several indexes are scored as one, the scores against each index alone
+  follow the combined scores of each chunk
+'''
+
+import numpy as np
+
+ISSL_SCORES_MAGIC = 0x524F43534C535349
+ISSL_SCORES_VERSION = 2
+
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'),
+    ('version', '<u4'),
+    ('scoreBytes', '<u4'),
+    ('queryCount', '<u8'),
+    ('indexCount', '<u8'),
+])
+
+SCORE_DTYPES = {
+    4: np.dtype('<f4'),
+    8: np.dtype('<f8'),
+}
+
+
+def readIsslScores(path, indexScores=False):
+    '''Returns the MIT and CFD scores of each query, as float64 arrays. A score
+    that the score method does not calculate is -1. The scores of each chunk
+    written by a streaming scorer are concatenated.
+
+    With `indexScores`, also returns a list of the MIT and CFD scores against
+    each index alone, which is empty if a single index was scored'''
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(data) < HEADER_DTYPE.itemsize:
+        raise ValueError(f'{path} is too short to hold ISSL scores')
+
+    mitChunks, cfdChunks = [], []
+    indexChunks = None
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < HEADER_DTYPE.itemsize:
+            raise ValueError(f'{path} ends part way through the header of a chunk of ISSL scores')
+
+        header = data[offset:offset + HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != ISSL_SCORES_MAGIC or header['version'] != ISSL_SCORES_VERSION:
+            raise ValueError(f'{path} does not hold ISSL scores of version {ISSL_SCORES_VERSION}')
+        if header['scoreBytes'] not in SCORE_DTYPES:
+            raise ValueError(f'{path} holds scores of an unknown width: {header["scoreBytes"]} bytes')
+
+        indexCount = int(header['indexCount'])
+
+        if indexChunks is None:
+            indexChunks = [([], []) for _ in range(indexCount)]
+        elif len(indexChunks) != indexCount:
+            raise ValueError(f'{path} holds chunks of scores against different numbers of indexes')
+
+        count = int(header['queryCount'])
+        scoreDtype = SCORE_DTYPES[int(header['scoreBytes'])]
+        start = offset + HEADER_DTYPE.itemsize
+        end = start + 2 * (1 + indexCount) * count * scoreDtype.itemsize
+        if end > len(data):
+            raise ValueError(f'{path} does not hold the scores of {count} queries')
+
+        scores = data[start:end].view(scoreDtype)
+        mitChunks.append(scores[:count])
+        cfdChunks.append(scores[count:2 * count])
+        for i, (mitIndexChunks, cfdIndexChunks) in enumerate(indexChunks):
+            setStart = 2 * (1 + i) * count
+            mitIndexChunks.append(scores[setStart:setStart + count])
+            cfdIndexChunks.append(scores[setStart + count:setStart + 2 * count])
+        offset = end
+
+    # Copied, so that the file can be rewritten by the next page
+    mitScores = np.concatenate(mitChunks).astype(np.float64)
+    cfdScores = np.concatenate(cfdChunks).astype(np.float64)
+    if not indexScores:
+        return mitScores, cfdScores
+
+    return mitScores, cfdScores, [
+        (
+            np.concatenate(mitIndexChunks).astype(np.float64),
+            np.concatenate(cfdIndexChunks).astype(np.float64)
+        )
+        for mitIndexChunks, cfdIndexChunks in indexChunks
+    ]
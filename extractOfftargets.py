@@ -115,7 +115,7 @@ def processingNode(fpInputs, fpOutputTempDir = None):
 
                     for i in range(0,len(match_chr)):
                         offtargets.append(
-                            seqModifier(match_chr[i][0:20])
+                            seqModifier(match_chr[i])[0:20]
                         )
 
                 lineNumber += 1
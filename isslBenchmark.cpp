@@ -0,0 +1,550 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Microbenchmarks of the parts of the ISSL scorer.
+
+    mit     Look up the precalculated MIT score of mismatch masks, using the
+            hash map and the dense table. Timed on their own, and within a scan
+            of the slice lists as when scoring.
+
+    scan    Score queries, without exiting early, and report the slice list
+            entries scanned per second. Given a second index of the same
+            off-targets, such as one with another layout, compare the two.
+
+    grouped Score queries each in turn, then grouped by the slice lists they
+            share, and compare the two.
+
+    order   Score queries with each order in which to scan their slices, and
+            report the slice list entries scanned per query.
+
+    simd    Score queries, without exiting early, filtering the slice lists
+            with each kernel that the CPU has (see isslScan.h), and report the
+            slice list entries scanned per second.
+
+
+To compile:
+
+g++ -o isslBenchmark isslBenchmark.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
+
+*/
+
+#include "isslIndex.h"
+#include "isslScoring.h"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <cmath>
+#include <vector>
+#include <string>
+#include <chrono>
+#include <random>
+#include <utility>
+
+using namespace std;
+
+/** Seconds taken by `f` */
+template <class F>
+double timeIt(F f)
+{
+    auto start = chrono::steady_clock::now();
+    f();
+    return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+/**
+ * Off-targets of `index` with up to two random substitutions, so that each has
+ * some off-targets within a few mismatches
+ */
+vector<uint64_t> benchmarkQueries(const IsslIndex &index, size_t queryCount, mt19937_64 &rng)
+{
+    vector<uint64_t> queries(queryCount);
+    uniform_int_distribution<size_t> pickOfftarget(0, index.offtargetsCount - 1);
+    uniform_int_distribution<size_t> pickPosition(0, index.seqLength - 1);
+    for (uint64_t &query : queries) {
+        query = index.offtargets[pickOfftarget(rng)];
+        for (size_t i = rng() % 3; i > 0; i--) {
+            query ^= (uint64_t)(rng() % 4) << (pickPosition(rng) * 2);
+        }
+    }
+    return queries;
+}
+
+/** Look up a precalculated MIT score in the hash map */
+struct HashMapLookup
+{
+    const IsslIndex &index;
+
+    double operator()(uint64_t mask) const
+    {
+        auto precalculatedScore = index.precalculatedScores.find(mask);
+        return precalculatedScore != index.precalculatedScores.end() ? precalculatedScore->second : 0.0;
+    }
+};
+
+/** Look up a precalculated MIT score in the dense table */
+struct DenseTableLookup
+{
+    const MismatchRanking &mitRanking;
+    const double *mitTable;
+
+    double operator()(uint64_t mask) const
+    {
+        return (size_t)__builtin_popcountll(mask) <= mitRanking.maxMismatches ? mitTable[mitRanking.rank(mask)] : 0.0;
+    }
+};
+
+/** Look up `lookups` masks, cycling through `masks` (a power of two in size) */
+template <class Lookup>
+pair<double, double> timeLookups(Lookup lookup, const vector<uint64_t> &masks, size_t lookups)
+{
+    double sum = 0.0;
+    size_t wrap = masks.size() - 1;
+    double sec = timeIt([&]() {
+        for (size_t i = 0; i < lookups; i++) {
+            sum += lookup(masks[i & wrap]);
+        }
+    });
+    return make_pair(sec, sum);
+}
+
+/** Scan the slice lists of each query, looking up the score of each site within `maxDist` */
+template <class Lookup>
+pair<double, double> timeScan(Lookup lookup, const IsslIndex &index, const vector<uint64_t> &queries, int maxDist, size_t &scored)
+{
+    double sum = 0.0;
+    scored = 0;
+    double sec = timeIt([&]() {
+        for (uint64_t query : queries) {
+            for (size_t i = 0; i < index.sliceCount; i++) {
+                index.scanSliceList(i, index.sliceValue(query, i), [&](uint64_t offtarget, uint64_t, uint64_t) {
+                    uint64_t xoredSignatures = query ^ offtarget;
+                    uint64_t mismatches = ((xoredSignatures & 0xAAAAAAAAAAAAAAAAull) >> 1) | (xoredSignatures & 0x5555555555555555ull);
+                    int dist = __builtin_popcountll(mismatches);
+                    if (dist > 0 && dist <= maxDist) {
+                        sum += lookup(mismatches);
+                        scored++;
+                    }
+                    return false;
+                });
+            }
+        }
+    });
+    return make_pair(sec, sum);
+}
+
+/**
+ * Compare the hash map and dense table lookups of the precalculated MIT scores
+ *
+ * The lookups are timed on their own, with masks drawn from those with a score,
+ * and within a scan of the slice lists, as when scoring. The queries for the
+ * scan are off-targets of the index with up to two random substitutions.
+ *
+ * @param[in] index the ISSL index
+ * @param[in] lookups the number of lookups to time on their own
+ * @param[in] queryCount the number of queries to scan for
+ * @param[in] maxDist the maximum number of mismatches
+ */
+int benchmarkMit(const IsslIndex &index, size_t lookups, size_t queryCount, int maxDist)
+{
+    vector<uint64_t> scoredMasks;
+    for (auto const &x : index.precalculatedScores) {
+        scoredMasks.push_back(x.first);
+    }
+    if (scoredMasks.empty() || index.offtargetsCount == 0) {
+        fprintf(stderr, "Error: the index has no precalculated scores\n");
+        return 1;
+    }
+
+    /** The ranks must be unique, and the table must agree with the hash map */
+    const MismatchRanking &mitRanking = index.mitRanking;
+    const double *mitTable = index.mitTable;
+
+    vector<bool> ranked(mitRanking.size());
+    for (uint64_t mask : scoredMasks) {
+        size_t rank = mitRanking.rank(mask);
+        if (!mitRanking.contains(mask) || ranked[rank] || mitTable[rank] != index.precalculatedScores.at(mask)) {
+            fprintf(stderr, "Error: the dense MIT table does not match the hash map\n");
+            return 1;
+        }
+        ranked[rank] = true;
+    }
+
+    mt19937_64 rng(1);
+
+    /** A working set of masks that fits in the cache, looked up repeatedly */
+    vector<uint64_t> masks(65536);
+    uniform_int_distribution<size_t> pickMask(0, scoredMasks.size() - 1);
+    for (uint64_t &mask : masks) {
+        mask = scoredMasks[pickMask(rng)];
+    }
+
+    vector<uint64_t> queries = benchmarkQueries(index, queryCount, rng);
+
+    HashMapLookup hashLookup = {index};
+    DenseTableLookup tableLookup = {mitRanking, mitTable};
+    size_t scored = 0;
+
+    auto hashAlone = timeLookups(hashLookup, masks, lookups);
+    auto tableAlone = timeLookups(tableLookup, masks, lookups);
+    auto hashScan = timeScan(hashLookup, index, queries, maxDist, scored);
+    auto tableScan = timeScan(tableLookup, index, queries, maxDist, scored);
+
+    printf("Masks with a score:  %zu (table of %zu, %zu bytes)\n", scoredMasks.size(), mitRanking.size(), mitRanking.size() * sizeof(double));
+    printf("\nLookups on their own: %zu\n", lookups);
+    printf("  Hash map:          %.2f ns per lookup\n", hashAlone.first * 1e9 / lookups);
+    printf("  Dense table:       %.2f ns per lookup\n", tableAlone.first * 1e9 / lookups);
+    printf("  Speed-up:          %.2fx\n", hashAlone.first / tableAlone.first);
+    printf("\nLookups within a scan of %zu queries: %zu\n", queryCount, scored);
+    printf("  Hash map:          %.3f s\n", hashScan.first);
+    printf("  Dense table:       %.3f s\n", tableScan.first);
+    printf("  Speed-up:          %.2fx\n", hashScan.first / tableScan.first);
+
+    if (hashAlone.second != tableAlone.second || hashScan.second != tableScan.second) {
+        fprintf(stderr, "Error: the hash map and dense table scores differ\n");
+        return 1;
+    }
+    return 0;
+}
+
+/**
+ * Time scoring queries against each index, without exiting early, so that
+ * every entry of the slice lists of each query is scanned
+ *
+ * @param[in] indexes the indexes to compare, of the same off-targets
+ * @param[in] queryCount the number of queries to score
+ * @param[in] maxDist the maximum number of mismatches
+ */
+int benchmarkScan(const vector<const IsslIndex *> &indexes, size_t queryCount, int maxDist)
+{
+    const IsslIndex &index = *indexes[0];
+    if (index.offtargetsCount == 0) {
+        fprintf(stderr, "Error: the index has no off-targets\n");
+        return 1;
+    }
+
+    mt19937_64 rng(1);
+    vector<uint64_t> queries = benchmarkQueries(index, queryCount, rng);
+
+    /** Every entry of the slice lists of a query is scanned */
+    size_t entries = 0;
+    for (uint64_t query : queries) {
+        for (size_t i = 0; i < index.sliceCount; i++) {
+            entries += index.sliceListSize(i, index.sliceValue(query, i));
+        }
+    }
+
+    printf("Queries:             %zu\n", queryCount);
+    printf("Entries scanned:     %zu\n", entries);
+    printf("Threads:             %d\n", omp_get_max_threads());
+
+    const char *layoutNames[] = {"standard", "inline", "compact"};
+    vector<double> firstMitScores, firstCfdScores;
+    double firstSec = 0.0;
+    for (size_t n = 0; n < indexes.size(); n++) {
+        vector<double> mitScores, cfdScores;
+
+        /** A threshold of zero never exits early */
+        double sec = timeIt([&]() {
+            scoreQueries(*indexes[n], queries, maxDist, 0.0, "and", cfdPamPenalties[0b1010], mitScores, cfdScores);
+        });
+
+        printf("\n%s layout (index %zu)\n", indexes[n]->layout < 3 ? layoutNames[indexes[n]->layout] : "unknown", n + 1);
+        if (indexes[n]->mapped != nullptr) {
+            printf("  Size:               %.1f MB\n", indexes[n]->mappedSize / 1e6);
+        }
+        printf("  Time:               %.3f s\n", sec);
+        printf("  Entries per second: %.3g\n", entries / sec);
+
+        if (n == 0) {
+            firstMitScores = mitScores;
+            firstCfdScores = cfdScores;
+            firstSec = sec;
+        }
+        else {
+            printf("  Speed-up:           %.2fx\n", firstSec / sec);
+            if (mitScores != firstMitScores || cfdScores != firstCfdScores) {
+                fprintf(stderr, "Error: the scores of index %zu differ from index 1\n", n + 1);
+                return 1;
+            }
+        }
+    }
+
+    return 0;
+}
+
+/**
+ * Time scoring queries each in turn, and grouped by the slice lists they share
+ *
+ * @param[in] index the ISSL index
+ * @param[in] queryCount the number of queries to score
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ */
+int benchmarkGrouped(const IsslIndex &index, size_t queryCount, int maxDist, double threshold, const string &scoreMethod)
+{
+    if (index.offtargetsCount == 0) {
+        fprintf(stderr, "Error: the index has no off-targets\n");
+        return 1;
+    }
+
+    mt19937_64 rng(1);
+    vector<uint64_t> queries = benchmarkQueries(index, queryCount, rng);
+
+    vector<double> mitScores, cfdScores, groupedMitScores, groupedCfdScores;
+    double sec = timeIt([&]() {
+        scoreQueries(index, queries, maxDist, threshold, scoreMethod, cfdPamPenalties[0b1010], mitScores, cfdScores);
+    });
+    double groupedSec = timeIt([&]() {
+        scoreQueriesGrouped(index, queries, maxDist, threshold, scoreMethod, cfdPamPenalties[0b1010], groupedMitScores, groupedCfdScores);
+    });
+
+    printf("Queries:             %zu (%.1f per slice list)\n", queryCount, (double)queryCount / index.sliceLimit);
+    printf("Threads:             %d\n", omp_get_max_threads());
+    printf("  Each in turn:      %.3f s\n", sec);
+    printf("  Grouped:           %.3f s\n", groupedSec);
+    printf("  Speed-up:          %.2fx\n", sec / groupedSec);
+
+    if (mitScores != groupedMitScores || cfdScores != groupedCfdScores) {
+        fprintf(stderr, "Error: the grouped scores differ\n");
+        return 1;
+    }
+    return 0;
+}
+
+/**
+ * Time scoring queries with each slice order, see `sliceVisitOrder`
+ *
+ * The queries that pass must score the same whatever the order, those that
+ * do not may exit early at another off-target.
+ *
+ * @param[in] index the ISSL index
+ * @param[in] queries the binary encoded queries
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ */
+int benchmarkOrder(const IsslIndex &index, const vector<uint64_t> &queries, int maxDist, double threshold, const string &scoreMethod)
+{
+    const OfftargetScorer scorer(index, maxDist, threshold, scoreMethod, cfdPamPenalties[0b1010]);
+    const char *orderNames[] = {"fixed", "largest", "sampled"};
+
+    printf("Queries:             %zu\n", queries.size());
+    printf("Threads:             %d\n", omp_get_max_threads());
+
+    vector<double> fixedMitScores, fixedCfdScores;
+    for (int sliceOrder = SLICE_ORDER_FIXED; sliceOrder <= SLICE_ORDER_SAMPLED; sliceOrder++) {
+        vector<double> mitScores, cfdScores;
+        ScoringStats stats;
+        double sec = timeIt([&]() {
+            scoreQueries(index, queries, maxDist, threshold, scoreMethod, cfdPamPenalties[0b1010], mitScores, cfdScores, 0, &stats, (SliceOrder)sliceOrder);
+        });
+
+        size_t exited = 0;
+        for (size_t i = 0; i < queries.size(); i++) {
+            exited += scorer.canExitEarly(10000.0 / mitScores[i] - 100.0, 10000.0 / cfdScores[i] - 100.0);
+        }
+
+        printf("\n%s order\n", orderNames[sliceOrder]);
+        printf("  Time:               %.3f s\n", sec);
+        printf("  Entries per query:  %.1f\n", (double)stats.entriesScanned / queries.size());
+        printf("  Exited early:       %zu\n", exited);
+
+        if (sliceOrder == SLICE_ORDER_FIXED) {
+            fixedMitScores = mitScores;
+            fixedCfdScores = cfdScores;
+            continue;
+        }
+
+        /** Scores are summed in another order, they may differ in the last place */
+        for (size_t i = 0; i < queries.size(); i++) {
+            bool fixedExited = scorer.canExitEarly(10000.0 / fixedMitScores[i] - 100.0, 10000.0 / fixedCfdScores[i] - 100.0);
+            bool orderExited = scorer.canExitEarly(10000.0 / mitScores[i] - 100.0, 10000.0 / cfdScores[i] - 100.0);
+            if (fixedExited != orderExited ||
+                (!fixedExited && (fabs(mitScores[i] - fixedMitScores[i]) > 1e-9 * fixedMitScores[i] || fabs(cfdScores[i] - fixedCfdScores[i]) > 1e-9 * fixedCfdScores[i]))
+            ) {
+                fprintf(stderr, "Error: query %zu scores differently with the %s order\n", i, orderNames[sliceOrder]);
+                return 1;
+            }
+        }
+    }
+
+    return 0;
+}
+
+/**
+ * Time scoring queries, without exiting early, with each kernel that the CPU has
+ *
+ * @param[in] index the ISSL index
+ * @param[in] queryCount the number of queries to score
+ * @param[in] maxDist the maximum number of mismatches
+ */
+int benchmarkSimd(const IsslIndex &index, size_t queryCount, int maxDist)
+{
+    if (index.offtargetsCount == 0) {
+        fprintf(stderr, "Error: the index has no off-targets\n");
+        return 1;
+    }
+
+    mt19937_64 rng(1);
+    vector<uint64_t> queries = benchmarkQueries(index, queryCount, rng);
+
+    size_t entries = 0;
+    for (uint64_t query : queries) {
+        for (size_t i = 0; i < index.sliceCount; i++) {
+            entries += index.sliceListSize(i, index.sliceValue(query, i));
+        }
+    }
+
+    const char *layoutNames[] = {"standard", "inline", "compact"};
+    printf("Layout:              %s\n", index.layout < 3 ? layoutNames[index.layout] : "unknown");
+    printf("Queries:             %zu\n", queryCount);
+    printf("Entries scanned:     %zu\n", entries);
+    printf("Threads:             %d\n", omp_get_max_threads());
+    printf("Default kernel:      %s\n", scanKernelNames[scanKernel()]);
+
+    ScanKernel defaultKernel = scanKernel();
+    vector<double> scalarMitScores, scalarCfdScores;
+    double scalarSec = 0.0;
+    for (int kernel = SCAN_KERNEL_SCALAR; kernel < SCAN_KERNEL_COUNT; kernel++) {
+        if (!scanKernelSupported((ScanKernel)kernel)) {
+            printf("\n%s kernel is not supported by this CPU\n", scanKernelNames[kernel]);
+            continue;
+        }
+
+        vector<double> mitScores, cfdScores;
+        scanKernel() = (ScanKernel)kernel;
+
+        /** A threshold of zero never exits early */
+        double sec = timeIt([&]() {
+            scoreQueries(index, queries, maxDist, 0.0, "and", cfdPamPenalties[0b1010], mitScores, cfdScores);
+        });
+
+        printf("\n%s kernel\n", scanKernelNames[kernel]);
+        printf("  Time:               %.3f s\n", sec);
+        printf("  Entries per second: %.3g\n", entries / sec);
+
+        if (kernel == SCAN_KERNEL_SCALAR) {
+            scalarMitScores = mitScores;
+            scalarCfdScores = cfdScores;
+            scalarSec = sec;
+        }
+        else {
+            printf("  Speed-up:           %.2fx\n", scalarSec / sec);
+            if (mitScores != scalarMitScores || cfdScores != scalarCfdScores) {
+                fprintf(stderr, "Error: the scores of the %s kernel differ from the scalar kernel\n", scanKernelNames[kernel]);
+                return 1;
+            }
+        }
+    }
+    scanKernel() = defaultKernel;
+
+    return 0;
+}
+
+int main(int argc, char **argv)
+{
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s mit [issltable] [lookups] [queries] [max distance]\n", argv[0]);
+        fprintf(stderr, "       %s scan [issltable] [queries] [max distance] [issltable to compare]\n", argv[0]);
+        fprintf(stderr, "       %s grouped [issltable] [queries] [max distance] [score-threshold] [score-method]\n", argv[0]);
+        fprintf(stderr, "       %s order [issltable] [queries or query file] [max distance] [score-threshold] [score-method]\n", argv[0]);
+        fprintf(stderr, "       %s simd [issltable] [queries] [max distance]\n", argv[0]);
+        exit(1);
+    }
+
+    IsslIndex index;
+    if (!loadIsslIndex(argv[2], index)) {
+        return 1;
+    }
+
+    if (!strcmp(argv[1], "mit")) {
+        size_t lookups = argc > 3 ? strtoull(argv[3], NULL, 10) : 50000000;
+        size_t queryCount = argc > 4 ? strtoull(argv[4], NULL, 10) : 10000;
+        int maxDist = argc > 5 ? atoi(argv[5]) : 4;
+        return benchmarkMit(index, lookups, queryCount, maxDist);
+    }
+
+    if (!strcmp(argv[1], "scan")) {
+        size_t queryCount = argc > 3 ? strtoull(argv[3], NULL, 10) : 10000;
+        int maxDist = argc > 4 ? atoi(argv[4]) : 4;
+
+        vector<const IsslIndex *> indexes;
+        indexes.push_back(&index);
+
+        IsslIndex otherIndex;
+        if (argc > 5) {
+            if (!loadIsslIndex(argv[5], otherIndex)) {
+                return 1;
+            }
+            if (otherIndex.offtargetsCount != index.offtargetsCount || otherIndex.seqLength != index.seqLength) {
+                fprintf(stderr, "Error: %s is not an index of the same off-targets\n", argv[5]);
+                return 1;
+            }
+            indexes.push_back(&otherIndex);
+        }
+
+        return benchmarkScan(indexes, queryCount, maxDist);
+    }
+
+    if (!strcmp(argv[1], "simd")) {
+        size_t queryCount = argc > 3 ? strtoull(argv[3], NULL, 10) : 10000;
+        int maxDist = argc > 4 ? atoi(argv[4]) : 4;
+        return benchmarkSimd(index, queryCount, maxDist);
+    }
+
+    if (!strcmp(argv[1], "grouped")) {
+        size_t queryCount = argc > 3 ? strtoull(argv[3], NULL, 10) : 100000;
+        int maxDist = argc > 4 ? atoi(argv[4]) : 4;
+        double threshold = argc > 5 ? atof(argv[5]) : 75;
+        string scoreMethod = argc > 6 ? argv[6] : "and";
+        if (!isScoreMethod(scoreMethod)) {
+            fprintf(stderr, "Unknown score method: %s\n", scoreMethod.c_str());
+            return 1;
+        }
+        return benchmarkGrouped(index, queryCount, maxDist, threshold, scoreMethod);
+    }
+
+    if (!strcmp(argv[1], "order")) {
+        int maxDist = argc > 4 ? atoi(argv[4]) : 4;
+        double threshold = argc > 5 ? atof(argv[5]) : 75;
+        string scoreMethod = argc > 6 ? argv[6] : "and";
+        if (!isScoreMethod(scoreMethod)) {
+            fprintf(stderr, "Unknown score method: %s\n", scoreMethod.c_str());
+            return 1;
+        }
+
+        /** The queries are read from a file of guides, one per line, or generated */
+        vector<uint64_t> queries;
+        FILE *fp = argc > 3 ? fopen(argv[3], "r") : NULL;
+        if (fp != NULL) {
+            SignatureEncoding encoding;
+            char line[256];
+            while (fgets(line, sizeof(line), fp) != NULL) {
+                if (strcspn(line, "\r\n") == index.seqLength) {
+                    queries.push_back(encoding.sequenceToSignature(line, index.seqLength));
+                }
+            }
+            fclose(fp);
+        }
+        else {
+            mt19937_64 rng(1);
+            queries = benchmarkQueries(index, argc > 3 ? strtoull(argv[3], NULL, 10) : 10000, rng);
+        }
+
+        if (queries.empty()) {
+            fprintf(stderr, "Error: there are no queries\n");
+            return 1;
+        }
+        return benchmarkOrder(index, queries, maxDist, threshold, scoreMethod);
+    }
+
+    fprintf(stderr, "Unknown benchmark: %s\n", argv[1]);
+    return 1;
+}
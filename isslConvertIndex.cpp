@@ -0,0 +1,68 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Convert an ISSL index written by an earlier version of isslCreateIndex
+(version 1) to version 2, which the scorer memory-maps and uses in place.
+Alternatively, convert an index from one layout of its slice contents to
+another (see isslIndex.h), or add a neighbour table to it.
+
+
+To compile:
+
+g++ -o isslConvertIndex isslConvertIndex.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
+
+*/
+
+#include "isslIndex.h"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+
+int main(int argc, char **argv)
+{
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s [issltable] [version 2 issltable] [layout (standard, inline or compact)] [neighbours]\n", argv[0]);
+        exit(1);
+    }
+
+    uint64_t layout = ISSL_LAYOUT_STANDARD;
+    if (argc > 3 && !parseIsslLayout(argv[3], layout)) {
+        fprintf(stderr, "Unknown layout: %s\n", argv[3]);
+        exit(1);
+    }
+    bool neighbours = false;
+    if (argc > 4) {
+        if (strcmp(argv[4], "neighbours")) {
+            fprintf(stderr, "Unknown option: %s\n", argv[4]);
+            exit(1);
+        }
+        neighbours = true;
+    }
+
+    IsslIndex index;
+    if (!loadIsslIndex(argv[1], index)) {
+        return 1;
+    }
+
+    /** A neighbour table is kept */
+    neighbours = neighbours || index.neighbours != nullptr;
+
+    if (index.header != nullptr && index.layout == layout && (index.neighbours != nullptr) == neighbours) {
+        fprintf(stderr, "%s is already a version %lu index with this layout\n", argv[1], (unsigned long)index.header->version);
+        return 1;
+    }
+
+    printf("Loaded %zu off-targets, now writing version 2 index...\n", index.offtargetsCount);
+
+    if (!writeIsslIndex(argv[2], index, layout, neighbours)) {
+        return 1;
+    }
+
+    printf("Done.\n");
+    return 0;
+}
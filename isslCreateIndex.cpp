@@ -7,10 +7,11 @@ bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
 
 To compile:
 
-g++ -o isslCreateIndex isslCreateIndex.cpp -O3 -std=c++11 -fopenmp -mpopcnt
+g++ -o isslCreateIndex isslCreateIndex.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
 
 */
 
+#include "isslIndex.h"
 
 #include <cstdio>
 #include <cstdlib>
@@ -21,7 +22,8 @@ g++ -o isslCreateIndex isslCreateIndex.cpp -O3 -std=c++11 -fopenmp -mpopcnt
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <unistd.h>
-#include <map>
+#include <algorithm>
+#include <omp.h>
 
 using namespace std;
 
@@ -29,13 +31,6 @@ size_t seqLength;
 vector<uint8_t> nucleotideIndex(256);
 vector<char> signatureIndex(4);
 
-size_t getFileSize(const char *path)
-{
-    struct stat64 statBuf;
-    stat64(path, &statBuf);
-    return statBuf.st_size;
-}
-
 uint64_t sequenceToSignature(const char *ptr)
 {
     uint64_t signature = 0;
@@ -129,18 +124,20 @@ double sscore(uint64_t xoredSignatures)
     return single_score(mismatch_array, m);
 }
 
-int main(int argc, char **argv)
+/**
+ * Read the sorted off-targets of `path`, each distinct off-target once
+ *
+ * @param[out] seqSignatures the binary encoded off-targets
+ * @param[out] seqSignaturesOccurrences the occurrences of each
+ * @return the number of off-target sites, including repeats
+ */
+size_t readOfftargets(const char *path, vector<uint64_t> &seqSignatures, vector<uint32_t> &seqSignaturesOccurrences)
 {
-    if (argc < 5) {
-        fprintf(stderr, "Usage: %s [offtargetSites.txt] [sequence length] [slice width (bits)] [sissltable]\n", argv[0]);
-        exit(1);
-    }
-    size_t fileSize = getFileSize(argv[1]);
+    size_t fileSize = getFileSize(path);
     
-    FILE *fp = fopen(argv[1], "rb");
-    seqLength = atoi(argv[2]);
-    if (seqLength > 32) {
-        fprintf(stderr, "Sequence length is greater than 32, which is the maximum supported currently\n");
+    FILE *fp = fopen(path, "rb");
+    if (fp == NULL) {
+        fprintf(stderr, "Failed to open %s\n", path);
         exit(1);
     }
     size_t seqLineLength = seqLength + 1; // '\n'
@@ -154,141 +151,314 @@ int main(int argc, char **argv)
     size_t seqCount = fileSize / seqLineLength;
     fprintf(stderr, "Number of sequences: %zu\n", seqCount);
     
-    
-    nucleotideIndex['A'] = 0;
-    nucleotideIndex['C'] = 1;
-    nucleotideIndex['G'] = 2;
-    nucleotideIndex['T'] = 3;
-    signatureIndex[0] = 'A';
-    signatureIndex[1] = 'C';
-    signatureIndex[2] = 'G';
-    signatureIndex[3] = 'T';
-    
-    size_t globalCount = 0;
-    
-    vector<uint64_t> seqSignatures;
-    vector<uint32_t> seqSignaturesOccurrences;
-    
-	size_t myCount = 0;
-    {
-        vector<char> entireDataSet(fileSize);
+    vector<char> entireDataSet(fileSize);
 
-        if (fread(entireDataSet.data(), fileSize, 1, fp) < 1) {
-            fprintf(stderr, "Failed to read in file.\n");
-            exit(1);
+    if (fileSize > 0 && fread(entireDataSet.data(), fileSize, 1, fp) < 1) {
+        fprintf(stderr, "Failed to read in file.\n");
+        exit(1);
+    }
+    fclose(fp);
+
+    // an off-target begins at each line that differs from the line before it
+    // (assumed the list is sorted), each thread finds those of a run of lines
+    auto isFirst = [&](size_t i) {
+        return i == 0 || memcmp(&entireDataSet[i * seqLineLength], &entireDataSet[(i - 1) * seqLineLength], seqLength) != 0;
+    };
+    int threads = omp_get_max_threads();
+    size_t chunk = (seqCount + threads - 1) / threads;
+    vector<size_t> threadFirsts(threads + 1, 0);
+
+    #pragma omp parallel for num_threads(threads)
+    for (int t = 0; t < threads; t++) {
+        for (size_t i = t * chunk; i < min(seqCount, (t + 1) * chunk); i++) {
+            threadFirsts[t + 1] += isFirst(i);
         }
-        fclose(fp);
-
-		size_t i = 0;
-		size_t offtargetId = 0;
-		while (i < seqCount) {
-			char *ptr = &entireDataSet[i * seqLineLength];
-			
-			uint64_t signature = sequenceToSignature(ptr);
-
-			// check how many times the off-target appears
-			// (assumed the list is sorted)
-			uint32_t occurrences = 1;
-			while (memcmp(ptr, ptr + (seqLineLength * occurrences), seqLength) == 0) {
-				occurrences++;
-			}
+    }
+    for (int t = 0; t < threads; t++) {
+        threadFirsts[t + 1] += threadFirsts[t];
+    }
+    size_t offtargetsCount = threadFirsts[threads];
+    fprintf(stderr, "Number of distinct sequences: %zu\n", offtargetsCount);
 
-			seqSignatures.push_back(signature);
-			seqSignaturesOccurrences.push_back(occurrences);
-			
-			myCount++;
-			if (myCount % 10000 == 0) {
-				fprintf(stderr, "%zu/%zu : %zu\n", myCount, seqCount, i);
-			}
-			
-			i += occurrences;
-		}
-    
+    // the first line of each off-target, until it is encoded
+    seqSignatures.resize(offtargetsCount);
+    seqSignaturesOccurrences.resize(offtargetsCount);
+
+    #pragma omp parallel for num_threads(threads)
+    for (int t = 0; t < threads; t++) {
+        size_t signatureId = threadFirsts[t];
+        for (size_t i = t * chunk; i < min(seqCount, (t + 1) * chunk); i++) {
+            if (isFirst(i)) {
+                seqSignatures[signatureId++] = i;
+            }
+        }
     }
-	printf("Finished counting occurrences, now constructing index...\n");
-    size_t sliceWidth = atoi(argv[3]);
-    size_t sliceLimit = 1 << sliceWidth;
-    size_t sliceCount = (seqLength * 2) / sliceWidth;
-    size_t offtargetsCount = myCount;
-	
-    vector<vector<vector<uint64_t>>> sliceLists(sliceCount, vector<vector<uint64_t>>(sliceLimit));
-    
+
+    // the occurrences of each off-target are the lines before the next begins
     #pragma omp parallel for
-    for (size_t i = 0; i < sliceCount; i++) {
-        uint64_t sliceMask = sliceLimit - 1;
-        int sliceShift = sliceWidth * i;
-        sliceMask = sliceMask << sliceShift;
-        auto &sliceList = sliceLists[i];
-        
-		uint32_t signatureId = 0;
-        for (uint64_t signature : seqSignatures) {
-			uint32_t occurrences = seqSignaturesOccurrences[signatureId];
-            uint8_t sliceVal = (signature & sliceMask) >> sliceShift;
-			
-			uint64_t seqSigIdVal = (((uint64_t)occurrences) << 32) | (uint64_t)signatureId;
-			sliceList[sliceVal].push_back(seqSigIdVal);
-			signatureId++;
-        }
+    for (size_t signatureId = 0; signatureId < offtargetsCount; signatureId++) {
+        size_t next = signatureId + 1 < offtargetsCount ? seqSignatures[signatureId + 1] : seqCount;
+        seqSignaturesOccurrences[signatureId] = next - seqSignatures[signatureId];
+    }
+
+    #pragma omp parallel for
+    for (size_t signatureId = 0; signatureId < offtargetsCount; signatureId++) {
+        seqSignatures[signatureId] = sequenceToSignature(&entireDataSet[seqSignatures[signatureId] * seqLineLength]);
     }
+
+    return seqCount;
+}
+
+/**
+ * Write the index of the off-targets `seqSignatures`, of `seqCount` sites including repeats, to `path`
+ */
+void writeIndex(
+    const char *path,
+    const vector<uint64_t> &seqSignatures,
+    const vector<uint32_t> &seqSignaturesOccurrences,
+    size_t seqCount,
+    size_t sliceWidth,
+    const vector<uint64_t> &sliceMasks,
+    uint64_t layout,
+    bool neighbours
+) {
+	printf("Finished counting occurrences, now constructing index...\n");
+    size_t sliceCount = sliceMasks.size();
+    size_t offtargetsCount = seqSignatures.size();
+
+    // the slice lists of every slice, one after another, and where each begins
+    vector<uint64_t> sliceListOffsets, seqSigIdVals;
+    sortIntoSliceLists(
+        offtargetsCount,
+        sliceMasks,
+        [&](size_t signatureId) { return seqSignatures[signatureId]; },
+        [&](size_t signatureId) { return (((uint64_t)seqSignaturesOccurrences[signatureId]) << 32) | (uint64_t)signatureId; },
+        sliceListOffsets,
+        seqSigIdVals
+    );
     
 	printf("Finished constructing index, now precalculating scores...\n");
 	
-	// Precalculate all the scores
-	map<uint64_t, double> precalculatedScores;
-	
-	int maxDist = seqLength * 2 / sliceWidth - 1;
-	size_t scoresCount = 0;
+	// an off-target within this many mismatches matches the query in at least one slice
+	int maxDist = sliceCount - 1;
+	printf("The index can be scored at a max distance of up to %d\n", maxDist);
 	
+	// the MIT score is defined over the first 20 positions at most
+	vector<uint64_t> masks;
 	for (int i = 1; i <= maxDist; i++) {
-		vector<uint64_t> tempMasks;
-		tempMasks = computeMasksTwoBit(20, i);
-		for (auto mask : tempMasks) {
-			double score = sscore(mask);
-			precalculatedScores.insert(pair<uint64_t, double>(mask, score));
-			scoresCount++;
+		for (auto mask : computeMasksTwoBit(min(seqLength, (size_t)20), i)) {
+			masks.push_back(mask);
 		}
 	}
+
+	// Precalculate all the scores
+	vector<double> scores(masks.size());
+	#pragma omp parallel for
+	for (size_t j = 0; j < masks.size(); j++) {
+		scores[j] = sscore(masks[j]);
+	}
+	phmap::flat_hash_map<uint64_t, double> precalculatedScores;
+	for (size_t j = 0; j < masks.size(); j++) {
+		precalculatedScores[masks[j]] = scores[j];
+	}
 	
 	printf("Finished calculating scores, now preparing to write to disk...\n");
 	
-    fp = fopen(argv[4], "wb");
-    vector<size_t> slicelistHeader;
-    slicelistHeader.push_back(offtargetsCount);
-    slicelistHeader.push_back(seqLength);
-    slicelistHeader.push_back(seqCount);
-    slicelistHeader.push_back(sliceWidth);
-    slicelistHeader.push_back(sliceCount);
-    slicelistHeader.push_back(scoresCount);
-	
-	
-	// write the header
-    fwrite(slicelistHeader.data(), sizeof(size_t), slicelistHeader.size(), fp);
+	// write the index, as version 2, so that it can be memory-mapped by the scorer
+	IsslIndexWriter writer(path);
+	writer.header.offtargetsCount = offtargetsCount;
+	writer.header.seqLength = seqLength;
+	writer.header.seqCount = seqCount;
 
-	// write the precalculated scores
-	for (auto const& x : precalculatedScores) {
-		fwrite(&x.first, sizeof(uint64_t), 1, fp);
-		fwrite(&x.second, sizeof(double), 1, fp);
-	}
+	// write the precalculated scores, the masks then their scores (sorted by mask)
+	writeIsslScores(writer, precalculatedScores);
+
+	// write the precalculated scores as a dense table, indexed by the rank of the mask
+	MismatchRanking mitRanking;
+	mitRanking.init(seqLength, maxDist);
+	writeIsslMitTable(writer, mitRanking, buildMitTable(mitRanking, precalculatedScores));
+
+	// write the slices, as their width or, if given by position, their masks
+	writeIsslSliceMasks(writer, sliceWidth, sliceMasks);
 
 	// write the offtargets
-	fwrite(seqSignatures.data(), sizeof(uint64_t), seqSignatures.size(), fp);
-	
-    for (size_t i = 0; i < sliceCount; i++) { // 5
-        for (size_t j = 0; j < sliceLimit; j++) { // 256
-            size_t sz = sliceLists[i][j].size(); 
-            fwrite(&sz, sizeof(size_t), 1, fp);
+	writer.writeSection(ISSL_SECTION_OFFTARGETS, seqSignatures.data(), sizeof(uint64_t) * seqSignatures.size());
+
+	// write where each slice list begins, and where the last ends
+	writer.writeSection(ISSL_SECTION_SLICE_OFFSETS, sliceListOffsets.data(), sizeof(uint64_t) * sliceListOffsets.size());
+
+	// write the slice contents, in the requested layout
+	IsslSliceContentsWriter contents(writer, layout, seqLength);
+	for (size_t idx = 0; idx + 1 < sliceListOffsets.size(); idx++) {
+		for (size_t j = sliceListOffsets[idx]; j < sliceListOffsets[idx + 1]; j++) {
+			uint64_t signatureId = seqSigIdVals[j] & 0xFFFFFFFFull;
+			contents.write(seqSignatures[signatureId], seqSigIdVals[j] >> 32, signatureId);
+		}
+		contents.endSliceList();
+	}
+	contents.finish();
+
+	// write the off-targets hashed by signature, to look up those within one mismatch of a query
+	if (neighbours) {
+		NeighbourTable table(offtargetsCount);
+		for (size_t signatureId = 0; signatureId < offtargetsCount; signatureId++) {
+			table.insert(seqSignatures[signatureId], seqSignaturesOccurrences[signatureId]);
+		}
+		writeIsslNeighbours(writer, table);
+	}
+
+	printf("Writing to disk...\n");
+    
+    if (!writer.finish()) {
+        exit(1);
+    }
+}
+
+/**
+ * Write each of `paths`, or each part of at most `shardSize` off-targets, as a
+ * shard of the shard set `shardSetPath`. If the shard set exists, the shards
+ * are added to it.
+ */
+void writeShards(
+    const vector<string> &paths,
+    const char *shardSetPath,
+    size_t shardSize,
+    size_t sliceWidth,
+    const vector<uint64_t> &sliceMasks,
+    uint64_t layout,
+    bool neighbours
+) {
+    bool append = false;
+    if (access(shardSetPath, F_OK) == 0) {
+        if (!isIsslShardSet(shardSetPath)) {
+            fprintf(stderr, "Error: %s exists and is not a shard set\n", shardSetPath);
+            exit(1);
+        }
+        append = true;
+    }
+
+    /** The shards are named after the shard set, and listed relative to it */
+    string shardSetName(shardSetPath);
+    size_t slash = shardSetName.rfind('/');
+    string shardSetDirectory = slash == string::npos ? "" : shardSetName.substr(0, slash + 1);
+    shardSetName = slash == string::npos ? shardSetName : shardSetName.substr(slash + 1);
+
+    vector<string> shardNames;
+    size_t shardNumber = 0;
+    vector<uint64_t> seqSignatures, shardSignatures;
+    vector<uint32_t> seqSignaturesOccurrences, shardOccurrences;
+    for (const string &path : paths) {
+        readOfftargets(path.c_str(), seqSignatures, seqSignaturesOccurrences);
+
+        size_t partSize = shardSize > 0 ? shardSize : max(seqSignatures.size(), (size_t)1);
+        for (size_t begin = 0; begin < seqSignatures.size() || begin == 0; begin += partSize) {
+            size_t end = min(begin + partSize, seqSignatures.size());
+            shardSignatures.assign(seqSignatures.begin() + begin, seqSignatures.begin() + end);
+            shardOccurrences.assign(seqSignaturesOccurrences.begin() + begin, seqSignaturesOccurrences.begin() + end);
+            size_t shardSeqCount = 0;
+            for (uint32_t occurrences : shardOccurrences) {
+                shardSeqCount += occurrences;
+            }
+
+            /** A shard added to an existing set does not replace one of its shards */
+            string shardName;
+            do {
+                shardName = shardSetName + "." + to_string(shardNumber++);
+            } while (access((shardSetDirectory + shardName).c_str(), F_OK) == 0);
+
+            printf("Writing shard %s of %zu off-targets from %s\n", shardName.c_str(), shardSignatures.size(), path.c_str());
+            writeIndex((shardSetDirectory + shardName).c_str(), shardSignatures, shardOccurrences, shardSeqCount, sliceWidth, sliceMasks, layout, neighbours);
+            shardNames.push_back(shardName);
         }
     }
 
-    for (size_t i = 0; i < sliceCount; i++) { // 5
-        for (size_t j = 0; j < sliceLimit; j++) { // 256
-            fwrite(sliceLists[i][j].data(), sizeof(uint64_t), sliceLists[i][j].size(), fp); // vector
+    if (!writeIsslShardSet(shardSetPath, shardNames, append)) {
+        exit(1);
+    }
+}
+
+int main(int argc, char **argv)
+{
+    /** In the shards mode, the arguments follow the mode, with the number of off-targets per shard after the shard set */
+    bool shards = argc > 1 && !strcmp(argv[1], "shards");
+    if (shards) {
+        argc--;
+        argv++;
+    }
+
+    if (argc < (shards ? 6 : 5)) {
+        fprintf(stderr, "Usage: %s [offtargetSites.txt] [sequence length] [slice width (bits) or scheme] [sissltable] [layout (standard, inline or compact)] [neighbours]\n", argv[0]);
+        fprintf(stderr, "       %s shards [offtargetSites.txt[,offtargetSites.txt...]] [sequence length] [slice width (bits) or scheme] [shard set] [off-targets per shard (0 for a shard per file)] [layout] [neighbours]\n", argv[0]);
+        exit(1);
+    }
+    size_t shardSize = 0;
+    if (shards) {
+        shardSize = strtoull(argv[5], NULL, 10);
+        for (int i = 5; i < argc - 1; i++) {
+            argv[i] = argv[i + 1];
         }
+        argc--;
+    }
+
+    uint64_t layout = ISSL_LAYOUT_STANDARD;
+    if (argc > 5 && !parseIsslLayout(argv[5], layout)) {
+        fprintf(stderr, "Unknown layout: %s\n", argv[5]);
+        exit(1);
+    }
+    bool neighbours = false;
+    if (argc > 6) {
+        if (strcmp(argv[6], "neighbours")) {
+            fprintf(stderr, "Unknown option: %s\n", argv[6]);
+            exit(1);
+        }
+        neighbours = true;
     }
-	
-	printf("Writing to disk...\n");
     
-    fclose(fp);
+    seqLength = atoi(argv[2]);
+    if (seqLength > 32) {
+        fprintf(stderr, "Sequence length is greater than 32, which is the maximum supported currently\n");
+        exit(1);
+    }
+    if (layout == ISSL_LAYOUT_INLINE && !InlineEncoding::supports(seqLength)) {
+        fprintf(stderr, "Sequence length is greater than 28, which is the maximum supported by the inline layout\n");
+        exit(1);
+    }
+    size_t sliceWidth;
+    vector<uint64_t> sliceMasks;
+    if (!parseSliceScheme(argv[3], seqLength, sliceMasks, sliceWidth) || sliceMasks.empty()) {
+        fprintf(stderr, "Invalid slice width or scheme: %s\n", argv[3]);
+        exit(1);
+    }
+    
+    nucleotideIndex['A'] = 0;
+    nucleotideIndex['C'] = 1;
+    nucleotideIndex['G'] = 2;
+    nucleotideIndex['T'] = 3;
+    signatureIndex[0] = 'A';
+    signatureIndex[1] = 'C';
+    signatureIndex[2] = 'G';
+    signatureIndex[3] = 'T';
+
+    if (shards) {
+        vector<string> paths;
+        for (const char *begin = argv[1]; ; ) {
+            const char *end = strchr(begin, ',');
+            paths.push_back(end != NULL ? string(begin, end) : string(begin));
+            if (end == NULL) {
+                break;
+            }
+            begin = end + 1;
+        }
+        writeShards(paths, argv[4], shardSize, sliceWidth, sliceMasks, layout, neighbours);
+        printf("Done.\n");
+        return 0;
+    }
+    
+    vector<uint64_t> seqSignatures;
+    vector<uint32_t> seqSignaturesOccurrences;
+    size_t seqCount = readOfftargets(argv[1], seqSignatures, seqSignaturesOccurrences);
+    
+    writeIndex(argv[4], seqSignatures, seqSignaturesOccurrences, seqCount, sliceWidth, sliceMasks, layout, neighbours);
     printf("Done.\n");
     return 0;
 }
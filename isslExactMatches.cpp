@@ -0,0 +1,168 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Count the number of times each query appears, exactly, in one or more ISSL
+indexes, or shard sets. This answers whether a guide is unique in the genome without Bowtie2.
+
+The off-targets extracted by extractOfftargets.py carry either an NGG or an
+NAG PAM, on either strand, so the count for a guide is the number of perfect
+matches that Bowtie2 would find across the eight PAM variants of the guide.
+
+Queries are read from a file, or from stdin when the file is `-`, and the
+counts are written to stdout in the same order (`<query>\t<count>`). They are
+processed, and flushed, in chunks so that the caller can stream them.
+
+
+To compile:
+
+g++ -o isslExactMatches isslExactMatches.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
+
+*/
+
+#include "isslIndex.h"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <vector>
+#include <string>
+#include <omp.h>
+
+using namespace std;
+
+/** The number of queries to read before counting and flushing the results */
+const size_t QUERY_CHUNK_SIZE = 65536;
+
+/**
+ * Count the occurrences of `signature` in `index`
+ *
+ * An exact match shares every slice with the query, so only the smallest of
+ * the buckets that the query falls in needs to be scanned. If the index has a
+ * neighbour table, the query is looked up in it instead.
+ *
+ * @param[in] index the ISSL index to search
+ * @param[in] signature the binary encoded query
+ */
+uint64_t countExactMatches(const IsslIndex &index, uint64_t signature)
+{
+    if (index.neighbours != nullptr) {
+        return index.neighbourOccurrences(signature);
+    }
+
+    size_t bestSlice = 0;
+    size_t bestSize = SIZE_MAX;
+    for (size_t i = 0; i < index.sliceCount; i++) {
+        size_t sz = index.sliceListSize(i, index.sliceValue(signature, i));
+        if (sz < bestSize) {
+            bestSize = sz;
+            bestSlice = i;
+        }
+    }
+
+    /** The off-targets are unique within the index, there is at most one match */
+    uint64_t matches = 0;
+    index.scanSliceList(bestSlice, index.sliceValue(signature, bestSlice), [&](uint64_t offtarget, uint64_t occurrences, uint64_t) {
+        if (offtarget == signature) {
+            matches = occurrences;
+            return true;
+        }
+        return false;
+    });
+
+    return matches;
+}
+
+int main(int argc, char **argv)
+{
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s [issltable] [query file or -] [issltable...]\n", argv[0]);
+        exit(1);
+    }
+
+    SignatureEncoding encoding;
+
+    /** Load each of the indexes, the first is required and any others are companions. A
+     *  shard set is replaced by its shards */
+    vector<string> paths;
+    paths.push_back(argv[1]);
+    for (int i = 3; i < argc; i++) {
+        paths.push_back(argv[i]);
+    }
+
+    vector<string> indexPaths;
+    if (!expandIsslShardSets(paths, indexPaths)) {
+        return 1;
+    }
+
+    vector<IsslIndex> indexes(indexPaths.size());
+    for (size_t i = 0; i < indexPaths.size(); i++) {
+        if (!loadIsslIndex(indexPaths[i].c_str(), indexes[i])) {
+            return 1;
+        }
+        if (indexes[i].seqLength != indexes[0].seqLength) {
+            fprintf(stderr, "Error: %s has a sequence length of %zu, expected %zu\n",
+                indexPaths[i].c_str(), indexes[i].seqLength, indexes[0].seqLength);
+            return 1;
+        }
+    }
+
+    size_t seqLength = indexes[0].seqLength;
+
+    FILE *fp = strcmp(argv[2], "-") == 0 ? stdin : fopen(argv[2], "rb");
+    if (fp == NULL) {
+        fprintf(stderr, "Failed to open query file: %s\n", argv[2]);
+        exit(1);
+    }
+
+    vector<string> queries;
+    vector<uint64_t> counts;
+    queries.reserve(QUERY_CHUNK_SIZE);
+
+    /** Read and count the queries one chunk at a time */
+    char line[256];
+    bool moreQueries = true;
+    while (moreQueries) {
+        queries.clear();
+        while (queries.size() < QUERY_CHUNK_SIZE) {
+            if (fgets(line, sizeof(line), fp) == NULL) {
+                moreQueries = false;
+                break;
+            }
+            size_t len = strcspn(line, "\r\n");
+            if (len == 0) {
+                continue;
+            }
+            if (len != seqLength) {
+                fprintf(stderr, "Error: query %.*s is not of the expected length (%zu)\n", (int)len, line, seqLength);
+                exit(1);
+            }
+            queries.push_back(string(line, len));
+        }
+
+        counts.assign(queries.size(), 0);
+
+        #pragma omp parallel for
+        for (size_t searchIdx = 0; searchIdx < queries.size(); searchIdx++) {
+            uint64_t signature = encoding.sequenceToSignature(queries[searchIdx].c_str(), seqLength);
+            for (const IsslIndex &index : indexes) {
+                counts[searchIdx] += countExactMatches(index, signature);
+            }
+        }
+
+        for (size_t searchIdx = 0; searchIdx < queries.size(); searchIdx++) {
+            printf("%s\t%lu\n", queries[searchIdx].c_str(), (unsigned long)counts[searchIdx]);
+        }
+        fflush(stdout);
+    }
+
+    if (fp != stdin) {
+        fclose(fp);
+    }
+
+    return 0;
+}
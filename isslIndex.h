@@ -0,0 +1,1801 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Reading and writing the binary encoded ISSL index, as written by
+isslCreateIndex. Shared by the ISSL tools.
+
+*/
+
+#ifndef ISSL_INDEX_H
+#define ISSL_INDEX_H
+
+#include <cstdio>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+#include <string>
+#include <algorithm>
+#include <map>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#include <omp.h>
+#include <phmap.h>
+
+/** Char to binary encoding */
+struct SignatureEncoding
+{
+    std::vector<uint8_t> nucleotideIndex;
+    std::vector<char> signatureIndex;
+
+    SignatureEncoding() : nucleotideIndex(256), signatureIndex(4)
+    {
+        nucleotideIndex['A'] = 0;
+        nucleotideIndex['C'] = 1;
+        nucleotideIndex['G'] = 2;
+        nucleotideIndex['T'] = 3;
+        signatureIndex[0] = 'A';
+        signatureIndex[1] = 'C';
+        signatureIndex[2] = 'G';
+        signatureIndex[3] = 'T';
+    }
+
+    /**
+     * Binary encode genetic string `ptr`
+     *
+     * For example,
+     *   ATCG becomes
+     *   00 11 01 10  (buffer with leading zeroes to encode as 64-bit unsigned int)
+     *
+     * @param[in] ptr the string containing ATCG to binary encode
+     * @param[in] seqLength the number of characters to encode
+     */
+    uint64_t sequenceToSignature(const char *ptr, size_t seqLength) const
+    {
+        uint64_t signature = 0;
+        for (size_t j = 0; j < seqLength; j++) {
+            signature |= (uint64_t)(nucleotideIndex[*ptr]) << (j * 2);
+            ptr++;
+        }
+        return signature;
+    }
+
+    /**
+     * Binary decode `signature` into a genetic string
+     *
+     * For example,
+     *   00 11 01 10 becomes (as 64-bit unsigned int)
+     *    A  T  C  G  (without spaces)
+     *
+     * @param[in] signature the binary encoded genetic string
+     * @param[in] seqLength the number of characters encoded
+     */
+    std::string signatureToSequence(uint64_t signature, size_t seqLength) const
+    {
+        std::string sequence = std::string(seqLength, ' ');
+        for (size_t j = 0; j < seqLength; j++) {
+            sequence[j] = signatureIndex[(signature >> (j * 2)) & 0x3];
+        }
+        return sequence;
+    }
+};
+
+/// Returns the size (bytes) of the file at `path`
+inline size_t getFileSize(const char *path)
+{
+    struct stat64 statBuf;
+    stat64(path, &statBuf);
+    return statBuf.st_size;
+}
+
+/** Version 2 of the index begins with this magic number, "ISSLINDX" */
+const uint64_t ISSL_INDEX_MAGIC = 0x58444E494C535349ull;
+const uint64_t ISSL_INDEX_VERSION = 2;
+
+/** Each section of a version 2 index begins on a page boundary */
+const uint64_t ISSL_PAGE_SIZE = 4096;
+
+/** The sections of a version 2 index */
+enum IsslSection
+{
+    /// the mismatch masks with a precalculated MIT score, sorted (uint64_t)
+    ISSL_SECTION_SCORE_MASKS = 0,
+    /// the precalculated MIT score of each mask (double)
+    ISSL_SECTION_SCORES = 1,
+    /// all binary-encoded off-target sites (uint64_t)
+    ISSL_SECTION_OFFTARGETS = 2,
+    /// where each slice list begins, within the slice contents, plus the end of the last (uint64_t)
+    ISSL_SECTION_SLICE_OFFSETS = 3,
+    /// the contents of the slices, as per the layout of the index (uint64_t)
+    ISSL_SECTION_SLICE_CONTENTS = 4,
+    /// the precalculated MIT score of every mask, indexed by its rank (double)
+    ISSL_SECTION_MIT_TABLE = 5,
+    /// the occurrences of the off-targets that do not fit in an inline entry, or the
+    /// occurrences section of a compact index, sorted (uint64_t pairs)
+    ISSL_SECTION_OCCURRENCE_OVERFLOW = 6,
+    /// the occurrences of each off-target in a compact index, saturated (uint8_t)
+    ISSL_SECTION_OCCURRENCES = 7,
+    /// where each compact slice list begins, within the slice contents, plus the end of the last (uint64_t)
+    ISSL_SECTION_SLICE_BYTE_OFFSETS = 8,
+    /// the (signature, occurrences) of each off-target, hashed, see `NeighbourTable` (uint64_t pairs)
+    ISSL_SECTION_NEIGHBOURS = 9,
+    /// the signature bits of each slice, if they are not `sliceWidth` bits apiece, see `parseSliceScheme` (uint64_t)
+    ISSL_SECTION_SLICE_MASKS = 10,
+
+    ISSL_MAX_SECTIONS = 32
+};
+
+/** The header of a version 2 index, it occupies the first page of the file */
+struct IsslIndexHeader
+{
+    uint64_t magic;
+    uint64_t version;
+    uint64_t offtargetsCount;
+    uint64_t seqLength;
+    uint64_t seqCount;
+    uint64_t sliceWidth;
+    uint64_t sliceCount;
+    uint64_t scoresCount;
+
+    /** The position and size (bytes) of each section, zero if absent */
+    uint64_t sectionOffsets[ISSL_MAX_SECTIONS];
+    uint64_t sectionSizes[ISSL_MAX_SECTIONS];
+
+    /** How the masks of the dense MIT table are ranked, zero if there is no table */
+    uint64_t mitTableScheme;
+    uint64_t mitTablePositions;
+    uint64_t mitTableDistance;
+
+    /** The layout of the slice contents */
+    uint64_t layout;
+};
+
+/** The layouts of the slice contents
+ *
+ *      standard    <occurrences 32-bit><off-target-id 32-bit>, the off-target
+ *                  is read from the off-targets section
+ *
+ *      inline      <occurrences><signature>, see `InlineEncoding`. There is no
+ *                  indirection to the off-targets section, the signatures are
+ *                  read in order with the slice list. Each off-target is stored
+ *                  once per slice, rather than once.
+ *
+ *      compact     the off-target ids of each slice list, ascending and delta
+ *                  encoded, see `encodeCompactIds`. The occurrences are held
+ *                  once per off-target, in the occurrences section, rather
+ *                  than once per slice. An entry takes one to two bytes for a
+ *                  large genome, rather than eight.
+ */
+const uint64_t ISSL_LAYOUT_STANDARD = 0;
+const uint64_t ISSL_LAYOUT_INLINE = 1;
+const uint64_t ISSL_LAYOUT_COMPACT = 2;
+
+/// The layout named `name`, or false if there is none
+inline bool parseIsslLayout(const char *name, uint64_t &layout)
+{
+    if (!strcmp(name, "standard")) {
+        layout = ISSL_LAYOUT_STANDARD;
+    }
+    else if (!strcmp(name, "inline")) {
+        layout = ISSL_LAYOUT_INLINE;
+    }
+    else if (!strcmp(name, "compact")) {
+        layout = ISSL_LAYOUT_COMPACT;
+    }
+    else {
+        return false;
+    }
+    return true;
+}
+
+/** An inline slice entry, <occurrences><signature>
+ *
+ *      The signature occupies the low 2 * seqLength bits, the occurrences the
+ *      remaining high bits. If an off-target occurs too often for them, they
+ *      are saturated and its occurrences are held in the overflow section.
+ */
+struct InlineEncoding
+{
+    size_t signatureBits = 0;
+    uint64_t signatureMask = ~0ull;
+    uint64_t maxOccurrences = 0;
+
+    void init(size_t seqLength)
+    {
+        signatureBits = seqLength * 2;
+        signatureMask = signatureBits == 64 ? ~0ull : (1ull << signatureBits) - 1;
+        maxOccurrences = signatureBits == 64 ? 0 : (~0ull >> signatureBits);
+    }
+
+    /// Whether the occurrences of an off-target can be stored inline
+    static bool supports(size_t seqLength)
+    {
+        return seqLength <= 28;
+    }
+
+    uint64_t entry(uint64_t signature, uint64_t occurrences) const
+    {
+        return (std::min(occurrences, maxOccurrences) << signatureBits) | signature;
+    }
+};
+
+/** The ids of a compact slice list are decoded this many at a time when scanning */
+const size_t ISSL_COMPACT_BLOCK = 64;
+
+/** The compact slice contents are followed by this many zeroes, see `decodeCompactIds` */
+const size_t ISSL_COMPACT_PADDING = 3;
+
+/** Occurrences of a compact index at or above this are held in the overflow section */
+const uint64_t ISSL_COMPACT_MAX_OCCURRENCES = 255;
+
+/**
+ * Encode the ascending ids of a compact slice list
+ *
+ *      The difference between each id and the one before it (the first, from
+ *      zero) is stored in one to four bytes. The differences are grouped in
+ *      fours, each group preceded by a byte holding the number of bytes of each
+ *      of its differences, less one, two bits apiece. The last group is padded
+ *      with differences of zero.
+ *
+ * @param[in] ids the ids, ascending
+ * @param[in] count the number of ids
+ * @param[out] bytes the encoded ids are appended to this
+ */
+inline void encodeCompactIds(const uint32_t *ids, size_t count, std::vector<uint8_t> &bytes)
+{
+    uint32_t previous = 0;
+    for (size_t g = 0; g < count; g += 4) {
+        size_t tagPosition = bytes.size();
+        uint8_t tag = 0;
+        bytes.push_back(0);
+        for (size_t k = 0; k < 4; k++) {
+            uint32_t delta = 0;
+            if (g + k < count) {
+                delta = ids[g + k] - previous;
+                previous = ids[g + k];
+            }
+            size_t length = delta < (1u << 8) ? 1 : delta < (1u << 16) ? 2 : delta < (1u << 24) ? 3 : 4;
+            tag |= (length - 1) << (k * 2);
+            for (size_t b = 0; b < length; b++) {
+                bytes.push_back((delta >> (b * 8)) & 0xFF);
+            }
+        }
+        bytes[tagPosition] = tag;
+    }
+}
+
+/**
+ * Decode `count` ids of a compact slice list, a multiple of four
+ *
+ *      Each difference is read as four bytes and masked to its length, so that
+ *      decoding does not branch on the length. The slice contents are padded so
+ *      that this never reads beyond them.
+ *
+ * @param[in] bytes where the ids to decode begin
+ * @param[in] count the number of ids to decode
+ * @param[in,out] previous the id before those to decode, zero at the beginning of a slice list
+ * @param[out] ids the decoded ids
+ * @return where the ids that follow begin
+ */
+inline const uint8_t *decodeCompactIds(const uint8_t *bytes, size_t count, uint32_t &previous, uint32_t *ids)
+{
+    static const uint32_t lengthMasks[4] = {0xFFu, 0xFFFFu, 0xFFFFFFu, 0xFFFFFFFFu};
+    for (size_t g = 0; g < count; g += 4) {
+        uint8_t tag = *bytes++;
+        for (size_t k = 0; k < 4; k++) {
+            size_t length = (tag >> (k * 2)) & 3;
+            uint32_t delta;
+            memcpy(&delta, bytes, sizeof(uint32_t));
+            previous += delta & lengthMasks[length];
+            ids[g + k] = previous;
+            bytes += length + 1;
+        }
+    }
+    return bytes;
+}
+
+/** The slots of a neighbour table are at most this full, so that probes are short */
+const size_t ISSL_NEIGHBOUR_LOAD = 2;
+
+/**
+ * A hash table of the off-targets, (signature, occurrences) pairs
+ *
+ *      The slice lists hold every off-target that shares a slice with the
+ *      query, whatever its distance. The off-targets within one mismatch of a
+ *      query contribute the most to its scores, and are found instead by
+ *      looking up the query and each of its 3 * seqLength neighbours.
+ *
+ *      Open addressing with linear probing, a power of two slots, at most one
+ *      in `ISSL_NEIGHBOUR_LOAD` used. An empty slot has zero occurrences.
+ */
+struct NeighbourTable
+{
+    std::vector<uint64_t> slots;
+
+    /// The number of slots for `offtargetsCount` off-targets
+    static size_t capacity(size_t offtargetsCount)
+    {
+        size_t capacity = 1;
+        while (capacity < offtargetsCount * ISSL_NEIGHBOUR_LOAD) {
+            capacity <<= 1;
+        }
+        return capacity;
+    }
+
+    /// The slot of `signature`, before probing
+    static size_t slot(uint64_t signature, size_t capacity)
+    {
+        uint64_t hash = signature * 0x9E3779B97F4A7C15ull;
+        return (hash ^ (hash >> 32)) & (capacity - 1);
+    }
+
+    /**
+     * The occurrences of `signature` in the table `slots`
+     *
+     * @param[in] slots the (signature, occurrences) pairs
+     * @param[in] capacity the number of slots, a power of two
+     * @param[in] signature the binary encoded off-target
+     * @return zero if it is not an off-target
+     */
+    static uint64_t occurrences(const uint64_t *slots, size_t capacity, uint64_t signature)
+    {
+        for (size_t s = slot(signature, capacity); slots[s * 2 + 1] != 0; s = (s + 1) & (capacity - 1)) {
+            if (slots[s * 2] == signature) {
+                return slots[s * 2 + 1];
+            }
+        }
+        return 0;
+    }
+
+    NeighbourTable(size_t offtargetsCount) : slots(capacity(offtargetsCount) * 2) {}
+
+    /// Add an off-target, each once
+    void insert(uint64_t signature, uint64_t occurrences)
+    {
+        size_t capacity = slots.size() / 2;
+        size_t s = slot(signature, capacity);
+        while (slots[s * 2 + 1] != 0) {
+            s = (s + 1) & (capacity - 1);
+        }
+        slots[s * 2] = signature;
+        slots[s * 2 + 1] = occurrences;
+    }
+};
+
+/** A slice holds at most this many bits of a signature, its slice lists are indexed by them */
+const size_t ISSL_MAX_SLICE_BITS = 32;
+
+/**
+ * The bits of `signature` under `sliceMask`, packed into the low bits
+ *
+ *      A slice of contiguous bits is shifted and masked, otherwise the bits
+ *      are gathered one at a time, lowest first.
+ */
+inline uint64_t extractSliceValue(uint64_t signature, uint64_t sliceMask)
+{
+    int shift = __builtin_ctzll(sliceMask);
+    uint64_t shiftedMask = sliceMask >> shift;
+    if ((shiftedMask & (shiftedMask + 1)) == 0) {
+        return (signature >> shift) & shiftedMask;
+    }
+
+    uint64_t value = 0;
+    for (uint64_t bit = 1; sliceMask; bit <<= 1) {
+        if (signature & sliceMask & (~sliceMask + 1)) {
+            value |= bit;
+        }
+        sliceMask &= sliceMask - 1;
+    }
+    return value;
+}
+
+/// The number of slice values, and slice lists, of the slice `sliceMask`
+inline size_t sliceValueCount(uint64_t sliceMask)
+{
+    return (size_t)1 << __builtin_popcountll(sliceMask);
+}
+
+/// The masks of `sliceCount` contiguous slices of `sliceWidth` bits, the first at the lowest bits
+inline std::vector<uint64_t> uniformSliceMasks(size_t sliceWidth, size_t sliceCount)
+{
+    std::vector<uint64_t> sliceMasks;
+    for (size_t i = 0; i < sliceCount; i++) {
+        sliceMasks.push_back(((1ull << sliceWidth) - 1) << (sliceWidth * i));
+    }
+    return sliceMasks;
+}
+
+/**
+ * Parse a slicing scheme
+ *
+ *      Either a width (bits), for `seqLength * 2 / width` contiguous slices of
+ *      that width, or the positions of each slice: slices separated by commas,
+ *      positions within a slice by `+`, and `a-b` for positions a to b. For
+ *      example, `0-4,5-9,10-14,15-19` is the same as a width of 10 for a
+ *      sequence length of 20, and `0+5+10+15,1+6+11+16,...` interleaves the
+ *      positions of the slices.
+ *
+ *      The slices must not share a position, so that an off-target within
+ *      `sliceCount - 1` mismatches of a query matches it exactly in at least
+ *      one slice.
+ *
+ * @param[in] scheme the scheme
+ * @param[in] seqLength the length of the sequences
+ * @param[out] sliceMasks the signature bits of each slice
+ * @param[out] sliceWidth the width, or zero if the slices are given by position
+ * @return false if the scheme is not valid
+ */
+inline bool parseSliceScheme(const std::string &scheme, size_t seqLength, std::vector<uint64_t> &sliceMasks, size_t &sliceWidth)
+{
+    sliceMasks.clear();
+    sliceWidth = 0;
+
+    if (!scheme.empty() && scheme.find_first_not_of("0123456789") == std::string::npos) {
+        sliceWidth = atoi(scheme.c_str());
+        if (sliceWidth == 0 || sliceWidth > ISSL_MAX_SLICE_BITS || sliceWidth > seqLength * 2) {
+            return false;
+        }
+        sliceMasks = uniformSliceMasks(sliceWidth, (seqLength * 2) / sliceWidth);
+        return true;
+    }
+
+    uint64_t usedMask = 0;
+    size_t begin = 0;
+    while (begin <= scheme.size()) {
+        size_t end = std::min(scheme.find(',', begin), scheme.size());
+        std::string slice = scheme.substr(begin, end - begin);
+
+        uint64_t sliceMask = 0;
+        size_t partBegin = 0;
+        while (partBegin <= slice.size()) {
+            size_t partEnd = std::min(slice.find('+', partBegin), slice.size());
+            std::string part = slice.substr(partBegin, partEnd - partBegin);
+
+            size_t dash = part.find('-');
+            std::string first = part.substr(0, dash);
+            std::string last = dash == std::string::npos ? first : part.substr(dash + 1);
+            if (first.empty() || last.empty() || (first + last).find_first_not_of("0123456789") != std::string::npos) {
+                return false;
+            }
+
+            size_t from = atoi(first.c_str()), to = atoi(last.c_str());
+            if (from > to || to >= seqLength) {
+                return false;
+            }
+            for (size_t pos = from; pos <= to; pos++) {
+                sliceMask |= 3ull << (pos * 2);
+            }
+            partBegin = partEnd + 1;
+        }
+
+        if ((sliceMask & usedMask) != 0 || (size_t)__builtin_popcountll(sliceMask) > ISSL_MAX_SLICE_BITS) {
+            return false;
+        }
+        usedMask |= sliceMask;
+        sliceMasks.push_back(sliceMask);
+        begin = end + 1;
+    }
+    return true;
+}
+
+/// The slicing scheme of `sliceMasks`, as parsed by `parseSliceScheme`
+inline std::string sliceSchemeName(const std::vector<uint64_t> &sliceMasks)
+{
+    std::string scheme;
+    for (size_t i = 0; i < sliceMasks.size(); i++) {
+        if (i > 0) {
+            scheme += ",";
+        }
+
+        /** Each run of positions, as `a-b` */
+        std::string slice;
+        for (size_t pos = 0; pos < 32; pos++) {
+            if (((sliceMasks[i] >> (pos * 2)) & 3) == 0 || (pos > 0 && ((sliceMasks[i] >> ((pos - 1) * 2)) & 3) != 0)) {
+                continue;
+            }
+            size_t last = pos;
+            while (last + 1 < 32 && ((sliceMasks[i] >> ((last + 1) * 2)) & 3) != 0) {
+                last++;
+            }
+            slice += (slice.empty() ? "" : "+") + std::to_string(pos) + (last > pos ? "-" + std::to_string(last) : "");
+        }
+        scheme += slice;
+    }
+    return scheme;
+}
+
+/** The masks of the dense MIT table are ranked by `MismatchRanking` */
+const uint64_t ISSL_MIT_RANK_COMBINADIC = 1;
+
+/** A dense ranking of the mismatch masks with up to `maxMismatches` mismatches
+ *
+ *      The masks are ordered by their number of mismatches, then within each
+ *      number of mismatches, `k`, by the combinatorial number system. A mask
+ *      with mismatches at positions p1 < p2 < ... < pk has the rank
+ *
+ *          firstRank[k] + C(p1, 1) + C(p2, 2) + ... + C(pk, k)
+ *
+ *      There are sum(C(positions, k), k <= maxMismatches) ranks, for 20
+ *      positions and 4 mismatches that is 6,196. A table indexed by the rank
+ *      is small enough to stay in the L1 cache and, unlike a hash map, needs
+ *      no probing.
+ */
+struct MismatchRanking
+{
+    size_t positions = 0, maxMismatches = 0;
+
+    /** C(p, i) for the mismatch at position p, at (2 * p) * (maxMismatches + 1) + i
+     *
+     *      Indexed by the bit of the mismatch, rather than its position, so that
+     *      the odd bits, which are never set in a mask, are zero. Bit 63 is used
+     *      as a sentinel once every mismatch has been ranked, so that `rank`
+     *      always makes `maxMismatches` steps and its loop is predictable.
+     */
+    std::vector<uint32_t> rankTerms;
+
+    /** The rank of the first mask with `k` mismatches, plus the number of ranks */
+    std::vector<uint32_t> firstRank;
+
+    void init(size_t positions, size_t maxMismatches)
+    {
+        this->positions = positions;
+        this->maxMismatches = maxMismatches = std::min(positions, maxMismatches);
+
+        /** Pascal's triangle, C(p, i) */
+        std::vector<std::vector<uint32_t>> binomial(positions + 1, std::vector<uint32_t>(maxMismatches + 1, 0));
+        for (size_t p = 0; p <= positions; p++) {
+            binomial[p][0] = 1;
+            for (size_t i = 1; i <= maxMismatches && i <= p; i++) {
+                binomial[p][i] = binomial[p - 1][i - 1] + binomial[p - 1][i];
+            }
+        }
+
+        rankTerms.assign(64 * (maxMismatches + 1), 0);
+        for (size_t p = 0; p < positions; p++) {
+            for (size_t i = 1; i <= maxMismatches; i++) {
+                rankTerms[(2 * p) * (maxMismatches + 1) + i] = binomial[p][i];
+            }
+        }
+
+        firstRank.assign(maxMismatches + 2, 0);
+        for (size_t k = 0; k <= maxMismatches; k++) {
+            firstRank[k + 1] = firstRank[k] + binomial[positions][k];
+        }
+    }
+
+    /// The number of ranks
+    size_t size() const
+    {
+        return firstRank.empty() ? 0 : firstRank[maxMismatches + 1];
+    }
+
+    /// The rank of `mask`, which must have at most `maxMismatches` mismatches within `positions`
+    size_t rank(uint64_t mask) const
+    {
+        size_t stride = maxMismatches + 1;
+        size_t r = firstRank[__builtin_popcountll(mask)];
+        for (size_t i = 1; i <= maxMismatches; i++) {
+            r += rankTerms[__builtin_ctzll(mask | (1ull << 63)) * stride + i];
+            mask &= mask - 1;
+        }
+        return r;
+    }
+
+    /// Whether `mask` can be ranked
+    bool contains(uint64_t mask) const
+    {
+        return (size_t)__builtin_popcountll(mask) <= maxMismatches && (positions == 32 || (mask >> (positions * 2)) == 0);
+    }
+};
+
+/**
+ * The dense MIT table of `scores`, which maps masks to precalculated MIT scores
+ *
+ * Masks without a precalculated score, score zero.
+ */
+template <class ScoreMap>
+std::vector<double> buildMitTable(const MismatchRanking &ranking, const ScoreMap &scores)
+{
+    std::vector<double> table(ranking.size(), 0.0);
+    for (auto const &x : scores) {
+        if (ranking.contains(x.first)) {
+            table[ranking.rank(x.first)] = x.second;
+        }
+    }
+    return table;
+}
+
+/// The most mismatches in any mask of `scores`
+template <class ScoreMap>
+size_t maxScoreMismatches(const ScoreMap &scores)
+{
+    size_t maxMismatches = 0;
+    for (auto const &x : scores) {
+        maxMismatches = std::max(maxMismatches, (size_t)__builtin_popcountll(x.first));
+    }
+    return maxMismatches;
+}
+
+/** An ISSL index, structured as:
+ *      - a header
+ *      - precalcuated local MIT scores
+ *      - precalculated local MIT scores as a dense table (version 2)
+ *      - all binary-encoded off-target sites
+ *      - slice list sizes (version 1) or offsets (version 2)
+ *      - slice contents
+ *
+ *  A version 1 index is read into memory. A version 2 index is memory-mapped
+ *  and used in place, so that processes using the same index share one copy
+ *  of it in the page cache.
+ */
+struct IsslIndex
+{
+    /** The index contains a fixed-sized header
+     *      - the number of off-targets in the index
+     *      - the length of an off-target
+     *      - the number of off-target sites (including repeats)
+     *      - bits per slice, or zero if the slices are given by `sliceMasks`
+     *      - the number of slices per sequence
+     *      - the number of precalculated MIT scores
+     */
+    size_t offtargetsCount = 0, seqLength = 0, seqCount = 0, sliceWidth = 0, sliceCount = 0, scoresCount = 0;
+
+    /** The maximum number of possibly slice identities, of the widest slice
+     *      4 chars per slice * each of A,T,C,G = limit of 16
+     */
+    size_t sliceLimit = 0;
+
+    /** The signature bits of each slice, see `parseSliceScheme`, and where the
+     *      slice lists of each slice begin within `sliceListOffsets`, plus the
+     *      end of the last
+     */
+    std::vector<uint64_t> sliceMasks;
+    std::vector<size_t> sliceListBases;
+
+    /** The precalculated MIT scores
+     *      - `mask` is a 2-bit encoding of mismatch positions
+     *          For example,
+     *              00 01 01 00 01  indicates mismatches in positions 1, 3 and 4
+     *
+     *      - `score` is the local MIT score for this mismatch combination
+     */
+    phmap::flat_hash_map<uint64_t, double> precalculatedScores;
+
+    /** The precalculated MIT scores as a dense table, indexed by `mitRanking.rank(mask)`
+     *
+     *      Read from the index if it has one, otherwise built from `precalculatedScores`
+     */
+    MismatchRanking mitRanking;
+    const double *mitTable = nullptr;
+    std::vector<double> mitTableStorage;
+
+    /** All of the off-target sites */
+    const uint64_t *offtargets = nullptr;
+
+    /** Where each slice list begins within `allSignatures`, ordered as
+     *      (for slices of 8 bits):
+     *
+     *         + Slice 0 :
+     *         |---- AAAA : <slice contents>
+     *         |---- AAAC : <slice contents>
+     *         |----  ...
+     *         |
+     *         + Slice 1 :
+     *         |---- AAAA : <slice contents>
+     *         |---- AAAC : <slice contents>
+     *         |---- ...
+     *         | ...
+     *
+     *      The last entry is the end of the last slice list
+     */
+    const uint64_t *sliceListOffsets = nullptr;
+
+    /** The contents of the slices
+     *
+     *      Stored contiguously
+     *
+     *      Each signature (64-bit) is structured as:
+     *          <occurrences 32-bit><off-target-id 32-bit>
+     *
+     *      or, in the inline layout:
+     *          <occurrences><signature>
+     *
+     *      The compact layout is not of 64-bit entries, see `compactSliceList`
+     */
+    const uint64_t *allSignatures = nullptr;
+
+    /** The layout of the slice contents, and for the inline layout, the
+     *      sorted (signature, occurrences) pairs that do not fit in an entry
+     *
+     *      For the compact layout, the sorted (off-target-id, occurrences)
+     *      pairs that do not fit in `occurrences`
+     */
+    uint64_t layout = ISSL_LAYOUT_STANDARD;
+    InlineEncoding inlineEncoding;
+    const uint64_t *occurrenceOverflow = nullptr;
+    size_t occurrenceOverflowCount = 0;
+
+    /** The compact layout
+     *      - the encoded ids of the slice lists, see `encodeCompactIds`
+     *      - where each slice list begins within them (bytes)
+     *      - the occurrences of each off-target, by id
+     */
+    const uint8_t *compactContents = nullptr;
+    const uint64_t *sliceListByteOffsets = nullptr;
+    const uint8_t *occurrences = nullptr;
+
+    /** The off-targets hashed by their signature, if the index has them, see `NeighbourTable` */
+    const uint64_t *neighbours = nullptr;
+    size_t neighbourCapacity = 0;
+
+    /** The sections of a version 1 index, read into memory */
+    std::vector<uint64_t> offtargetsStorage;
+    std::vector<uint64_t> sliceListOffsetsStorage;
+    std::vector<uint64_t> allSignaturesStorage;
+
+    /** A version 2 index, mapped into memory */
+    const IsslIndexHeader *header = nullptr;
+    void *mapped = nullptr;
+    size_t mappedSize = 0;
+
+    IsslIndex() {}
+    IsslIndex(const IsslIndex &) = delete;
+    IsslIndex &operator=(const IsslIndex &) = delete;
+
+    ~IsslIndex()
+    {
+        if (mapped != nullptr) {
+            munmap(mapped, mappedSize);
+        }
+    }
+
+    /// Set the slices of the index, and where their slice lists begin
+    void initSlices(const std::vector<uint64_t> &sliceMasks)
+    {
+        this->sliceMasks = sliceMasks;
+        sliceCount = sliceMasks.size();
+        sliceLimit = 0;
+        sliceListBases.assign(1, 0);
+        for (uint64_t sliceMask : sliceMasks) {
+            size_t values = sliceValueCount(sliceMask);
+            sliceLimit = std::max(sliceLimit, values);
+            sliceListBases.push_back(sliceListBases.back() + values);
+        }
+    }
+
+    /// The number of slice values, and slice lists, of slice `i`
+    size_t sliceValues(size_t i) const
+    {
+        return sliceListBases[i + 1] - sliceListBases[i];
+    }
+
+    /// The number of slice lists over every slice
+    size_t sliceListCount() const
+    {
+        return sliceListBases.back();
+    }
+
+    /// The slice value of `signature` in slice `i`
+    uint64_t sliceValue(uint64_t signature, size_t i) const
+    {
+        return extractSliceValue(signature, sliceMasks[i]);
+    }
+
+    /// The number of signatures in slice `i` with the slice value `value`
+    size_t sliceListSize(size_t i, uint64_t value) const
+    {
+        size_t idx = sliceListBases[i] + value;
+        return sliceListOffsets[idx + 1] - sliceListOffsets[idx];
+    }
+
+    /// The signatures in slice `i` with the slice value `value`
+    const uint64_t *sliceList(size_t i, uint64_t value) const
+    {
+        return allSignatures + sliceListOffsets[sliceListBases[i] + value];
+    }
+
+    /// The encoded ids of the compact slice list of slice `i` with the slice value `value`
+    const uint8_t *compactSliceList(size_t i, uint64_t value) const
+    {
+        return compactContents + sliceListByteOffsets[sliceListBases[i] + value];
+    }
+
+    /// The occurrences of `key` in the overflow section, or `saturated` if it is not there
+    uint64_t overflowOccurrences(uint64_t key, uint64_t saturated) const
+    {
+        size_t lo = 0, hi = occurrenceOverflowCount;
+        while (lo < hi) {
+            size_t mid = (lo + hi) / 2;
+            if (occurrenceOverflow[mid * 2] < key) {
+                lo = mid + 1;
+            }
+            else {
+                hi = mid;
+            }
+        }
+        if (lo < occurrenceOverflowCount && occurrenceOverflow[lo * 2] == key) {
+            return occurrenceOverflow[lo * 2 + 1];
+        }
+        return saturated;
+    }
+
+    /// The occurrences of the off-target of an inline slice entry
+    uint64_t inlineOccurrences(uint64_t entry) const
+    {
+        uint64_t occurrences = entry >> inlineEncoding.signatureBits;
+        if (occurrences == inlineEncoding.maxOccurrences) {
+            occurrences = overflowOccurrences(entry & inlineEncoding.signatureMask, occurrences);
+        }
+        return occurrences;
+    }
+
+    /// The occurrences of the off-target `id` of a compact index
+    uint64_t compactOccurrences(uint32_t id) const
+    {
+        uint64_t occurrences = this->occurrences[id];
+        if (occurrences == ISSL_COMPACT_MAX_OCCURRENCES) {
+            occurrences = overflowOccurrences(id, occurrences);
+        }
+        return occurrences;
+    }
+
+    /// The occurrences of the off-target `signature`, zero if there is none. The index must have a neighbour table
+    uint64_t neighbourOccurrences(uint64_t signature) const
+    {
+        return NeighbourTable::occurrences(neighbours, neighbourCapacity, signature);
+    }
+
+    /**
+     * Read the slice list of slice `i` with the slice value `value`, in any layout
+     *
+     * @param[out] signatures the off-target of each entry
+     * @param[out] entries each entry, see `entryOccurrences`. The ids of a compact slice list
+     */
+    void readSliceList(size_t i, uint64_t value, std::vector<uint64_t> &signatures, std::vector<uint64_t> &entries) const
+    {
+        size_t count = sliceListSize(i, value);
+        signatures.resize(count);
+        entries.resize(count);
+
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            const uint8_t *bytes = compactSliceList(i, value);
+            uint32_t ids[ISSL_COMPACT_BLOCK];
+            uint32_t previous = 0;
+            for (size_t j = 0; j < count; j += ISSL_COMPACT_BLOCK) {
+                size_t block = std::min(ISSL_COMPACT_BLOCK, count - j);
+                bytes = decodeCompactIds(bytes, (block + 3) & ~(size_t)3, previous, ids);
+                for (size_t k = 0; k < block; k++) {
+                    entries[j + k] = ids[k];
+                    signatures[j + k] = offtargets[ids[k]];
+                }
+            }
+            return;
+        }
+
+        const uint64_t *list = sliceList(i, value);
+        for (size_t j = 0; j < count; j++) {
+            entries[j] = list[j];
+            signatures[j] = layout == ISSL_LAYOUT_INLINE ? list[j] & inlineEncoding.signatureMask : offtargets[list[j] & 0xFFFFFFFFull];
+        }
+    }
+
+    /// The occurrences of the off-target of an entry read by `readSliceList`
+    uint64_t entryOccurrences(uint64_t entry) const
+    {
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            return compactOccurrences(entry);
+        }
+        if (layout == ISSL_LAYOUT_INLINE) {
+            return inlineOccurrences(entry);
+        }
+        return entry >> 32;
+    }
+
+    /**
+     * Visit each entry of the slice list of slice `i` with the slice value `value`, in any layout
+     *
+     * @param[in] f called with the signature, occurrences and id of each
+     *              off-target (the inline layout has no ids, they are zero),
+     *              returns true to stop
+     * @return true if `f` stopped the scan
+     */
+    template <class F>
+    bool scanSliceList(size_t i, uint64_t value, F f) const
+    {
+        size_t count = sliceListSize(i, value);
+
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            const uint8_t *bytes = compactSliceList(i, value);
+            uint32_t ids[ISSL_COMPACT_BLOCK];
+            uint32_t previous = 0;
+            for (size_t j = 0; j < count; j += ISSL_COMPACT_BLOCK) {
+                size_t block = std::min(ISSL_COMPACT_BLOCK, count - j);
+                bytes = decodeCompactIds(bytes, (block + 3) & ~(size_t)3, previous, ids);
+                for (size_t k = 0; k < block; k++) {
+                    if (f(offtargets[ids[k]], compactOccurrences(ids[k]), (uint64_t)ids[k])) {
+                        return true;
+                    }
+                }
+            }
+            return false;
+        }
+
+        const uint64_t *entries = sliceList(i, value);
+        for (size_t j = 0; j < count; j++) {
+            bool stop;
+            if (layout == ISSL_LAYOUT_INLINE) {
+                stop = f(entries[j] & inlineEncoding.signatureMask, inlineOccurrences(entries[j]), (uint64_t)0);
+            }
+            else {
+                stop = f(offtargets[entries[j] & 0xFFFFFFFFull], entries[j] >> 32, entries[j] & 0xFFFFFFFFull);
+            }
+            if (stop) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    /// The precalculated MIT score of `mask`, zero if there is none
+    double mitScore(uint64_t mask) const
+    {
+        return mitRanking.contains(mask) ? mitTable[mitRanking.rank(mask)] : 0.0;
+    }
+
+    /// Build the dense MIT table from `precalculatedScores`
+    void buildMitTable()
+    {
+        mitRanking.init(seqLength, maxScoreMismatches(precalculatedScores));
+        mitTableStorage = ::buildMitTable(mitRanking, precalculatedScores);
+        mitTable = mitTableStorage.data();
+    }
+
+    /**
+     * The section `id` of a version 2 index
+     *
+     * @param[in] id the section
+     * @param[out] bytes the size of the section
+     * @return nullptr if the index does not have the section
+     */
+    const void *section(size_t id, size_t *bytes = nullptr) const
+    {
+        if (header == nullptr || header->sectionSizes[id] == 0) {
+            return nullptr;
+        }
+        if (bytes != nullptr) {
+            *bytes = header->sectionSizes[id];
+        }
+        return (const char *)mapped + header->sectionOffsets[id];
+    }
+};
+
+/**
+ * Load a version 1 ISSL index, `fp`, into memory
+ *
+ * Structured as:
+ *      - a header (6 items)
+ *      - precalcuated local MIT scores, interleaved (mask, score) pairs
+ *      - all binary-encoded off-target sites
+ *      - slice list sizes
+ *      - slice contents
+ */
+inline bool loadIsslIndexV1(FILE *fp, IsslIndex &index)
+{
+    std::vector<size_t> slicelistHeader(6);
+
+    if (fread(slicelistHeader.data(), sizeof(size_t), slicelistHeader.size(), fp) == 0) {
+        fprintf(stderr, "Error reading index: header invalid\n");
+        return false;
+    }
+
+    index.offtargetsCount = slicelistHeader[0];
+    index.seqLength       = slicelistHeader[1];
+    index.seqCount        = slicelistHeader[2];
+    index.sliceWidth      = slicelistHeader[3];
+    index.sliceCount      = slicelistHeader[4];
+    index.scoresCount     = slicelistHeader[5];
+    index.initSlices(uniformSliceMasks(index.sliceWidth, index.sliceCount));
+
+    for (size_t i = 0; i < index.scoresCount; i++) {
+        uint64_t mask = 0;
+        double score = 0.0;
+        fread(&mask, sizeof(uint64_t), 1, fp);
+        fread(&score, sizeof(double), 1, fp);
+
+        index.precalculatedScores.insert(std::pair<uint64_t, double>(mask, score));
+    }
+
+    index.offtargetsStorage.resize(index.offtargetsCount);
+    if (fread(index.offtargetsStorage.data(), sizeof(uint64_t), index.offtargetsCount, fp) == 0) {
+        fprintf(stderr, "Error reading index: loading off-target sequences failed\n");
+        return false;
+    }
+
+    /** The slice list sizes are converted to where each slice list begins */
+    std::vector<size_t> allSlicelistSizes(index.sliceListCount());
+    if (fread(allSlicelistSizes.data(), sizeof(size_t), allSlicelistSizes.size(), fp) == 0) {
+        fprintf(stderr, "Error reading index: reading slice list sizes failed\n");
+        return false;
+    }
+
+    index.sliceListOffsetsStorage.resize(allSlicelistSizes.size() + 1);
+    index.sliceListOffsetsStorage[0] = 0;
+    for (size_t idx = 0; idx < allSlicelistSizes.size(); idx++) {
+        index.sliceListOffsetsStorage[idx + 1] = index.sliceListOffsetsStorage[idx] + allSlicelistSizes[idx];
+    }
+
+    index.allSignaturesStorage.resize(index.sliceListOffsetsStorage.back());
+    if (fread(index.allSignaturesStorage.data(), sizeof(uint64_t), index.allSignaturesStorage.size(), fp) == 0) {
+        fprintf(stderr, "Error reading index: reading slice contents failed\n");
+        return false;
+    }
+
+    index.offtargets = index.offtargetsStorage.data();
+    index.sliceListOffsets = index.sliceListOffsetsStorage.data();
+    index.allSignatures = index.allSignaturesStorage.data();
+
+    index.buildMitTable();
+
+    return true;
+}
+
+/**
+ * Map a version 2 ISSL index, `fd`, into memory
+ */
+inline bool loadIsslIndexV2(int fd, IsslIndex &index)
+{
+    struct stat64 statBuf;
+    if (fstat64(fd, &statBuf) != 0 || (size_t)statBuf.st_size < sizeof(IsslIndexHeader)) {
+        fprintf(stderr, "Error reading index: header invalid\n");
+        return false;
+    }
+
+    index.mappedSize = statBuf.st_size;
+    index.mapped = mmap(NULL, index.mappedSize, PROT_READ, MAP_SHARED, fd, 0);
+    if (index.mapped == MAP_FAILED) {
+        index.mapped = nullptr;
+        fprintf(stderr, "Error reading index: could not map the index into memory\n");
+        return false;
+    }
+
+    const IsslIndexHeader *header = (const IsslIndexHeader *)index.mapped;
+    if (header->version != ISSL_INDEX_VERSION) {
+        fprintf(stderr, "Error reading index: unsupported version %lu\n", (unsigned long)header->version);
+        return false;
+    }
+
+    for (size_t id = 0; id < ISSL_MAX_SECTIONS; id++) {
+        if (header->sectionOffsets[id] + header->sectionSizes[id] > index.mappedSize) {
+            fprintf(stderr, "Error reading index: section %zu is truncated\n", id);
+            return false;
+        }
+    }
+
+    index.header          = header;
+    index.offtargetsCount = header->offtargetsCount;
+    index.seqLength       = header->seqLength;
+    index.seqCount        = header->seqCount;
+    index.sliceWidth      = header->sliceWidth;
+    index.sliceCount      = header->sliceCount;
+    index.scoresCount     = header->scoresCount;
+    index.layout          = header->layout;
+    index.inlineEncoding.init(index.seqLength);
+
+    if (index.layout != ISSL_LAYOUT_STANDARD && index.layout != ISSL_LAYOUT_COMPACT && (index.layout != ISSL_LAYOUT_INLINE || !InlineEncoding::supports(index.seqLength))) {
+        fprintf(stderr, "Error reading index: unsupported layout %lu\n", (unsigned long)index.layout);
+        return false;
+    }
+
+    /** The slices are `sliceWidth` bits apiece, unless the index has their masks */
+    size_t sliceMasksBytes = 0;
+    const uint64_t *sliceMasks = (const uint64_t *)index.section(ISSL_SECTION_SLICE_MASKS, &sliceMasksBytes);
+    if (index.sliceWidth == 0 && sliceMasks != nullptr && sliceMasksBytes == index.sliceCount * sizeof(uint64_t)) {
+        index.initSlices(std::vector<uint64_t>(sliceMasks, sliceMasks + index.sliceCount));
+    }
+    else if (index.sliceWidth > 0 && index.sliceWidth <= ISSL_MAX_SLICE_BITS && sliceMasks == nullptr) {
+        index.initSlices(uniformSliceMasks(index.sliceWidth, index.sliceCount));
+    }
+    else {
+        fprintf(stderr, "Error reading index: the slices do not match the header\n");
+        return false;
+    }
+    for (uint64_t sliceMask : index.sliceMasks) {
+        if (sliceMask == 0 || __builtin_popcountll(sliceMask) > (int)ISSL_MAX_SLICE_BITS) {
+            fprintf(stderr, "Error reading index: the slices do not match the header\n");
+            return false;
+        }
+    }
+
+    size_t offtargetsBytes = 0, sliceListOffsetsBytes = 0, allSignaturesBytes = 0;
+    const uint64_t *scoreMasks = (const uint64_t *)index.section(ISSL_SECTION_SCORE_MASKS);
+    const double *scores = (const double *)index.section(ISSL_SECTION_SCORES);
+    index.offtargets = (const uint64_t *)index.section(ISSL_SECTION_OFFTARGETS, &offtargetsBytes);
+    index.sliceListOffsets = (const uint64_t *)index.section(ISSL_SECTION_SLICE_OFFSETS, &sliceListOffsetsBytes);
+    index.allSignatures = (const uint64_t *)index.section(ISSL_SECTION_SLICE_CONTENTS, &allSignaturesBytes);
+
+    size_t sliceListOffsetsCount = index.sliceListCount() + 1;
+    size_t contentsBytes = sliceListOffsetsBytes == sliceListOffsetsCount * sizeof(uint64_t) ? index.sliceListOffsets[sliceListOffsetsCount - 1] * sizeof(uint64_t) : 0;
+
+    /** The compact slice contents are encoded ids, located by their own offsets */
+    if (index.layout == ISSL_LAYOUT_COMPACT) {
+        size_t sliceListByteOffsetsBytes = 0, occurrencesBytes = 0;
+        index.compactContents = (const uint8_t *)index.allSignatures;
+        index.allSignatures = nullptr;
+        index.sliceListByteOffsets = (const uint64_t *)index.section(ISSL_SECTION_SLICE_BYTE_OFFSETS, &sliceListByteOffsetsBytes);
+        index.occurrences = (const uint8_t *)index.section(ISSL_SECTION_OCCURRENCES, &occurrencesBytes);
+
+        contentsBytes = 0;
+        if (sliceListByteOffsetsBytes == sliceListOffsetsCount * sizeof(uint64_t) && occurrencesBytes == index.offtargetsCount) {
+            contentsBytes = index.sliceListByteOffsets[sliceListOffsetsCount - 1] + ISSL_COMPACT_PADDING;
+        }
+    }
+
+    if (offtargetsBytes != index.offtargetsCount * sizeof(uint64_t) ||
+        sliceListOffsetsBytes != sliceListOffsetsCount * sizeof(uint64_t) ||
+        allSignaturesBytes != contentsBytes
+    ) {
+        fprintf(stderr, "Error reading index: the sections do not match the header\n");
+        return false;
+    }
+
+    size_t occurrenceOverflowBytes = 0;
+    index.occurrenceOverflow = (const uint64_t *)index.section(ISSL_SECTION_OCCURRENCE_OVERFLOW, &occurrenceOverflowBytes);
+    index.occurrenceOverflowCount = occurrenceOverflowBytes / (2 * sizeof(uint64_t));
+
+    /** The neighbour table is optional, see `NeighbourTable` */
+    size_t neighboursBytes = 0;
+    index.neighbours = (const uint64_t *)index.section(ISSL_SECTION_NEIGHBOURS, &neighboursBytes);
+    if (index.neighbours != nullptr) {
+        index.neighbourCapacity = neighboursBytes / (2 * sizeof(uint64_t));
+        if (index.neighbourCapacity < NeighbourTable::capacity(index.offtargetsCount) || (index.neighbourCapacity & (index.neighbourCapacity - 1)) != 0) {
+            fprintf(stderr, "Error reading index: the neighbour table does not match the header\n");
+            return false;
+        }
+    }
+
+    /** The scores are few, a hash map of them is quick to build */
+    for (size_t i = 0; i < index.scoresCount; i++) {
+        index.precalculatedScores.insert(std::pair<uint64_t, double>(scoreMasks[i], scores[i]));
+    }
+
+    /** Use the dense MIT table in place, if the index has one */
+    size_t mitTableBytes = 0;
+    const double *mitTable = (const double *)index.section(ISSL_SECTION_MIT_TABLE, &mitTableBytes);
+    if (header->mitTableScheme == ISSL_MIT_RANK_COMBINADIC && header->mitTablePositions == index.seqLength && mitTable != nullptr) {
+        index.mitRanking.init(header->mitTablePositions, header->mitTableDistance);
+        if (mitTableBytes != index.mitRanking.size() * sizeof(double)) {
+            fprintf(stderr, "Error reading index: the MIT table does not match the header\n");
+            return false;
+        }
+        index.mitTable = mitTable;
+    }
+    else {
+        index.buildMitTable();
+    }
+
+    return true;
+}
+
+/**
+ * A set of shards is a text file, beginning with `ISSL_SHARDS_HEADER`, that
+ * lists the indexes of which it is made, a path per line. A relative path is
+ * relative to the directory of the shard set.
+ *
+ * Each shard is an index in its own right, with its own off-target ids, so a
+ * shard can be built, or rebuilt, without the others. The scorer scores a
+ * shard set as one index, summing the scores of the off-targets in each
+ * shard, and `isslMergeIndexes` folds its shards into a single index.
+ */
+const char ISSL_SHARDS_HEADER[] = "ISSL shards";
+
+/// Whether the file at `path` is a set of shards, rather than an index
+inline bool isIsslShardSet(const char *path)
+{
+    FILE *fp = fopen(path, "rb");
+    if (fp == NULL) {
+        return false;
+    }
+    char header[sizeof(ISSL_SHARDS_HEADER)] = {0};
+    bool isShardSet = fread(header, 1, sizeof(header) - 1, fp) == sizeof(header) - 1 &&
+        memcmp(header, ISSL_SHARDS_HEADER, sizeof(header) - 1) == 0;
+    fclose(fp);
+    return isShardSet;
+}
+
+/**
+ * Read the shards of the shard set at `path`
+ *
+ * @param[out] shardPaths the path of each shard, resolved against the directory of the shard set
+ * @return false, with a message on stderr, if the shard set could not be read
+ */
+inline bool readIsslShardSet(const char *path, std::vector<std::string> &shardPaths)
+{
+    FILE *fp = fopen(path, "r");
+    if (fp == NULL) {
+        fprintf(stderr, "Error reading shard set: could not open %s\n", path);
+        return false;
+    }
+
+    std::string directory(path);
+    size_t slash = directory.rfind('/');
+    directory = slash == std::string::npos ? "" : directory.substr(0, slash + 1);
+
+    shardPaths.clear();
+    char line[4096];
+    bool first = true;
+    while (fgets(line, sizeof(line), fp) != NULL) {
+        std::string shard(line, strcspn(line, "\r\n"));
+        if (first) {
+            first = false;
+            if (shard != ISSL_SHARDS_HEADER) {
+                fprintf(stderr, "Error reading shard set: %s is not a shard set\n", path);
+                fclose(fp);
+                return false;
+            }
+            continue;
+        }
+        if (shard.empty() || shard[0] == '#') {
+            continue;
+        }
+        shardPaths.push_back(shard[0] == '/' ? shard : directory + shard);
+    }
+    fclose(fp);
+
+    if (shardPaths.empty()) {
+        fprintf(stderr, "Error reading shard set: %s has no shards\n", path);
+        return false;
+    }
+    return true;
+}
+
+/**
+ * Write the shard set `path`, of the shards `shardPaths`, as given
+ *
+ * @param[in] append add the shards to the existing shard set `path`
+ */
+inline bool writeIsslShardSet(const char *path, const std::vector<std::string> &shardPaths, bool append = false)
+{
+    FILE *fp = fopen(path, append ? "a" : "w");
+    if (fp == NULL) {
+        fprintf(stderr, "Error writing shard set: could not open %s\n", path);
+        return false;
+    }
+    if (!append) {
+        fprintf(fp, "%s\n", ISSL_SHARDS_HEADER);
+    }
+    for (const std::string &shard : shardPaths) {
+        fprintf(fp, "%s\n", shard.c_str());
+    }
+    if (fclose(fp) != 0) {
+        fprintf(stderr, "Error writing shard set: could not write %s\n", path);
+        return false;
+    }
+    return true;
+}
+
+/**
+ * Replace each shard set of `paths` by its shards
+ *
+ * @param[out] indexPaths the indexes, in order
+ * @param[out] groups if given, the position within `paths` of each of `indexPaths`
+ * @return false, with a message on stderr, if a shard set could not be read
+ */
+inline bool expandIsslShardSets(const std::vector<std::string> &paths, std::vector<std::string> &indexPaths, std::vector<size_t> *groups = nullptr)
+{
+    indexPaths.clear();
+    if (groups != nullptr) {
+        groups->clear();
+    }
+    for (size_t i = 0; i < paths.size(); i++) {
+        std::vector<std::string> shardPaths(1, paths[i]);
+        if (isIsslShardSet(paths[i].c_str()) && !readIsslShardSet(paths[i].c_str(), shardPaths)) {
+            return false;
+        }
+        for (const std::string &shard : shardPaths) {
+            indexPaths.push_back(shard);
+            if (groups != nullptr) {
+                groups->push_back(i);
+            }
+        }
+    }
+    return true;
+}
+
+/**
+ * Load the ISSL index at `path` into `index`
+ *
+ * @param[in] path the index written by isslCreateIndex, either version
+ * @param[out] index the index to populate
+ * @return false, with a message on stderr, if the index could not be read
+ */
+inline bool loadIsslIndex(const char *path, IsslIndex &index)
+{
+    if (isIsslShardSet(path)) {
+        fprintf(stderr, "Error reading index: %s is a shard set, merge it into one index with isslMergeIndexes\n", path);
+        return false;
+    }
+
+    FILE *fp = fopen(path, "rb");
+    if (fp == NULL) {
+        fprintf(stderr, "Error reading index: could not open %s\n", path);
+        return false;
+    }
+
+    uint64_t magic = 0;
+    if (fread(&magic, sizeof(uint64_t), 1, fp) < 1) {
+        fprintf(stderr, "Error reading index: header invalid\n");
+        fclose(fp);
+        return false;
+    }
+
+    bool loaded;
+    if (magic == ISSL_INDEX_MAGIC) {
+        loaded = loadIsslIndexV2(fileno(fp), index);
+    }
+    else {
+        rewind(fp);
+        loaded = loadIsslIndexV1(fp, index);
+    }
+
+    fclose(fp);
+    return loaded;
+}
+
+/**
+ * Write a version 2 ISSL index, section by section
+ *
+ *      IsslIndexWriter writer(path);
+ *      writer.header.offtargetsCount = ...;
+ *      writer.beginSection(ISSL_SECTION_OFFTARGETS);
+ *      writer.write(offtargets, bytes);
+ *      ...
+ *      writer.finish();
+ */
+class IsslIndexWriter
+{
+public:
+    IsslIndexHeader header;
+
+    IsslIndexWriter(const char *path) : fp(fopen(path, "wb")), position(0), currentSection(ISSL_MAX_SECTIONS), failed(fp == NULL)
+    {
+        memset(&header, 0, sizeof(header));
+        header.magic = ISSL_INDEX_MAGIC;
+        header.version = ISSL_INDEX_VERSION;
+        if (fp == NULL) {
+            fprintf(stderr, "Error writing index: could not open %s\n", path);
+        }
+
+        /** The header is written last, its page is reserved */
+        pad();
+    }
+
+    ~IsslIndexWriter()
+    {
+        if (fp != NULL) {
+            fclose(fp);
+        }
+    }
+
+    /// Begin section `id` on the next page boundary
+    void beginSection(size_t id)
+    {
+        pad();
+        currentSection = id;
+        header.sectionOffsets[id] = position;
+        header.sectionSizes[id] = 0;
+    }
+
+    /// Append `bytes` of `data` to the current section
+    void write(const void *data, size_t bytes)
+    {
+        if (fp == NULL || bytes == 0) {
+            return;
+        }
+        if (fwrite(data, 1, bytes, fp) != bytes) {
+            failed = true;
+        }
+        position += bytes;
+        header.sectionSizes[currentSection] += bytes;
+    }
+
+    /// Write a whole section
+    void writeSection(size_t id, const void *data, size_t bytes)
+    {
+        beginSection(id);
+        write(data, bytes);
+    }
+
+    /// Write the header and close the file
+    bool finish()
+    {
+        if (fp == NULL) {
+            return false;
+        }
+        pad();
+        if (fseek(fp, 0, SEEK_SET) != 0 || fwrite(&header, sizeof(header), 1, fp) != 1) {
+            failed = true;
+        }
+        if (fclose(fp) != 0) {
+            failed = true;
+        }
+        fp = NULL;
+        if (failed) {
+            fprintf(stderr, "Error writing index\n");
+        }
+        return !failed;
+    }
+
+private:
+    FILE *fp;
+    uint64_t position;
+    size_t currentSection;
+    bool failed;
+
+    /// Pad the file to the next page boundary
+    void pad()
+    {
+        static const char zeroes[ISSL_PAGE_SIZE] = {0};
+        size_t padding = (ISSL_PAGE_SIZE - (position % ISSL_PAGE_SIZE)) % ISSL_PAGE_SIZE;
+        if (position == 0) {
+            padding = ISSL_PAGE_SIZE;
+        }
+        if (fp != NULL && padding > 0 && fwrite(zeroes, 1, padding, fp) != padding) {
+            failed = true;
+        }
+        position += padding;
+    }
+};
+
+/**
+ * Write the precalculated MIT scores of `index` as sorted masks and scores
+ */
+inline void writeIsslScores(IsslIndexWriter &writer, const phmap::flat_hash_map<uint64_t, double> &precalculatedScores)
+{
+    std::vector<std::pair<uint64_t, double>> sortedScores(precalculatedScores.begin(), precalculatedScores.end());
+    std::sort(sortedScores.begin(), sortedScores.end());
+
+    writer.header.scoresCount = sortedScores.size();
+
+    writer.beginSection(ISSL_SECTION_SCORE_MASKS);
+    for (auto const &x : sortedScores) {
+        writer.write(&x.first, sizeof(uint64_t));
+    }
+
+    writer.beginSection(ISSL_SECTION_SCORES);
+    for (auto const &x : sortedScores) {
+        writer.write(&x.second, sizeof(double));
+    }
+}
+
+/**
+ * Write the dense MIT table, ranked by `ranking`
+ */
+inline void writeIsslMitTable(IsslIndexWriter &writer, const MismatchRanking &ranking, const std::vector<double> &mitTable)
+{
+    writer.header.mitTableScheme = ISSL_MIT_RANK_COMBINADIC;
+    writer.header.mitTablePositions = ranking.positions;
+    writer.header.mitTableDistance = ranking.maxMismatches;
+    writer.writeSection(ISSL_SECTION_MIT_TABLE, mitTable.data(), mitTable.size() * sizeof(double));
+}
+
+/**
+ * Write the slices, as the width of each in the header or as their masks if
+ * they are given by position, see `parseSliceScheme`
+ */
+inline void writeIsslSliceMasks(IsslIndexWriter &writer, size_t sliceWidth, const std::vector<uint64_t> &sliceMasks)
+{
+    writer.header.sliceWidth = sliceWidth;
+    writer.header.sliceCount = sliceMasks.size();
+    if (sliceWidth == 0) {
+        writer.writeSection(ISSL_SECTION_SLICE_MASKS, sliceMasks.data(), sliceMasks.size() * sizeof(uint64_t));
+    }
+}
+
+/**
+ * Write the neighbour table of the off-targets, see `NeighbourTable`
+ */
+inline void writeIsslNeighbours(IsslIndexWriter &writer, const NeighbourTable &table)
+{
+    writer.writeSection(ISSL_SECTION_NEIGHBOURS, table.slots.data(), table.slots.size() * sizeof(uint64_t));
+}
+
+/**
+ * Write the slice contents in a layout, one entry at a time
+ *
+ *      IsslSliceContentsWriter contents(writer, layout, seqLength);
+ *      contents.write(signature, occurrences, id);
+ *      ...
+ *      contents.endSliceList();
+ *      ...
+ *      contents.finish();
+ *
+ * The header's `offtargetsCount` must be set beforehand. The entries of each
+ * slice list are written in the order given, except in the compact layout,
+ * where they are ordered by id.
+ */
+class IsslSliceContentsWriter
+{
+public:
+    IsslSliceContentsWriter(IsslIndexWriter &writer, uint64_t layout, size_t seqLength) : writer(writer), layout(layout)
+    {
+        encoding.init(seqLength);
+        writer.header.layout = layout;
+        writer.beginSection(ISSL_SECTION_SLICE_CONTENTS);
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            occurrences.resize(writer.header.offtargetsCount);
+            sliceListByteOffsets.push_back(0);
+        }
+        else {
+            buffer.reserve(BUFFER_SIZE);
+        }
+    }
+
+    /// Append the entry of an off-target to the current slice list
+    void write(uint64_t signature, uint64_t occurrences, uint64_t id)
+    {
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            sliceListIds.push_back(id);
+            this->occurrences[id] = std::min(occurrences, ISSL_COMPACT_MAX_OCCURRENCES);
+            if (occurrences >= ISSL_COMPACT_MAX_OCCURRENCES) {
+                overflow[id] = occurrences;
+            }
+            return;
+        }
+
+        if (layout == ISSL_LAYOUT_INLINE) {
+            buffer.push_back(encoding.entry(signature, occurrences));
+            if (occurrences >= encoding.maxOccurrences) {
+                overflow[signature] = occurrences;
+            }
+        }
+        else {
+            buffer.push_back((occurrences << 32) | id);
+        }
+        if (buffer.size() == BUFFER_SIZE) {
+            flush();
+        }
+    }
+
+    /// End the current slice list, the next entry begins the next slice list
+    void endSliceList()
+    {
+        if (layout != ISSL_LAYOUT_COMPACT) {
+            return;
+        }
+        size_t begin = bytes.size();
+        std::sort(sliceListIds.begin(), sliceListIds.end());
+        encodeCompactIds(sliceListIds.data(), sliceListIds.size(), bytes);
+        sliceListByteOffsets.push_back(sliceListByteOffsets.back() + bytes.size() - begin);
+        sliceListIds.clear();
+        if (bytes.size() >= BUFFER_SIZE * sizeof(uint64_t)) {
+            flush();
+        }
+    }
+
+    /// Finish the slice contents, and write any overflowing occurrences
+    void finish()
+    {
+        flush();
+        if (layout == ISSL_LAYOUT_COMPACT) {
+            static const uint8_t padding[ISSL_COMPACT_PADDING] = {0};
+            writer.write(padding, ISSL_COMPACT_PADDING);
+            writer.writeSection(ISSL_SECTION_SLICE_BYTE_OFFSETS, sliceListByteOffsets.data(), sliceListByteOffsets.size() * sizeof(uint64_t));
+            writer.writeSection(ISSL_SECTION_OCCURRENCES, occurrences.data(), occurrences.size());
+        }
+        if (!overflow.empty()) {
+            writer.beginSection(ISSL_SECTION_OCCURRENCE_OVERFLOW);
+            for (auto const &x : overflow) {
+                writer.write(&x.first, sizeof(uint64_t));
+                writer.write(&x.second, sizeof(uint64_t));
+            }
+        }
+    }
+
+private:
+    static const size_t BUFFER_SIZE = 65536;
+
+    IsslIndexWriter &writer;
+    uint64_t layout;
+    InlineEncoding encoding;
+    std::vector<uint64_t> buffer;
+    std::map<uint64_t, uint64_t> overflow;
+
+    /** The compact layout */
+    std::vector<uint32_t> sliceListIds;
+    std::vector<uint8_t> bytes;
+    std::vector<uint64_t> sliceListByteOffsets;
+    std::vector<uint8_t> occurrences;
+
+    void flush()
+    {
+        writer.write(buffer.data(), buffer.size() * sizeof(uint64_t));
+        buffer.clear();
+        writer.write(bytes.data(), bytes.size());
+        bytes.clear();
+    }
+};
+
+/**
+ * Place each of `count` off-targets in its slice list of each slice, by a counting sort across every thread
+ *
+ *      Each thread counts the slice values of a run of the off-targets, so that
+ *      every slice list is sized, and each thread's part of it placed, before
+ *      any entry is written. The threads then write their entries without
+ *      locking, and the entries of each slice list are in the order of the ids.
+ *
+ * @param[in] signatureOf the signature of an off-target, given its id
+ * @param[in] entryOf the slice list entry of an off-target, given its id
+ * @param[out] sliceListOffsets where each slice list begins in `entries`, and where the last ends
+ * @param[out] entries the slice lists of every slice, in turn
+ */
+template <class SignatureOf, class EntryOf>
+inline void sortIntoSliceLists(
+    size_t count,
+    const std::vector<uint64_t> &sliceMasks,
+    SignatureOf signatureOf,
+    EntryOf entryOf,
+    std::vector<uint64_t> &sliceListOffsets,
+    std::vector<uint64_t> &entries
+) {
+    std::vector<size_t> sliceListBases(1, 0);
+    for (uint64_t sliceMask : sliceMasks) {
+        sliceListBases.push_back(sliceListBases.back() + sliceValueCount(sliceMask));
+    }
+    sliceListOffsets.resize(sliceListBases.back() + 1);
+    entries.resize(count * sliceMasks.size());
+
+    for (size_t i = 0; i < sliceMasks.size(); i++) {
+        uint64_t sliceMask = sliceMasks[i];
+        size_t values = sliceValueCount(sliceMask);
+
+        /** A thread is given at least as many off-targets as it has counts, so the counts are no larger than the slice */
+        int threads = (int)std::max((size_t)1, std::min((size_t)omp_get_max_threads(), count / values));
+        size_t chunk = (count + threads - 1) / threads;
+        std::vector<uint64_t> counts(threads * values, 0);
+
+        #pragma omp parallel for num_threads(threads)
+        for (int t = 0; t < threads; t++) {
+            uint64_t *threadCounts = &counts[t * values];
+            for (size_t id = t * chunk; id < std::min(count, (t + 1) * chunk); id++) {
+                threadCounts[extractSliceValue(signatureOf(id), sliceMask)]++;
+            }
+        }
+
+        /** Each slice holds every off-target once, and each thread's run of a slice list follows those of the threads before it */
+        uint64_t offset = i * count;
+        for (size_t value = 0; value < values; value++) {
+            sliceListOffsets[sliceListBases[i] + value] = offset;
+            for (int t = 0; t < threads; t++) {
+                uint64_t threadCount = counts[t * values + value];
+                counts[t * values + value] = offset;
+                offset += threadCount;
+            }
+        }
+
+        #pragma omp parallel for num_threads(threads)
+        for (int t = 0; t < threads; t++) {
+            uint64_t *ends = &counts[t * values];
+            for (size_t id = t * chunk; id < std::min(count, (t + 1) * chunk); id++) {
+                entries[ends[extractSliceValue(signatureOf(id), sliceMask)]++] = entryOf(id);
+            }
+        }
+    }
+    sliceListOffsets[sliceListBases.back()] = count * sliceMasks.size();
+}
+
+/**
+ * Build an index of the standard layout in memory, as isslCreateIndex would
+ *
+ * The precalculated MIT scores are not set, copy them from another index.
+ *
+ * @param[in] offtargets the (signature, occurrences) of each off-target, sorted and distinct
+ * @param[in] sliceWidth the bits per slice, or zero if the slices are given by `sliceMasks`
+ * @param[in] sliceMasks the signature bits of each slice
+ * @param[out] index the index to populate
+ */
+inline void buildIsslIndex(
+    const std::vector<std::pair<uint64_t, uint64_t>> &offtargets,
+    size_t seqLength,
+    size_t sliceWidth,
+    const std::vector<uint64_t> &sliceMasks,
+    IsslIndex &index
+) {
+    index.seqLength = seqLength;
+    index.offtargetsCount = offtargets.size();
+    index.offtargetsStorage.resize(offtargets.size());
+    size_t seqCount = 0;
+    #pragma omp parallel for reduction(+:seqCount)
+    for (size_t id = 0; id < offtargets.size(); id++) {
+        index.offtargetsStorage[id] = offtargets[id].first;
+        seqCount += offtargets[id].second;
+    }
+    index.seqCount = seqCount;
+    index.offtargets = index.offtargetsStorage.data();
+
+    index.sliceWidth = sliceWidth;
+    index.initSlices(sliceMasks);
+    index.layout = ISSL_LAYOUT_STANDARD;
+
+    sortIntoSliceLists(
+        offtargets.size(),
+        sliceMasks,
+        [&](size_t id) { return offtargets[id].first; },
+        [&](size_t id) { return (std::min(offtargets[id].second, (uint64_t)UINT32_MAX) << 32) | id; },
+        index.sliceListOffsetsStorage,
+        index.allSignaturesStorage
+    );
+    index.sliceListOffsets = index.sliceListOffsetsStorage.data();
+    index.allSignatures = index.allSignaturesStorage.data();
+}
+
+/**
+ * Write `index`, of either version and any layout, to `path` as a version 2 index in `layout`
+ *
+ * @param[in] neighbours whether to write a neighbour table, see `NeighbourTable`
+ */
+inline bool writeIsslIndex(const char *path, const IsslIndex &index, uint64_t layout, bool neighbours = false)
+{
+    if (layout == ISSL_LAYOUT_INLINE && !InlineEncoding::supports(index.seqLength)) {
+        fprintf(stderr, "Error writing index: the inline layout does not support a sequence length of %zu\n", index.seqLength);
+        return false;
+    }
+
+    IsslIndexWriter writer(path);
+    writer.header.offtargetsCount = index.offtargetsCount;
+    writer.header.seqLength = index.seqLength;
+    writer.header.seqCount = index.seqCount;
+    writer.header.sliceWidth = index.sliceWidth;
+    writer.header.sliceCount = index.sliceCount;
+
+    size_t sliceListOffsetsCount = index.sliceListCount() + 1;
+
+    writeIsslScores(writer, index.precalculatedScores);
+    writeIsslMitTable(writer, index.mitRanking, std::vector<double>(index.mitTable, index.mitTable + index.mitRanking.size()));
+    writer.writeSection(ISSL_SECTION_OFFTARGETS, index.offtargets, index.offtargetsCount * sizeof(uint64_t));
+    writeIsslSliceMasks(writer, index.sliceWidth, index.sliceMasks);
+    writer.writeSection(ISSL_SECTION_SLICE_OFFSETS, index.sliceListOffsets, sliceListOffsetsCount * sizeof(uint64_t));
+
+    /** The inline layout has no ids, they are found from the off-targets */
+    phmap::flat_hash_map<uint64_t, uint64_t> offtargetIds;
+    if (index.layout == ISSL_LAYOUT_INLINE && layout != ISSL_LAYOUT_INLINE) {
+        for (size_t id = 0; id < index.offtargetsCount; id++) {
+            offtargetIds[index.offtargets[id]] = id;
+        }
+    }
+
+    IsslSliceContentsWriter contents(writer, layout, index.seqLength);
+    for (size_t i = 0; i < index.sliceCount; i++) {
+        for (size_t value = 0; value < index.sliceValues(i); value++) {
+            index.scanSliceList(i, value, [&](uint64_t signature, uint64_t occurrences, uint64_t id) {
+                if (!offtargetIds.empty()) {
+                    id = offtargetIds[signature];
+                }
+                contents.write(signature, occurrences, id);
+                return false;
+            });
+            contents.endSliceList();
+        }
+    }
+    contents.finish();
+
+    /** Each off-target is in exactly one slice list of a slice */
+    if (neighbours) {
+        NeighbourTable table(index.offtargetsCount);
+        for (size_t value = 0; value < index.sliceValues(0); value++) {
+            index.scanSliceList(0, value, [&](uint64_t signature, uint64_t occurrences, uint64_t) {
+                table.insert(signature, occurrences);
+                return false;
+            });
+        }
+        writeIsslNeighbours(writer, table);
+    }
+
+    return writer.finish();
+}
+
+#endif
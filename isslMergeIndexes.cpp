@@ -0,0 +1,141 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Merge ISSL indexes, or the shards of a shard set (see isslIndex.h), into a
+single version 2 index. An off-target found in several indexes is kept once,
+with the sum of its occurrences, so the merged index scores as the indexes do
+together.
+
+The slices of the merged index are those of the first index, unless another
+width or scheme is given, and it may be written in any layout, with or
+without a neighbour table.
+
+
+To compile:
+
+g++ -o isslMergeIndexes isslMergeIndexes.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
+
+*/
+
+#include "isslIndex.h"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+#include <string>
+#include <algorithm>
+
+using namespace std;
+
+int main(int argc, char **argv)
+{
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s [issltable or shard set[,issltable...]] [merged issltable] [slice width (bits) or scheme, or - for that of the first] [layout (standard, inline or compact)] [neighbours]\n", argv[0]);
+        exit(1);
+    }
+
+    uint64_t layout = ISSL_LAYOUT_STANDARD;
+    if (argc > 4 && !parseIsslLayout(argv[4], layout)) {
+        fprintf(stderr, "Unknown layout: %s\n", argv[4]);
+        exit(1);
+    }
+    bool neighbours = false;
+    if (argc > 5) {
+        if (strcmp(argv[5], "neighbours")) {
+            fprintf(stderr, "Unknown option: %s\n", argv[5]);
+            exit(1);
+        }
+        neighbours = true;
+    }
+
+    /** Load each of the indexes, with any shard set replaced by its shards */
+    vector<string> paths;
+    for (const char *begin = argv[1]; ; ) {
+        const char *end = strchr(begin, ',');
+        paths.push_back(end != NULL ? string(begin, end) : string(begin));
+        if (end == NULL) {
+            break;
+        }
+        begin = end + 1;
+    }
+
+    vector<string> indexPaths;
+    if (!expandIsslShardSets(paths, indexPaths)) {
+        return 1;
+    }
+
+    vector<IsslIndex> indexes(indexPaths.size());
+    for (size_t i = 0; i < indexPaths.size(); i++) {
+        if (!loadIsslIndex(indexPaths[i].c_str(), indexes[i])) {
+            return 1;
+        }
+        if (indexes[i].seqLength != indexes[0].seqLength) {
+            fprintf(stderr, "Error: %s has a sequence length of %zu, expected %zu\n",
+                indexPaths[i].c_str(), indexes[i].seqLength, indexes[0].seqLength);
+            return 1;
+        }
+    }
+
+    const IsslIndex &first = indexes[0];
+    size_t sliceWidth = first.sliceWidth;
+    vector<uint64_t> sliceMasks = first.sliceMasks;
+    if (argc > 3 && strcmp(argv[3], "-") && (!parseSliceScheme(argv[3], first.seqLength, sliceMasks, sliceWidth) || sliceMasks.empty())) {
+        fprintf(stderr, "Invalid slice width or scheme: %s\n", argv[3]);
+        exit(1);
+    }
+
+    /** Every off-target is in exactly one slice list of each slice */
+    vector<pair<uint64_t, uint64_t>> offtargets;
+    for (size_t i = 0; i < indexes.size(); i++) {
+        for (uint64_t value = 0; value < indexes[i].sliceValues(0); value++) {
+            indexes[i].scanSliceList(0, value, [&](uint64_t signature, uint64_t occurrences, uint64_t) {
+                offtargets.push_back(make_pair(signature, occurrences));
+                return false;
+            });
+        }
+        printf("Read %zu off-targets from %s\n", indexes[i].offtargetsCount, indexPaths[i].c_str());
+    }
+
+    /** An off-target in several indexes is kept once, with the sum of its occurrences */
+    sort(offtargets.begin(), offtargets.end());
+    size_t merged = 0;
+    for (size_t j = 0; j < offtargets.size(); j++) {
+        if (merged > 0 && offtargets[merged - 1].first == offtargets[j].first) {
+            offtargets[merged - 1].second += offtargets[j].second;
+        }
+        else {
+            offtargets[merged++] = offtargets[j];
+        }
+    }
+    offtargets.resize(merged);
+
+    printf("Merged into %zu off-targets, now constructing index...\n", offtargets.size());
+
+    IsslIndex index;
+    buildIsslIndex(offtargets, first.seqLength, sliceWidth, sliceMasks, index);
+
+    /** The MIT scores are the same for every index, those of the first are kept */
+    index.precalculatedScores = first.precalculatedScores;
+    index.scoresCount = first.scoresCount;
+    index.mitRanking = first.mitRanking;
+    index.mitTableStorage.assign(first.mitTable, first.mitTable + first.mitRanking.size());
+    index.mitTable = index.mitTableStorage.data();
+    if (index.sliceCount > maxScoreMismatches(index.precalculatedScores) + 1) {
+        fprintf(stderr, "Warning: %s has MIT scores for off-targets within %zu mismatches, the merged index finds those within %zu\n",
+            indexPaths[0].c_str(), maxScoreMismatches(index.precalculatedScores), index.sliceCount - 1);
+    }
+
+    printf("Writing to disk...\n");
+
+    if (!writeIsslIndex(argv[2], index, layout, neighbours)) {
+        return 1;
+    }
+
+    printf("Done.\n");
+    return 0;
+}
@@ -0,0 +1,278 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Finding the entries of a slice list within the maximum distance of a query.
+Most entries of a slice list are not, so they are filtered out several at a
+time with AVX2 or AVX-512 where the CPU has them, chosen when first used.
+The entries that remain are scored one at a time, in order, by the caller.
+
+*/
+
+#ifndef ISSL_SCAN_H
+#define ISSL_SCAN_H
+
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <immintrin.h>
+
+/** The instructions used to filter slice lists */
+enum ScanKernel
+{
+    SCAN_KERNEL_SCALAR = 0,
+    /// four entries at a time
+    SCAN_KERNEL_AVX2 = 1,
+    /// eight entries at a time, AVX-512F and AVX-512BW
+    SCAN_KERNEL_AVX512 = 2,
+
+    SCAN_KERNEL_COUNT = 3
+};
+
+/** The names of the kernels, as given to `ISSL_SCAN_KERNEL` */
+const char *const scanKernelNames[SCAN_KERNEL_COUNT] = {"scalar", "avx2", "avx512"};
+
+/// Whether the CPU has the instructions of `kernel`
+inline bool scanKernelSupported(ScanKernel kernel)
+{
+    __builtin_cpu_init();
+    switch (kernel) {
+        case SCAN_KERNEL_AVX2:
+            return __builtin_cpu_supports("avx2");
+        case SCAN_KERNEL_AVX512:
+            return __builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512bw");
+        default:
+            return true;
+    }
+}
+
+/**
+ * The kernel used to filter slice lists
+ *
+ *      The widest that the CPU has, unless the environment variable
+ *      `ISSL_SCAN_KERNEL` names a narrower one (scalar, avx2 or avx512)
+ */
+inline ScanKernel &scanKernel()
+{
+    static ScanKernel kernel = []() {
+        ScanKernel widest = SCAN_KERNEL_SCALAR;
+        for (int k = SCAN_KERNEL_AVX2; k < SCAN_KERNEL_COUNT; k++) {
+            if (scanKernelSupported((ScanKernel)k)) {
+                widest = (ScanKernel)k;
+            }
+        }
+
+        const char *name = getenv("ISSL_SCAN_KERNEL");
+        for (int k = 0; name != NULL && k <= widest; k++) {
+            if (!strcmp(name, scanKernelNames[k])) {
+                return (ScanKernel)k;
+            }
+        }
+        return widest;
+    }();
+    return kernel;
+}
+
+/** Where the off-targets of the entries of a slice list are */
+enum ScanSource
+{
+    /// the entries are inline, the off-target is under the signature mask
+    SCAN_SOURCE_SIGNATURES = 0,
+    /// the entries are standard, the off-target id is in the low 32 bits
+    SCAN_SOURCE_ENTRY_IDS = 1,
+    /// the entries are the decoded 32-bit ids of a compact slice list
+    SCAN_SOURCE_COMPACT_IDS = 2
+};
+
+/** The entries of a slice list, as filtered by `nearEntries` */
+struct ScanEntries
+{
+    /// the entries, of the type given by the source
+    const void *entries;
+    ScanSource source;
+
+    /// the off-targets of the index, and the signature mask of an inline entry
+    const uint64_t *offtargets;
+    uint64_t signatureMask;
+
+    /// The off-target of entry `j`
+    uint64_t offtarget(size_t j) const
+    {
+        switch (source) {
+            case SCAN_SOURCE_SIGNATURES:
+                return ((const uint64_t *)entries)[j] & signatureMask;
+            case SCAN_SOURCE_ENTRY_IDS:
+                return offtargets[((const uint64_t *)entries)[j] & 0xFFFFFFFFull];
+            default:
+                return offtargets[((const uint32_t *)entries)[j]];
+        }
+    }
+};
+
+/**
+ * The entries from `begin` to `end` within `maxDist` of the query, one at a time
+ *
+ * @param[in] scan the entries
+ * @param[in] begin the first entry
+ * @param[in] end one past the last entry
+ * @param[in] searchSignature the binary encoded query
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[out] near the positions of the entries within `maxDist`, ascending
+ * @return the number of entries within `maxDist`
+ */
+template <int Source>
+size_t nearEntriesScalar(const ScanEntries &scan, size_t begin, size_t end, uint64_t searchSignature, int maxDist, uint32_t *near)
+{
+    size_t count = 0;
+    for (size_t j = begin; j < end; j++) {
+        uint64_t offtarget;
+        if (Source == SCAN_SOURCE_SIGNATURES) {
+            offtarget = ((const uint64_t *)scan.entries)[j] & scan.signatureMask;
+        }
+        else if (Source == SCAN_SOURCE_ENTRY_IDS) {
+            offtarget = scan.offtargets[((const uint64_t *)scan.entries)[j] & 0xFFFFFFFFull];
+        }
+        else {
+            offtarget = scan.offtargets[((const uint32_t *)scan.entries)[j]];
+        }
+        uint64_t xoredSignatures = searchSignature ^ offtarget;
+        uint64_t mismatches = ((xoredSignatures >> 1) | xoredSignatures) & 0x5555555555555555ull;
+        near[count] = j;
+        count += __builtin_popcountll(mismatches) <= maxDist;
+    }
+    return count;
+}
+
+/**
+ * As `nearEntriesScalar`, four entries at a time
+ *
+ *      The mismatches of each entry have at most one bit in each pair, so a
+ *      byte holds at most four. They are summed in pairs, then nibbles, then
+ *      bytes, as there is no 64-bit popcount in AVX2.
+ */
+template <int Source>
+__attribute__((target("avx2")))
+size_t nearEntriesAvx2(const ScanEntries &scan, size_t begin, size_t end, uint64_t searchSignature, int maxDist, uint32_t *near)
+{
+    const __m256i query = _mm256_set1_epi64x(searchSignature);
+    const __m256i signatureMask = _mm256_set1_epi64x(scan.signatureMask);
+    const __m256i idMask = _mm256_set1_epi64x(0xFFFFFFFFll);
+    const __m256i oddBits = _mm256_set1_epi64x(0x5555555555555555ll);
+    const __m256i pairBits = _mm256_set1_epi64x(0x3333333333333333ll);
+    const __m256i nibbleBits = _mm256_set1_epi64x(0x0F0F0F0F0F0F0F0Fll);
+    const __m256i limit = _mm256_set1_epi64x(maxDist);
+    const __m256i zero = _mm256_setzero_si256();
+
+    size_t count = 0;
+    size_t j = begin;
+    for (; j + 4 <= end; j += 4) {
+        __m256i offtargets;
+        if (Source == SCAN_SOURCE_SIGNATURES) {
+            offtargets = _mm256_and_si256(_mm256_loadu_si256((const __m256i *)((const uint64_t *)scan.entries + j)), signatureMask);
+        }
+        else if (Source == SCAN_SOURCE_ENTRY_IDS) {
+            __m256i ids = _mm256_and_si256(_mm256_loadu_si256((const __m256i *)((const uint64_t *)scan.entries + j)), idMask);
+            offtargets = _mm256_i64gather_epi64((const long long *)scan.offtargets, ids, 8);
+        }
+        else {
+            // the ids are unsigned, a 32-bit gather would sign-extend those of 2^31 or more
+            __m256i ids = _mm256_cvtepu32_epi64(_mm_loadu_si128((const __m128i *)((const uint32_t *)scan.entries + j)));
+            offtargets = _mm256_i64gather_epi64((const long long *)scan.offtargets, ids, 8);
+        }
+
+        __m256i xoredSignatures = _mm256_xor_si256(query, offtargets);
+        __m256i mismatches = _mm256_and_si256(_mm256_or_si256(_mm256_srli_epi64(xoredSignatures, 1), xoredSignatures), oddBits);
+        mismatches = _mm256_add_epi64(_mm256_and_si256(mismatches, pairBits), _mm256_and_si256(_mm256_srli_epi64(mismatches, 2), pairBits));
+        mismatches = _mm256_and_si256(_mm256_add_epi64(mismatches, _mm256_srli_epi64(mismatches, 4)), nibbleBits);
+        __m256i dist = _mm256_sad_epu8(mismatches, zero);
+
+        unsigned far = _mm256_movemask_pd(_mm256_castsi256_pd(_mm256_cmpgt_epi64(dist, limit)));
+        for (unsigned hits = ~far & 0xF; hits; hits &= hits - 1) {
+            near[count++] = j + __builtin_ctz(hits);
+        }
+    }
+
+    return count + nearEntriesScalar<Source>(scan, j, end, searchSignature, maxDist, near + count);
+}
+
+/**
+ * As `nearEntriesAvx2`, eight entries at a time
+ */
+template <int Source>
+__attribute__((target("avx512f,avx512bw")))
+size_t nearEntriesAvx512(const ScanEntries &scan, size_t begin, size_t end, uint64_t searchSignature, int maxDist, uint32_t *near)
+{
+    const __m512i query = _mm512_set1_epi64(searchSignature);
+    const __m512i signatureMask = _mm512_set1_epi64(scan.signatureMask);
+    const __m512i idMask = _mm512_set1_epi64(0xFFFFFFFFll);
+    const __m512i oddBits = _mm512_set1_epi64(0x5555555555555555ll);
+    const __m512i pairBits = _mm512_set1_epi64(0x3333333333333333ll);
+    const __m512i nibbleBits = _mm512_set1_epi64(0x0F0F0F0F0F0F0F0Fll);
+    const __m512i limit = _mm512_set1_epi64(maxDist);
+    const __m512i zero = _mm512_setzero_si512();
+
+    size_t count = 0;
+    size_t j = begin;
+    for (; j + 8 <= end; j += 8) {
+        __m512i offtargets;
+        if (Source == SCAN_SOURCE_SIGNATURES) {
+            offtargets = _mm512_and_si512(_mm512_loadu_si512((const uint64_t *)scan.entries + j), signatureMask);
+        }
+        else if (Source == SCAN_SOURCE_ENTRY_IDS) {
+            __m512i ids = _mm512_and_si512(_mm512_loadu_si512((const uint64_t *)scan.entries + j), idMask);
+            offtargets = _mm512_i64gather_epi64(ids, (const long long *)scan.offtargets, 8);
+        }
+        else {
+            __m512i ids = _mm512_cvtepu32_epi64(_mm256_loadu_si256((const __m256i *)((const uint32_t *)scan.entries + j)));
+            offtargets = _mm512_i64gather_epi64(ids, (const long long *)scan.offtargets, 8);
+        }
+
+        __m512i xoredSignatures = _mm512_xor_si512(query, offtargets);
+        __m512i mismatches = _mm512_and_si512(_mm512_or_si512(_mm512_srli_epi64(xoredSignatures, 1), xoredSignatures), oddBits);
+        mismatches = _mm512_add_epi64(_mm512_and_si512(mismatches, pairBits), _mm512_and_si512(_mm512_srli_epi64(mismatches, 2), pairBits));
+        mismatches = _mm512_and_si512(_mm512_add_epi64(mismatches, _mm512_srli_epi64(mismatches, 4)), nibbleBits);
+        __m512i dist = _mm512_sad_epu8(mismatches, zero);
+
+        for (unsigned hits = _mm512_cmple_epu64_mask(dist, limit); hits; hits &= hits - 1) {
+            near[count++] = j + __builtin_ctz(hits);
+        }
+    }
+
+    return count + nearEntriesScalar<Source>(scan, j, end, searchSignature, maxDist, near + count);
+}
+
+/**
+ * The entries from `begin` to `end` within `maxDist` of the query, see `nearEntriesScalar`
+ *
+ *      Filtered with `kernel`, which the CPU must have, see `scanKernel`
+ */
+template <int Source>
+size_t nearEntries(ScanKernel kernel, const ScanEntries &scan, size_t begin, size_t end, uint64_t searchSignature, int maxDist, uint32_t *near)
+{
+    switch (kernel) {
+        case SCAN_KERNEL_AVX512:
+            return nearEntriesAvx512<Source>(scan, begin, end, searchSignature, maxDist, near);
+        case SCAN_KERNEL_AVX2:
+            return nearEntriesAvx2<Source>(scan, begin, end, searchSignature, maxDist, near);
+        default:
+            return nearEntriesScalar<Source>(scan, begin, end, searchSignature, maxDist, near);
+    }
+}
+
+/// As `nearEntries`, for the source of `scan`
+inline size_t nearEntries(ScanKernel kernel, const ScanEntries &scan, size_t begin, size_t end, uint64_t searchSignature, int maxDist, uint32_t *near)
+{
+    switch (scan.source) {
+        case SCAN_SOURCE_SIGNATURES:
+            return nearEntries<SCAN_SOURCE_SIGNATURES>(kernel, scan, begin, end, searchSignature, maxDist, near);
+        case SCAN_SOURCE_ENTRY_IDS:
+            return nearEntries<SCAN_SOURCE_ENTRY_IDS>(kernel, scan, begin, end, searchSignature, maxDist, near);
+        default:
+            return nearEntries<SCAN_SOURCE_COMPACT_IDS>(kernel, scan, begin, end, searchSignature, maxDist, near);
+    }
+}
+
+#endif
@@ -9,20 +9,78 @@ To compile:
 
 g++ -o isslScoreOfftargets isslScoreOfftargets.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
 
+
+To run as a daemon, which loads the index once and then scores the requests
+received on a Unix domain socket, or on a TCP port given as `host:port`:
+
+./isslScoreOfftargets --daemon [issltable] [socket path or host:port]
+
+Each request is a line, `SCORE <max distance> <score-threshold> <score-method> <count> [pam] [threads]`,
+followed by `count` lines of queries. The response is a line, `OK <count>`, followed
+by the scores of each query in the same format as printed by the scorer. Otherwise,
+the response is `ERROR <message>`. The request `SHUTDOWN` stops the daemon.
+
+The request `PARTIAL`, of the same form, reports the sums of the local scores
+of each query instead, `<sequence>\t<mit>\t<cfd>\t<exited>`, so that several
+daemons, each given part of the index, can score a page together and add
+their sums (see IsslCluster.py). A query exits early once the sums of a daemon
+alone cross the threshold, as the sums over every daemon can only be larger.
+
+The request `INFO` reports the index files that the daemon serves, with any shard
+set replaced by its shards, so that a client can check that it is scored against
+the index it expects. The response is `OK <count>`, followed by a line per file,
+`<path>\t<size>\t<modification time in ns>`, as when the file was loaded. Given
+`INFO checksums`, each line is followed by `\t<crc-32>` of the contents of the
+file, in hex, which is calculated on the first request and then kept.
+
+
+By default, the scorer prints a line per query, `<sequence>\t<mit>\t<cfd>`. With
+`--output-format=float64` or `float32`, it instead writes an `IsslScoresHeader`,
+followed by the MIT score of each query and then the CFD score of each query,
+in the order of the query file, as little-endian floats of that width. Scores
+that the score method does not calculate are -1, as when printed.
+
+Several indexes, separated by commas, are scored as if they were one: the local
+scores of the off-targets in each are added to the same global scores, and a
+query exits early once they cross the threshold, before scanning any further
+index. The scores against each index alone follow the combined scores, as more
+columns of each line, or more pairs of arrays. A query that exits early has
+scores only for the off-targets found before then, as for one index.
+
+A shard set (see isslIndex.h) is scored as its shards, which are each an
+index, but its scores are reported as those of one index.
+
+Queries are read from a file, or from stdin when the file is `-`. Given
+`--chunk-size`, or reading from stdin, the queries are read, scored and their scores
+written and flushed a chunk at a time, so that memory does not grow with the
+number of queries and the caller can stream them. In the binary formats, each
+chunk is written with its own header.
+
+Given `--stats=<file>`, the counters of each query, and their sums, are written
+to it as JSON once every query is scored, see `writeStats`. The counters of each
+query are kept until then, even when scoring in chunks. Given `--stats` or
+`--verbose`, the time each thread was busy and the slice list entries scanned
+per query are also reported on stderr, otherwise only the scores are written.
+
 */
 
-#include "cfdPenalties.h"
+#include "isslIndex.h"
+#include "isslScoring.h"
 
 #include <cstdio>
 #include <cstdlib>
 #include <cstdint>
 #include <vector>
 #include <string>
-#include <unordered_set>
-#include <unordered_map>
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <sys/socket.h>
+#include <sys/file.h>
+#include <sys/un.h>
+#include <netdb.h>
 #include <unistd.h>
+#include <fcntl.h>
+#include <cerrno>
 #include <stdint.h>
 #include <sys/time.h>
 #include <chrono>
@@ -34,473 +92,845 @@ g++ -o isslScoreOfftargets isslScoreOfftargets.cpp -O3 -std=c++11 -fopenmp -mpop
 #include <omp.h>
 #include <phmap.h>
 #include <map>
+#include <mutex>
+#include <thread>
+#include <functional>
 
 using namespace std;
 
-size_t seqLength, seqCount, sliceWidth, sliceCount, offtargetsCount, scoresCount;
+SignatureEncoding encoding;
 
-vector<uint8_t> nucleotideIndex(256);
-vector<char> signatureIndex(4);
+/** The number of queries read from stdin before scoring them and writing their scores */
+const size_t QUERY_CHUNK_SIZE = 65536;
 
-/// Returns the size (bytes) of the file at `path`
-size_t getFileSize(const char *path)
+/** Only one request is scored at a time, each uses every thread */
+mutex scoringMutex;
+
+/** An index file served by the daemon, as reported by `INFO` */
+struct ServedIndexFile
+{
+    string path;
+    int fd = -1;
+    long long size = 0;
+    long long mtimeNs = 0;
+    bool checksummed = false;
+    uint32_t checksum = 0;
+};
+
+/** The checksums of the served index files are calculated by one request at a time */
+mutex checksumMutex;
+
+const uint64_t ISSL_SCORES_MAGIC = 0x524F43534C535349ull;
+const uint32_t ISSL_SCORES_VERSION = 2;
+
+/** The header of the binary scores, see above */
+struct IsslScoresHeader
 {
-    struct stat64 statBuf;
-    stat64(path, &statBuf);
-    return statBuf.st_size;
+    uint64_t magic;
+    uint32_t version;
+    uint32_t scoreBytes;
+    uint64_t queryCount;
+
+    /// the indexes whose own scores follow the combined scores, zero if there is one index
+    uint64_t indexCount;
+};
+
+/**
+ * Print global scores to `fp`
+ *
+ * @param[in] indexMitScores the global MIT scores against each index alone,
+ *      printed after the combined scores if there are several indexes
+ * @param[in] indexCfdScores likewise, the global CFD scores
+ */
+void printScores(
+    FILE *fp,
+    size_t seqLength,
+    const string &scoreMethod,
+    const vector<uint64_t> &querySignatures,
+    const vector<double> &querySignatureMitScores,
+    const vector<double> &querySignatureCfdScores,
+    const vector<vector<double>> &indexMitScores = vector<vector<double>>(),
+    const vector<vector<double>> &indexCfdScores = vector<vector<double>>()
+) {
+    bool calcMit = (!scoreMethod.compare("mit") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+    bool calcCfd = (!scoreMethod.compare("cfd") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+
+    for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
+        auto querySequence = encoding.signatureToSequence(querySignatures[searchIdx], seqLength);
+        fprintf(fp, "%s", querySequence.c_str());
+        for (size_t set = 0; set <= indexMitScores.size(); set++) {
+            const vector<double> &mitScores = set == 0 ? querySignatureMitScores : indexMitScores[set - 1];
+            const vector<double> &cfdScores = set == 0 ? querySignatureCfdScores : indexCfdScores[set - 1];
+            if (calcMit)
+                fprintf(fp, "\t%f", mitScores[searchIdx]);
+            else
+                fprintf(fp, "\t-1");
+
+            if (calcCfd)
+                fprintf(fp, "\t%f", cfdScores[searchIdx]);
+            else
+                fprintf(fp, "\t-1");
+        }
+        fprintf(fp, "\n");
+    }
+}
+
+/**
+ * Write global scores to `fp` as arrays of floats, see above
+ *
+ * @tparam Float the type of each score, float or double
+ * @param[in] indexMitScores the global MIT scores against each index alone, see `printScores`
+ * @param[in] indexCfdScores likewise, the global CFD scores
+ */
+template <typename Float>
+bool writeScores(
+    FILE *fp,
+    const string &scoreMethod,
+    const vector<double> &querySignatureMitScores,
+    const vector<double> &querySignatureCfdScores,
+    const vector<vector<double>> &indexMitScores,
+    const vector<vector<double>> &indexCfdScores
+) {
+    bool calcMit = (!scoreMethod.compare("mit") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+    bool calcCfd = (!scoreMethod.compare("cfd") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+
+    IsslScoresHeader header;
+    header.magic = ISSL_SCORES_MAGIC;
+    header.version = ISSL_SCORES_VERSION;
+    header.scoreBytes = sizeof(Float);
+    header.queryCount = querySignatureMitScores.size();
+    header.indexCount = indexMitScores.size();
+
+    if (fwrite(&header, sizeof(header), 1, fp) != 1) {
+        return false;
+    }
+
+    vector<Float> mitScores(header.queryCount, (Float)-1);
+    vector<Float> cfdScores(header.queryCount, (Float)-1);
+    for (size_t set = 0; set <= indexMitScores.size(); set++) {
+        const vector<double> &setMitScores = set == 0 ? querySignatureMitScores : indexMitScores[set - 1];
+        const vector<double> &setCfdScores = set == 0 ? querySignatureCfdScores : indexCfdScores[set - 1];
+        for (size_t i = 0; i < header.queryCount; i++) {
+            if (calcMit)
+                mitScores[i] = (Float)setMitScores[i];
+            if (calcCfd)
+                cfdScores[i] = (Float)setCfdScores[i];
+        }
+
+        if (fwrite(mitScores.data(), sizeof(Float), mitScores.size(), fp) != mitScores.size() ||
+            fwrite(cfdScores.data(), sizeof(Float), cfdScores.size(), fp) != cfdScores.size()) {
+            return false;
+        }
+    }
+    return fflush(fp) == 0;
 }
 
+/** The parameters of a scoring run, reported with its stats */
+struct StatsRun
+{
+    int maxDist;
+    double threshold;
+    string scoreMethod;
+    string schedule;
+    string sliceOrder;
+    size_t chunkSize;
+    double seconds;
+};
+
 /**
- * Binary encode genetic string `ptr`
+ * Write the counters of a scoring run to `fp` as JSON
  *
- * For example, 
- *   ATCG becomes
- *   00 11 01 10  (buffer with leading zeroes to encode as 64-bit unsigned int)
+ *      The object holds the parameters of the run, the sums of the counters,
+ *      and `queries`, an array of the counters of each query in the order of
+ *      the query file, each `[entries scanned, entries within maxDist,
+ *      off-targets scored, exit slice, seconds]`, see `QueryStats`. With
+ *      several indexes, the counters are summed over them, and the slices of
+ *      each are numbered after those of the indexes before it.
+ */
+void writeStats(FILE *fp, const vector<IsslIndex> &indexes, const StatsRun &run, const ScoringStats &stats)
+{
+    const char *layoutNames[] = {"standard", "inline", "compact"};
+
+    fprintf(fp, "{\n");
+    fprintf(fp, "  \"indexes\": [");
+    for (size_t i = 0; i < indexes.size(); i++) {
+        const IsslIndex &index = indexes[i];
+        fprintf(fp, "%s\n    {\"offtargets\": %zu, \"slices\": %zu, \"slice_scheme\": \"%s\", \"layout\": \"%s\", \"neighbours\": %s}",
+            i > 0 ? "," : "", index.offtargetsCount, index.sliceCount, sliceSchemeName(index.sliceMasks).c_str(),
+            index.layout < 3 ? layoutNames[index.layout] : "unknown", index.neighbours != nullptr ? "true" : "false");
+    }
+    fprintf(fp, "\n  ],\n");
+    fprintf(fp, "  \"parameters\": {\"max_distance\": %d, \"threshold\": %g, \"score_method\": \"%s\", \"schedule\": \"%s\", \"slice_order\": \"%s\", \"chunk_size\": %zu, \"scan_kernel\": \"%s\"},\n",
+        run.maxDist, run.threshold, run.scoreMethod.c_str(), run.schedule.c_str(), run.sliceOrder.c_str(), run.chunkSize, scanKernelNames[scanKernel()]);
+    fprintf(fp, "  \"seconds\": %.6f,\n", run.seconds);
+
+    fprintf(fp, "  \"thread_busy_seconds\": [");
+    for (size_t i = 0; i < stats.threadBusySeconds.size(); i++) {
+        fprintf(fp, "%s%.6f", i > 0 ? ", " : "", stats.threadBusySeconds[i]);
+    }
+    fprintf(fp, "],\n");
+
+    fprintf(fp, "  \"totals\": {\"queries\": %zu, \"entries_scanned\": %zu, \"entries_near\": %zu, \"offtargets_scored\": %zu, \"early_exits\": %zu},\n",
+        stats.queries.size(), stats.entriesScanned, stats.entriesNear, stats.offtargetsScored, stats.earlyExits);
+
+    /** The queries that exited early, by the number of slices scanned, zero for those exiting on the neighbour table */
+    fprintf(fp, "  \"exits_by_slice\": [");
+    for (size_t i = 0; i < stats.exitsBySlice.size(); i++) {
+        fprintf(fp, "%s%zu", i > 0 ? ", " : "", stats.exitsBySlice[i]);
+    }
+    fprintf(fp, "],\n");
+
+    fprintf(fp, "  \"query_fields\": [\"entries_scanned\", \"entries_near\", \"offtargets_scored\", \"exit_slice\", \"seconds\"],\n");
+    fprintf(fp, "  \"queries\": [");
+    for (size_t i = 0; i < stats.queries.size(); i++) {
+        const QueryStats &query = stats.queries[i];
+        fprintf(fp, "%s\n    [%lu, %lu, %lu, %d, %.7f]", i > 0 ? "," : "",
+            (unsigned long)query.entriesScanned, (unsigned long)query.entriesNear, (unsigned long)query.offtargetsScored,
+            (int)query.exitSlice, query.seconds);
+    }
+    fprintf(fp, "%s]\n", stats.queries.empty() ? "" : "\n  ");
+    fprintf(fp, "}\n");
+}
+
+/**
+ * Load the indexes of `list`, separated by commas, with any shard set replaced by its shards
  *
- * @param[in] ptr the string containing ATCG to binary encode
+ * @param[out] indexes the indexes, in order
+ * @param[out] groups the position within `list` of each of `indexes`
+ * @param[out] indexPaths the path of each of `indexes`
+ * @return the number of indexes in `list`, or zero, with a message on stderr, if one could not be loaded
  */
-uint64_t sequenceToSignature(const char *ptr)
+size_t loadIsslIndexes(const char *list, vector<IsslIndex> &indexes, vector<size_t> &groups, vector<string> &indexPaths)
 {
-    uint64_t signature = 0;
-    for (size_t j = 0; j < seqLength; j++) {
-        signature |= (uint64_t)(nucleotideIndex[*ptr]) << (j * 2);
-        ptr++;
+    vector<string> paths;
+    for (const char *begin = list; ; ) {
+        const char *end = strchr(begin, ',');
+        paths.push_back(end != NULL ? string(begin, end) : string(begin));
+        if (end == NULL) {
+            break;
+        }
+        begin = end + 1;
+    }
+
+    if (!expandIsslShardSets(paths, indexPaths, &groups)) {
+        return 0;
+    }
+
+    vector<IsslIndex>(indexPaths.size()).swap(indexes);
+    for (size_t i = 0; i < indexPaths.size(); i++) {
+        if (!loadIsslIndex(indexPaths[i].c_str(), indexes[i])) {
+            return 0;
+        }
+        if (indexes[i].seqLength != indexes[0].seqLength) {
+            fprintf(stderr, "Error: %s has a sequence length of %zu, expected %zu\n",
+                indexPaths[i].c_str(), indexes[i].seqLength, indexes[0].seqLength);
+            return 0;
+        }
+    }
+    return paths.size();
+}
+
+/**
+ * Print the sums of the local scores of each query to `fp`, as `<sequence>\t<mit>\t<cfd>\t<exited>`
+ *
+ *      The sums are printed in full, so that the sums of several daemons can
+ *      be added as if they had been summed by one.
+ */
+void printPartialScores(
+    FILE *fp,
+    size_t seqLength,
+    const vector<uint64_t> &querySignatures,
+    const vector<double> &totScoresMit,
+    const vector<double> &totScoresCfd,
+    const vector<char> &exited
+) {
+    for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
+        auto querySequence = encoding.signatureToSequence(querySignatures[searchIdx], seqLength);
+        fprintf(fp, "%s\t%.17g\t%.17g\t%d\n", querySequence.c_str(), totScoresMit[searchIdx], totScoresCfd[searchIdx], exited[searchIdx] ? 1 : 0);
+    }
+}
+
+/**
+ * Calculate the CRC-32 of the contents of the file `fd`, as by zlib's `crc32`
+ *
+ * @return false if the file could not be read
+ */
+bool fileCrc32(int fd, uint32_t &crc)
+{
+    static uint32_t table[256];
+    static bool tableBuilt = false;
+    if (!tableBuilt) {
+        for (uint32_t i = 0; i < 256; i++) {
+            uint32_t c = i;
+            for (int bit = 0; bit < 8; bit++) {
+                c = (c & 1) ? 0xEDB88320u ^ (c >> 1) : c >> 1;
+            }
+            table[i] = c;
+        }
+        tableBuilt = true;
+    }
+
+    vector<unsigned char> block(1 << 24);
+    crc = 0xFFFFFFFFu;
+    off_t offset = 0;
+    ssize_t bytesRead;
+    while ((bytesRead = pread(fd, block.data(), block.size(), offset)) > 0) {
+        for (ssize_t i = 0; i < bytesRead; i++) {
+            crc = table[(crc ^ block[i]) & 0xFF] ^ (crc >> 8);
+        }
+        offset += bytesRead;
+    }
+    crc ^= 0xFFFFFFFFu;
+    return bytesRead == 0;
+}
+
+/**
+ * Report the index files served by the daemon to `out`, see `INFO`
+ *
+ * @param[in,out] files the served index files, whose checksums are kept once calculated
+ * @param[in] checksums whether to report the checksum of each file
+ */
+void printServedIndexFiles(FILE *out, vector<ServedIndexFile> &files, bool checksums)
+{
+    if (checksums) {
+        lock_guard<mutex> lock(checksumMutex);
+        for (ServedIndexFile &file : files) {
+            if (!file.checksummed && !fileCrc32(file.fd, file.checksum)) {
+                fprintf(out, "ERROR could not read %s\n", file.path.c_str());
+                return;
+            }
+            file.checksummed = true;
+        }
+    }
+
+    fprintf(out, "OK %zu\n", files.size());
+    for (const ServedIndexFile &file : files) {
+        fprintf(out, "%s\t%lld\t%lld", file.path.c_str(), file.size, file.mtimeNs);
+        if (checksums) {
+            fprintf(out, "\t%08x", file.checksum);
+        }
+        fprintf(out, "\n");
+    }
+}
+
+/**
+ * Serve the requests of one daemon client until it disconnects
+ *
+ * @param[in] indexes the ISSL indexes, scored as one
+ * @param[in] files the index files that `indexes` were loaded from, reported by `INFO`
+ * @param[in] fd the connected socket
+ * @param[in] listenFd the listening socket, closed on `SHUTDOWN`
+ */
+void serveDaemonClient(const vector<IsslIndex> &indexes, vector<ServedIndexFile> &files, int fd, int listenFd)
+{
+    FILE *in = fdopen(fd, "r");
+    FILE *out = fdopen(dup(fd), "w");
+    size_t seqLength = indexes[0].seqLength;
+
+    char line[256];
+    while (fgets(line, sizeof(line), in) != NULL) {
+        char requestBuf[16];
+        int maxDist = 0;
+        double threshold = 0.0;
+        char scoreMethodBuf[16];
+        char pamBuf[16] = "NGG";
+        size_t queryCount = 0;
+        int threads = 0;
+
+        if (strncmp(line, "SHUTDOWN", 8) == 0) {
+            fprintf(out, "OK 0\n");
+            fflush(out);
+            shutdown(listenFd, SHUT_RDWR);
+            break;
+        }
+
+        if (strncmp(line, "INFO", 4) == 0) {
+            printServedIndexFiles(out, files, strstr(line + 4, "checksums") != NULL);
+            fflush(out);
+            continue;
+        }
+
+        if (sscanf(line, "%15s %d %lf %15s %zu %15s %d", requestBuf, &maxDist, &threshold, scoreMethodBuf, &queryCount, pamBuf, &threads) < 5 ||
+            (strcmp(requestBuf, "SCORE") && strcmp(requestBuf, "PARTIAL"))) {
+            fprintf(out, "ERROR unknown request\n");
+            fflush(out);
+            continue;
+        }
+
+        string scoreMethod = scoreMethodBuf;
+        bool partial = !strcmp(requestBuf, "PARTIAL");
+
+        /** Read every query of the request before reporting an error, so that the next request can be read */
+        double pamPenalty = 0.0;
+        bool valid = isScoreMethod(scoreMethod) && cfdPamPenalty(pamBuf, pamPenalty);
+        vector<uint64_t> querySignatures(queryCount);
+        for (size_t i = 0; i < queryCount; i++) {
+            if (fgets(line, sizeof(line), in) == NULL) {
+                valid = false;
+                break;
+            }
+            if (strcspn(line, "\r\n") != seqLength) {
+                valid = false;
+            }
+            querySignatures[i] = encoding.sequenceToSignature(line, seqLength);
+        }
+
+        if (!valid) {
+            fprintf(out, "ERROR invalid score method, PAM or query length (expected %zu)\n", seqLength);
+            fflush(out);
+            continue;
+        }
+
+        /** The off-targets within `maxDist` are found only if it is less than the slices of every index */
+        size_t sliceCount = indexes[0].sliceCount;
+        for (const IsslIndex &index : indexes) {
+            sliceCount = min(sliceCount, index.sliceCount);
+        }
+        if (maxDist < 0 || (size_t)maxDist >= sliceCount) {
+            fprintf(out, "ERROR max distance %d is not less than the slices of the index (%zu)\n", maxDist, sliceCount);
+            fflush(out);
+            continue;
+        }
+
+        vector<double> totScoresMit(queryCount, 0.0);
+        vector<double> totScoresCfd(queryCount, 0.0);
+        vector<char> exited(queryCount, 0);
+        {
+            lock_guard<mutex> lock(scoringMutex);
+            for (const IsslIndex &index : indexes) {
+                addQueryScores(index, querySignatures, maxDist, threshold, scoreMethod, pamPenalty, totScoresMit, totScoresCfd, exited, threads);
+            }
+        }
+
+        fprintf(out, "OK %zu\n", queryCount);
+        if (partial) {
+            printPartialScores(out, seqLength, querySignatures, totScoresMit, totScoresCfd, exited);
+        }
+        else {
+            vector<double> querySignatureMitScores;
+            vector<double> querySignatureCfdScores;
+            globalScores(totScoresMit, totScoresCfd, querySignatureMitScores, querySignatureCfdScores);
+            printScores(out, seqLength, scoreMethod, querySignatures, querySignatureMitScores, querySignatureCfdScores);
+        }
+        fflush(out);
     }
-    return signature;
+
+    fclose(in);
+    fclose(out);
+}
+
+/// Whether the daemon `address` is a TCP port, `host:port`, rather than a Unix domain socket
+bool isTcpAddress(const char *address)
+{
+    return strchr(address, ':') != NULL && strchr(address, '/') == NULL;
 }
 
 /**
- * Binary encode genetic string `ptr`
+ * Listen on `address`, a Unix domain socket, or a TCP port as `host:port`
  *
- * For example, 
- *   00 11 01 10 becomes (as 64-bit unsigned int)
- *    A  T  C  G  (without spaces)
+ * @param[out] alreadyServed whether another process is serving `address`
+ * @return the listening socket, or -1 with a message on stderr
+ */
+int listenDaemon(const char *address, bool &alreadyServed)
+{
+    alreadyServed = false;
+
+    if (isTcpAddress(address)) {
+        const char *colon = strrchr(address, ':');
+        string host(address, colon);
+        struct addrinfo hints, *addrs = NULL;
+        memset(&hints, 0, sizeof(hints));
+        hints.ai_family = AF_UNSPEC;
+        hints.ai_socktype = SOCK_STREAM;
+        hints.ai_flags = AI_PASSIVE;
+        int status = getaddrinfo(host.empty() ? NULL : host.c_str(), colon + 1, &hints, &addrs);
+        if (status != 0) {
+            fprintf(stderr, "Error: could not resolve %s: %s\n", address, gai_strerror(status));
+            return -1;
+        }
+
+        int listenFd = socket(addrs->ai_family, addrs->ai_socktype, addrs->ai_protocol);
+        int reuse = 1;
+        if (listenFd >= 0) {
+            setsockopt(listenFd, SOL_SOCKET, SO_REUSEADDR, &reuse, sizeof(reuse));
+        }
+        if (listenFd < 0 || bind(listenFd, addrs->ai_addr, addrs->ai_addrlen) != 0 || listen(listenFd, SOMAXCONN) != 0) {
+            alreadyServed = errno == EADDRINUSE;
+            fprintf(stderr, "Error: could not listen on %s: %s\n", address, strerror(errno));
+            freeaddrinfo(addrs);
+            return -1;
+        }
+        freeaddrinfo(addrs);
+        return listenFd;
+    }
+
+    struct sockaddr_un addr;
+    memset(&addr, 0, sizeof(addr));
+    addr.sun_family = AF_UNIX;
+    if (strlen(address) >= sizeof(addr.sun_path)) {
+        fprintf(stderr, "Error: socket path is too long: %s\n", address);
+        return -1;
+    }
+    strcpy(addr.sun_path, address);
+
+    /** Holding the lock, any existing socket is stale */
+    unlink(address);
+
+    int listenFd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (listenFd < 0 || bind(listenFd, (struct sockaddr *)&addr, sizeof(addr)) != 0 || listen(listenFd, SOMAXCONN) != 0) {
+        fprintf(stderr, "Error: could not listen on %s: %s\n", address, strerror(errno));
+        return -1;
+    }
+    return listenFd;
+}
+
+/**
+ * Load the indexes once and serve scoring requests on a socket
  *
- * @param[in] signature the binary encoded genetic string
+ * @param[in] indexList the ISSL indexes, or shard sets, separated by commas
+ * @param[in] address where to listen, see `listenDaemon`
+ * @return 2 if a daemon is already serving `address`, otherwise 0 or 1
  */
-string signatureToSequence(uint64_t signature)
+int runDaemon(const char *indexList, const char *address)
 {
-    string sequence = string(seqLength, ' ');
-    for (size_t j = 0; j < seqLength; j++) {
-        sequence[j] = signatureIndex[(signature >> (j * 2)) & 0x3];
+    /** Only one daemon may serve a socket, the lock is released when the daemon exits. A
+     *  TCP port is claimed by listening on it */
+    if (!isTcpAddress(address)) {
+        string lockPath = string(address) + ".lock";
+        int lockFd = open(lockPath.c_str(), O_RDWR | O_CREAT, 0644);
+        if (lockFd < 0 || flock(lockFd, LOCK_EX | LOCK_NB) != 0) {
+            fprintf(stderr, "A daemon is already serving %s\n", address);
+            return 2;
+        }
+    }
+
+    vector<IsslIndex> indexes;
+    vector<size_t> indexGroups;
+    vector<string> indexPaths;
+    if (loadIsslIndexes(indexList, indexes, indexGroups, indexPaths) == 0) {
+        return 1;
+    }
+
+    /** The files are kept open, so that their checksums are of the files that were
+     *  loaded even if they are since replaced */
+    vector<ServedIndexFile> files(indexPaths.size());
+    for (size_t i = 0; i < indexPaths.size(); i++) {
+        char resolvedPath[PATH_MAX];
+        struct stat statBuf;
+        files[i].path = realpath(indexPaths[i].c_str(), resolvedPath) != NULL ? resolvedPath : indexPaths[i];
+        files[i].fd = open(indexPaths[i].c_str(), O_RDONLY);
+        if (files[i].fd < 0 || fstat(files[i].fd, &statBuf) != 0) {
+            fprintf(stderr, "Error: could not open %s\n", indexPaths[i].c_str());
+            return 1;
+        }
+        files[i].size = statBuf.st_size;
+        files[i].mtimeNs = statBuf.st_mtim.tv_sec * 1000000000LL + statBuf.st_mtim.tv_nsec;
+    }
+
+    bool alreadyServed = false;
+    int listenFd = listenDaemon(address, alreadyServed);
+    if (listenFd < 0) {
+        return alreadyServed ? 2 : 1;
+    }
+
+    fprintf(stderr, "Listening on %s\n", address);
+
+    int fd;
+    while ((fd = accept(listenFd, NULL, NULL)) >= 0) {
+        thread(serveDaemonClient, cref(indexes), ref(files), fd, listenFd).detach();
+    }
+
+    /** Acquire the scoring lock so that no request is scored whilst exiting */
+    lock_guard<mutex> lock(scoringMutex);
+    if (!isTcpAddress(address)) {
+        unlink(address);
     }
-    return sequence;
+    close(listenFd);
+    return 0;
 }
 
 int main(int argc, char **argv)
 {
-    if (argc < 4) {
-        fprintf(stderr, "Usage: %s [issltable] [query file] [max distance] [score-threshold] [score-method]\n", argv[0]);
+    if (argc == 4 && !strcmp(argv[1], "--daemon")) {
+        return runDaemon(argv[2], argv[3]);
+    }
+
+    /** The optional settings are given as `--name=value`, before or after the arguments */
+    map<string, string> options;
+    vector<char *> args;
+    for (int i = 0; i < argc; i++) {
+        if (i == 0 || strncmp(argv[i], "--", 2)) {
+            args.push_back(argv[i]);
+            continue;
+        }
+        const char *value = strchr(argv[i], '=');
+        string name = value != NULL ? string(argv[i] + 2, (size_t)(value - argv[i] - 2)) : string(argv[i] + 2);
+        if (name.compare("schedule") && name.compare("slice-order") && name.compare("output-format") && name.compare("chunk-size") && name.compare("stats") && name.compare("verbose")) {
+            fprintf(stderr, "Error: unknown option: %s\n", argv[i]);
+            exit(1);
+        }
+        options[name] = value != NULL ? value + 1 : "";
+    }
+    argc = args.size();
+    argv = args.data();
+
+    if (argc < 6) {
+        fprintf(stderr, "Usage: %s [issltable or shard set[,issltable...]] [query file or -] [max distance] [score-threshold] [score-method] [pam (default NGG)] [threads (default all)] [options]\n", argv[0]);
+        fprintf(stderr, "       %s --daemon [issltable or shard set[,issltable...]] [socket path or host:port]\n", argv[0]);
+        fprintf(stderr, "Options:\n");
+        fprintf(stderr, "  --schedule=queries|grouped            score each query in turn, or those that share a slice list together (default queries)\n");
+        fprintf(stderr, "  --slice-order=fixed|largest|sampled   the order in which to scan the slices of each query (default fixed)\n");
+        fprintf(stderr, "  --output-format=text|float64|float32  print the scores, or write them as arrays of floats (default text)\n");
+        fprintf(stderr, "  --chunk-size=N                        score the queries N at a time (default all, or 65536 from stdin)\n");
+        fprintf(stderr, "  --stats=FILE                          write the counters of each query to FILE as JSON\n");
+        fprintf(stderr, "  --verbose                             report how long each thread was busy, and the entries scanned per query\n");
         exit(1);
     }
-    
-    /** Char to binary encoding */
-    nucleotideIndex['A'] = 0;
-    nucleotideIndex['C'] = 1;
-    nucleotideIndex['G'] = 2;
-    nucleotideIndex['T'] = 3;
-    signatureIndex[0] = 'A';
-    signatureIndex[1] = 'C';
-    signatureIndex[2] = 'G';
-    signatureIndex[3] = 'T';
 
     /** The maximum number of mismatches */
     int maxDist = atoi(argv[3]);
-    
+
     /** The threshold used to exit scoring early */
     double threshold = atof(argv[4]);
-    
-    /** Scoring methods. To exit early: 
-     *      - only CFD must drop below `threshold`
-     *      - only MIT must drop below `threshold`
-     *      - both CFD and MIT must drop below `threshold`
-     *      - CFD or MIT must drop below `threshold`
-     *      - the average of CFD and MIT must below `threshold`
-     */
+
+    /** Scoring methods, see `isScoreMethod` */
     string scoreMethod = argv[5];
-    
-    /** Which scores should be calcled? */
-    bool calcMit = (!scoreMethod.compare("mit") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
-    bool calcCfd = (!scoreMethod.compare("cfd") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
 
-    /** Begin reading the binary encoded ISSL, structured as:
-     *      - a header (6 items)
-     *      - precalcuated local MIT scores
-     *      - all binary-encoded off-target sites
-     *      - slice list sizes
-     *      - slice contents
-     */
-    FILE *fp = fopen(argv[1], "rb");
-    
-    /** The index contains a fixed-sized header 
-     *      - the number of off-targets in the index
-     *      - the length of an off-target
-     *      - 
-     *      - chars per slice
-     *      - the number of slices per sequence
-     *      - the number of precalculated MIT scores
-     */
-    vector<size_t> slicelistHeader(6);
-    
-    if (fread(slicelistHeader.data(), sizeof(size_t), slicelistHeader.size(), fp) == 0) {
-        fprintf(stderr, "Error reading index: header invalid\n");
-        return 1;
-    }
-    
-    offtargetsCount = slicelistHeader[0]; 
-    seqLength       = slicelistHeader[1]; 
-    seqCount        = slicelistHeader[2]; 
-    sliceWidth      = slicelistHeader[3]; 
-    sliceCount      = slicelistHeader[4]; 
-    scoresCount     = slicelistHeader[5]; 
-    
-    /** The maximum number of possibly slice identities
-     *      4 chars per slice * each of A,T,C,G = limit of 16
-     */
-    size_t sliceLimit = 1 << sliceWidth;
-    
-    /** Read in the precalculated MIT scores 
-     *      - `mask` is a 2-bit encoding of mismatch positions
-     *          For example,
-     *              00 01 01 00 01  indicates mismatches in positions 1, 3 and 4
-     *  
-     *      - `score` is the local MIT score for this mismatch combination
-     */
-    phmap::flat_hash_map<uint64_t, double> precalculatedScores;
-
-    for (int i = 0; i < scoresCount; i++) {
-        uint64_t mask = 0;
-        double score = 0.0;
-        fread(&mask, sizeof(uint64_t), 1, fp);
-        fread(&score, sizeof(double), 1, fp);
-        
-        precalculatedScores.insert(pair<uint64_t, double>(mask, score));
-    }
-    
-    /** Load in all of the off-target sites */
-    vector<uint64_t> offtargets(offtargetsCount);
-    if (fread(offtargets.data(), sizeof(uint64_t), offtargetsCount, fp) == 0) {
-        fprintf(stderr, "Error reading index: loading off-target sequences failed\n");
-        return 1;
+    /** The PAM that CFD penalises for the off-targets, of which only the last two nucleotides are scored */
+    double pamPenalty = 0.0;
+    if (!cfdPamPenalty(argc > 6 ? argv[6] : "NGG", pamPenalty)) {
+        fprintf(stderr, "Error: invalid PAM: %s\n", argv[6]);
+        exit(1);
     }
-    
-    /** Prevent assessing an off-target site for multiple slices
-     *
-     *      Create enough 1-bit "seen" flags for the off-targets
-     *      We only want to score a candidate guide against an off-target once.
-     *      The least-significant bit represents the first off-target
-     *      0 0 0 1   0 1 0 0   would indicate that the 3rd and 5th off-target have been seen.
-     *      The CHAR_BIT macro tells us how many bits are in a byte (C++ >= 8 bits per byte)
-     */
-    uint64_t numOfftargetToggles = (offtargetsCount / ((size_t)sizeof(uint64_t) * (size_t)CHAR_BIT)) + 1;
-
-    /** The number of signatures embedded per slice
-     *
-     *      These counts are stored contiguously
-     *
-     */
-    vector<size_t> allSlicelistSizes(sliceCount * sliceLimit);
-    
-    if (fread(allSlicelistSizes.data(), sizeof(size_t), allSlicelistSizes.size(), fp) == 0) {
-        fprintf(stderr, "Error reading index: reading slice list sizes failed\n");
-        return 1;
+
+    /** The number of threads to score with, zero for all */
+    int threads = argc > 7 ? atoi(argv[7]) : 0;
+    if (threads < 0) {
+        fprintf(stderr, "Error: invalid number of threads: %s\n", argv[7]);
+        exit(1);
     }
-    
-    /** The contents of the slices
-     *
-     *      Stored contiguously
-     *
-     *      Each signature (64-bit) is structured as:
-     *          <occurrences 32-bit><off-target-id 32-bit>
-     */
-    vector<uint64_t> allSignatures(seqCount * sliceCount);
-    
-    if (fread(allSignatures.data(), sizeof(uint64_t), allSignatures.size(), fp) == 0) {
-        fprintf(stderr, "Error reading index: reading slice contents failed\n");
-        return 1;
+
+    /** Score each query in turn, or the queries that share a slice list together, see `scoreQueriesGrouped` */
+    string schedule = options.count("schedule") ? options["schedule"] : "queries";
+    if (schedule.compare("queries") && schedule.compare("grouped")) {
+        fprintf(stderr, "Error: unknown schedule: %s\n", schedule.c_str());
+        exit(1);
     }
-    
-    /** End reading the index */
-    fclose(fp);
-    
-    /** Start constructing index in memory
-     *
-     *      To begin, reverse the contiguous storage of the slices,
-     *         into the following:
-     *
-     *         + Slice 0 :
-     *         |---- AAAA : <slice contents>
-     *         |---- AAAC : <slice contents>
-     *         |----  ...
-     *         | 
-     *         + Slice 1 :
-     *         |---- AAAA : <slice contents>
-     *         |---- AAAC : <slice contents>
-     *         |---- ...
-     *         | ...
-     */
-    vector<vector<uint64_t *>> sliceLists(sliceCount, vector<uint64_t *>(sliceLimit));
-
-    uint64_t *offset = allSignatures.data();
-    for (size_t i = 0; i < sliceCount; i++) {
-        for (size_t j = 0; j < sliceLimit; j++) {
-            size_t idx = i * sliceLimit + j;
-            sliceLists[i][j] = offset;
-            offset += allSlicelistSizes[idx];
-        }
-    }
-    
-    /** Load query file (candidate guides)
-     *      and prepare memory for calculated global scores
-     */
-    size_t seqLineLength = seqLength + 1;
-    size_t fileSize = getFileSize(argv[2]);
-    if (fileSize % seqLineLength != 0) {
-        fprintf(stderr, "Error: query file is not a multiple of the expected line length (%zu)\n", seqLineLength);
-        fprintf(stderr, "The sequence length may be incorrect; alternatively, the line endings\n");
-        fprintf(stderr, "may be something other than LF, or there may be junk at the end of the file.\n");
+
+    /** The order in which to scan the slices of each query, see `sliceVisitOrder` */
+    string sliceOrderName = options.count("slice-order") ? options["slice-order"] : "fixed";
+    SliceOrder sliceOrder = SLICE_ORDER_FIXED;
+    if (!parseSliceOrder(sliceOrderName, sliceOrder)) {
+        fprintf(stderr, "Error: unknown slice order: %s\n", sliceOrderName.c_str());
         exit(1);
     }
-    size_t queryCount = fileSize / seqLineLength;
-    fp = fopen(argv[2], "rb");
-    vector<char> queryDataSet(fileSize);
-    vector<uint64_t> querySignatures(queryCount);
-    vector<double> querySignatureMitScores(queryCount);
-    vector<double> querySignatureCfdScores(queryCount);
 
-    if (fread(queryDataSet.data(), fileSize, 1, fp) < 1) {
-        fprintf(stderr, "Failed to read in query file.\n");
+    /** Print the scores as text, or write them as arrays of floats, see `writeScores` */
+    string outputFormat = options.count("output-format") ? options["output-format"] : "text";
+    if (outputFormat.compare("text") && outputFormat.compare("float64") && outputFormat.compare("float32")) {
+        fprintf(stderr, "Error: unknown output format: %s\n", outputFormat.c_str());
         exit(1);
     }
-    fclose(fp);
 
-    /** Binary encode query sequences */
-    #pragma omp parallel
-    {
-        #pragma omp for
-        for (size_t i = 0; i < queryCount; i++) {
-            char *ptr = &queryDataSet[i * seqLineLength];
-            uint64_t signature = sequenceToSignature(ptr);
-            querySignatures[i] = signature;
-        }
-    }
-
-    /** Begin scoring */
-    #pragma omp parallel
-    {
-        unordered_map<uint64_t, unordered_set<uint64_t>> searchResults;
-        vector<uint64_t> offtargetToggles(numOfftargetToggles);
-    
-        uint64_t * offtargetTogglesTail = offtargetToggles.data() + numOfftargetToggles - 1;
-
-        /** For each candidate guide */
-        #pragma omp for
-        for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
-
-            auto searchSignature = querySignatures[searchIdx];
-
-            /** Global scores */
-            double totScoreMit = 0.0;
-            double totScoreCfd = 0.0;
-            
-            int numOffTargetSitesScored = 0;
-            double maximum_sum = (10000.0 - threshold*100) / threshold;
-            bool checkNextSlice = true;
-            
-            /** For each ISSL slice */
-            for (size_t i = 0; i < sliceCount; i++) {
-                uint64_t sliceMask = sliceLimit - 1;
-                int sliceShift = sliceWidth * i;
-                sliceMask = sliceMask << sliceShift;
-                auto &sliceList = sliceLists[i];
-                
-                uint64_t searchSlice = (searchSignature & sliceMask) >> sliceShift;
-                
-                size_t idx = i * sliceLimit + searchSlice;
-                
-                size_t signaturesInSlice = allSlicelistSizes[idx];
-                uint64_t *sliceOffset = sliceList[searchSlice];
-                
-                /** For each off-target signature in slice */
-                for (size_t j = 0; j < signaturesInSlice; j++) {
-                    
-                    auto signatureWithOccurrencesAndId = sliceOffset[j];
-                    auto signatureId = signatureWithOccurrencesAndId & 0xFFFFFFFFull;
-                    uint32_t occurrences = (signatureWithOccurrencesAndId >> (32));
-
-                    /** Find the positions of mismatches 
-                     *
-                     *  Search signature (SS):    A  A  T  T    G  C  A  T
-                     *                           00 00 11 11   10 01 00 11
-                     *              
-                     *        Off-target (OT):    A  T  A  T    C  G  A  T
-                     *                           00 11 00 11   01 10 00 11
-                     *                           
-                     *                SS ^ OT:   00 00 11 11   10 01 00 11
-                     *                         ^ 00 11 00 11   01 10 00 11
-                     *                  (XORd) = 00 11 11 00   11 11 00 00
-                     *
-                     *        XORd & evenBits:   00 11 11 00   11 11 00 00
-                     *                         & 10 10 10 10   10 10 10 10
-                     *                   (eX)  = 00 10 10 00   10 10 00 00
-                     *
-                     *         XORd & oddBits:   00 11 11 00   11 11 00 00
-                     *                         & 01 01 01 01   01 01 01 01
-                     *                   (oX)  = 00 01 01 00   01 01 00 00
-                     *
-                     *         (eX >> 1) | oX:   00 01 01 00   01 01 00 00 (>>1)
-                     *                         | 00 01 01 00   01 01 00 00
-                     *            mismatches   = 00 01 01 00   01 01 00 00
-                     *
-                     *   popcount(mismatches):   4
-                     */
-                    uint64_t xoredSignatures = searchSignature ^ offtargets[signatureId];
-                    uint64_t evenBits = xoredSignatures & 0xAAAAAAAAAAAAAAAAull;
-                    uint64_t oddBits = xoredSignatures & 0x5555555555555555ull;
-                    uint64_t mismatches = (evenBits >> 1) | oddBits;
-                    int dist = __builtin_popcountll(mismatches);
-
-                    /** Prevent assessing the same off-target for multiple slices */
-                    uint64_t seenOfftargetAlready = 0;
-                    uint64_t * ptrOfftargetFlag = (offtargetTogglesTail - (signatureId / 64));
-                    seenOfftargetAlready = (*ptrOfftargetFlag >> (signatureId % 64)) & 1ULL;
-                    
-					if (dist >= 0 && dist <= maxDist) {
-						if (!seenOfftargetAlready) {
-							// Begin calculating MIT score
-							if (calcMit) {
-								if (dist > 0 && dist <= maxDist) {
-									totScoreMit += precalculatedScores[mismatches] * (double)occurrences;
-								}
-							} 
-							
-							// Begin calculating CFD score
-							if (calcCfd) {
-								/** "In other words, for the CFD score, a value of 0 
-								 *      indicates no predicted off-target activity whereas 
-								 *      a value of 1 indicates a perfect match"
-								 *      John Doench, 2016. 
-								 *      https://www.nature.com/articles/nbt.3437
-								*/
-								double cfdScore = 0;
-								if (dist == 0) {
-									cfdScore = 1;
-								}
-								else if (dist > 0 && dist <= maxDist) {
-									cfdScore = cfdPamPenalties[0b1010]; // PAM: NGG, TODO: do not hard-code the PAM
-									
-									for (size_t pos = 0; pos < 20; pos++) {
-										size_t mask = pos << 4;
-										
-										// Create the mask to look up the position-identity score
-										// In Python... c2b is char to bit
-										//  mask = pos << 4
-										//  mask |= c2b[sgRNA[pos]] << 2
-										//  mask |= c2b[revcom(offTaret[pos])]
-										
-										// Find identity at `pos` for search signature
-										// example: find identity in pos=2
-										//  Recall ISSL is inverted, hence:
-										//              3'-  T  G  C  C  G  A -5'
-										//  start           11 10 01 01 10 00   
-										//  3UL << pos*2    00 00 00 11 00 00 
-										//  and             00 00 00 01 00 00
-										//  shift           00 00 00 00 01 00
-										uint64_t searchSigIdentityPos = searchSignature;
-										searchSigIdentityPos &= (3UL << (pos * 2));
-										searchSigIdentityPos = searchSigIdentityPos >> (pos * 2); 
-										searchSigIdentityPos = searchSigIdentityPos << 2;
-
-										// Find identity at `pos` for offtarget
-										// example: find identity in pos=2
-										//  Recall ISSL is inverted, hence:
-										//              3'-  T  G  C  C  G  A -5'
-										//  start           11 10 01 01 10 00   
-										//  3UL<<pos*2      00 00 00 11 00 00 
-										//  and             00 00 00 01 00 00
-										//  shift           00 00 00 00 00 01
-										//  rev comp 3UL    00 00 00 00 00 10 (done below)
-										uint64_t offtargetIdentityPos = offtargets[signatureId];
-										offtargetIdentityPos &= (3UL << (pos * 2));
-										offtargetIdentityPos = offtargetIdentityPos >> (pos * 2); 
-
-										// Complete the mask
-										// reverse complement (^3UL) `offtargetIdentityPos` here
-										mask = (mask | searchSigIdentityPos | (offtargetIdentityPos ^ 3UL));
-
-										if (searchSigIdentityPos >> 2 != offtargetIdentityPos) {
-											cfdScore *= cfdPosPenalties[mask];
-										}
-									}
-								}
-								totScoreCfd += cfdScore * (double)occurrences;
-							}
-					
-							*ptrOfftargetFlag |= (1ULL << (signatureId % 64));
-							numOffTargetSitesScored += occurrences;
-
-							/** Stop calculating global score early if possible */
-							if (!scoreMethod.compare("and")) {
-								if (totScoreMit > maximum_sum && totScoreCfd > maximum_sum) {
-									checkNextSlice = false;
-									break;
-								}
-							}
-							if (!scoreMethod.compare("or")) {
-								if (totScoreMit > maximum_sum || totScoreCfd > maximum_sum) {
-									checkNextSlice = false;
-									break;
-								}
-							}
-							if (!scoreMethod.compare("avg")) {
-								if (((totScoreMit + totScoreCfd) / 2.0) > maximum_sum) {
-									checkNextSlice = false;
-									break;
-								}
-							}
-							if (!scoreMethod.compare("mit")) {
-								if (totScoreMit > maximum_sum) {
-									checkNextSlice = false;
-									break;
-								}
-							}
-							if (!scoreMethod.compare("cfd")) {
-								if (totScoreCfd > maximum_sum) {
-									checkNextSlice = false;
-									break;
-								}
-							}
-						}
-					}
+    /** Score the queries in chunks of this many, writing the scores of each chunk as it is scored, or zero for all at once */
+    size_t chunkSize = options.count("chunk-size") ? strtoull(options["chunk-size"].c_str(), NULL, 10) : 0;
+    bool fromStdin = !strcmp(argv[2], "-");
+    if (fromStdin && chunkSize == 0) {
+        chunkSize = QUERY_CHUNK_SIZE;
+    }
+
+    /** Where to write the counters of each query and their sums, see `writeStats` */
+    const char *statsPath = options.count("stats") ? options["stats"].c_str() : nullptr;
+
+    /** Load each of the indexes, which are scored as one */
+    vector<IsslIndex> indexes;
+    vector<size_t> indexGroups;
+    vector<string> indexPaths;
+    size_t groupCount = loadIsslIndexes(argv[1], indexes, indexGroups, indexPaths);
+    if (groupCount == 0) {
+        return 1;
+    }
+    for (const IsslIndex &index : indexes) {
+        if (!supportsMaxDist(index, maxDist)) {
+            fprintf(stderr, "Error: a max distance of %d needs an index of more slices, the index has %zu\n", maxDist, index.sliceCount);
+            return 1;
+        }
+    }
+
+    size_t seqLength = indexes[0].seqLength;
+    vector<uint64_t> querySignatures;
+    vector<double> querySignatureMitScores;
+    vector<double> querySignatureCfdScores;
+    vector<vector<double>> indexMitScores, indexCfdScores;
+    size_t queryCount = 0;
+    ScoringStats totalStats;
+    double startSeconds = omp_get_wtime();
+
+    /** Score the queries in `querySignatures` and write their scores */
+    auto scoreChunk = [&]() {
+        vector<double> totScoresMit(querySignatures.size(), 0.0);
+        vector<double> totScoresCfd(querySignatures.size(), 0.0);
+        vector<char> exited(querySignatures.size(), 0);
+        vector<double> previousMit, previousCfd, indexTotScoresMit(querySignatures.size()), indexTotScoresCfd(querySignatures.size());
+
+        /** Each index adds to the global scores of the queries yet to exit early. The
+         *  scores against each of the given indexes alone, or the shards of a shard set
+         *  together, are those added by it */
+        ScoringStats stats;
+        size_t sliceOffset = 0;
+        indexMitScores.assign(groupCount > 1 ? groupCount : 0, vector<double>());
+        indexCfdScores.assign(indexMitScores.size(), vector<double>());
+        for (size_t i = 0; i < indexes.size(); i++) {
+            if (i == 0 || indexGroups[i] != indexGroups[i - 1]) {
+                previousMit = totScoresMit;
+                previousCfd = totScoresCfd;
+            }
+
+            ScoringStats indexStats;
+            if (!schedule.compare("grouped")) {
+                addQueryScoresGrouped(indexes[i], querySignatures, maxDist, threshold, scoreMethod, pamPenalty, totScoresMit, totScoresCfd, exited, threads, &indexStats);
+            }
+            else {
+                addQueryScores(indexes[i], querySignatures, maxDist, threshold, scoreMethod, pamPenalty, totScoresMit, totScoresCfd, exited, threads, &indexStats, sliceOrder);
+            }
+            stats.combine(indexStats, sliceOffset);
+            sliceOffset += indexes[i].sliceCount;
+
+            if (groupCount > 1 && (i + 1 == indexes.size() || indexGroups[i + 1] != indexGroups[i])) {
+                for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
+                    indexTotScoresMit[searchIdx] = totScoresMit[searchIdx] - previousMit[searchIdx];
+                    indexTotScoresCfd[searchIdx] = totScoresCfd[searchIdx] - previousCfd[searchIdx];
                 }
+                globalScores(indexTotScoresMit, indexTotScoresCfd, indexMitScores[indexGroups[i]], indexCfdScores[indexGroups[i]]);
+            }
+        }
+        globalScores(totScoresMit, totScoresCfd, querySignatureMitScores, querySignatureCfdScores);
 
-                if (!checkNextSlice)
+        if (statsPath == nullptr) {
+            stats.queries.clear();
+        }
+        totalStats.append(stats);
+        queryCount += querySignatures.size();
+
+        if (!outputFormat.compare("text")) {
+            printScores(stdout, seqLength, scoreMethod, querySignatures, querySignatureMitScores, querySignatureCfdScores, indexMitScores, indexCfdScores);
+            fflush(stdout);
+        }
+        else {
+            bool written = !outputFormat.compare("float64")
+                ? writeScores<double>(stdout, scoreMethod, querySignatureMitScores, querySignatureCfdScores, indexMitScores, indexCfdScores)
+                : writeScores<float>(stdout, scoreMethod, querySignatureMitScores, querySignatureCfdScores, indexMitScores, indexCfdScores);
+            if (!written) {
+                fprintf(stderr, "Error: failed to write the scores\n");
+                exit(1);
+            }
+        }
+    };
+
+    if (chunkSize > 0) {
+        FILE *fp = fromStdin ? stdin : fopen(argv[2], "rb");
+        if (fp == NULL) {
+            fprintf(stderr, "Failed to open query file: %s\n", argv[2]);
+            exit(1);
+        }
+
+        /** Read, score and write the queries one chunk at a time */
+        querySignatures.reserve(chunkSize);
+        char line[256];
+        bool moreQueries = true;
+        while (moreQueries) {
+            querySignatures.clear();
+            while (querySignatures.size() < chunkSize) {
+                if (fgets(line, sizeof(line), fp) == NULL) {
+                    moreQueries = false;
                     break;
+                }
+                size_t len = strcspn(line, "\r\n");
+                if (len == 0) {
+                    continue;
+                }
+                if (len != seqLength) {
+                    fprintf(stderr, "Error: query %.*s is not of the expected length (%zu)\n", (int)len, line, seqLength);
+                    exit(1);
+                }
+                querySignatures.push_back(encoding.sequenceToSignature(line, seqLength));
             }
 
-            querySignatureMitScores[searchIdx] = 10000.0 / (100.0 + totScoreMit);
-            querySignatureCfdScores[searchIdx] = 10000.0 / (100.0 + totScoreCfd);
+            /** An empty input still writes an empty set of scores */
+            if (!querySignatures.empty() || (queryCount == 0 && !moreQueries)) {
+                scoreChunk();
+            }
+        }
 
-            memset(offtargetToggles.data(), 0, sizeof(uint64_t)*offtargetToggles.size());
+        if (fp != stdin) {
+            fclose(fp);
+        }
+    }
+    else {
+        /** Load query file (candidate guides)
+         *      and prepare memory for calculated global scores
+         */
+        size_t seqLineLength = seqLength + 1;
+        size_t fileSize = getFileSize(argv[2]);
+        if (fileSize % seqLineLength != 0) {
+            fprintf(stderr, "Error: query file is not a multiple of the expected line length (%zu)\n", seqLineLength);
+            fprintf(stderr, "The sequence length may be incorrect; alternatively, the line endings\n");
+            fprintf(stderr, "may be something other than LF, or there may be junk at the end of the file.\n");
+            exit(1);
+        }
+        size_t fileQueryCount = fileSize / seqLineLength;
+        FILE *fp = fopen(argv[2], "rb");
+        vector<char> queryDataSet(fileSize);
+        querySignatures.resize(fileQueryCount);
+
+        if (fread(queryDataSet.data(), fileSize, 1, fp) < 1) {
+            fprintf(stderr, "Failed to read in query file.\n");
+            exit(1);
+        }
+        fclose(fp);
+
+        /** Binary encode query sequences */
+        #pragma omp parallel
+        {
+            #pragma omp for
+            for (size_t i = 0; i < fileQueryCount; i++) {
+                char *ptr = &queryDataSet[i * seqLineLength];
+                uint64_t signature = encoding.sequenceToSignature(ptr, seqLength);
+                querySignatures[i] = signature;
+            }
         }
 
+        scoreChunk();
     }
-    
-    /** Print global scores to stdout */
-    for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
-        auto querySequence = signatureToSequence(querySignatures[searchIdx]);
-        printf("%s\t", querySequence.c_str());
-        if (calcMit) 
-            printf("%f\t", querySignatureMitScores[searchIdx]);
-        else
-            printf("-1\t");
-        
-        if (calcCfd)
-            printf("%f\n", querySignatureCfdScores[searchIdx]);
-        else
-            printf("-1\n");
-            
+
+    /** Report how evenly the queries were shared between the threads, and how much of the index each scanned */
+    if (options.count("verbose") || statsPath != nullptr) {
+        fprintf(stderr, "Scored %zu queries using %zu threads, busy for (s):", queryCount, totalStats.threadBusySeconds.size());
+        for (double busySeconds : totalStats.threadBusySeconds) {
+            fprintf(stderr, " %.3f", busySeconds);
+        }
+        fprintf(stderr, "\n");
+        fprintf(stderr, "Scanned %.1f slice list entries per query\n", queryCount > 0 ? (double)totalStats.entriesScanned / queryCount : 0.0);
+    }
+
+    if (statsPath != nullptr) {
+        FILE *statsFp = fopen(statsPath, "w");
+        if (statsFp == NULL) {
+            fprintf(stderr, "Error: could not write the stats to %s\n", statsPath);
+            exit(1);
+        }
+
+        StatsRun run;
+        run.maxDist = maxDist;
+        run.threshold = threshold;
+        run.scoreMethod = scoreMethod;
+        run.schedule = schedule;
+        run.sliceOrder = sliceOrderName;
+        run.chunkSize = chunkSize;
+        run.seconds = omp_get_wtime() - startSeconds;
+        writeStats(statsFp, indexes, run, totalStats);
+        fclose(statsFp);
     }
 
     return 0;
-}
\ No newline at end of file
+}
@@ -0,0 +1,1121 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Scoring candidate guides against the off-targets in an ISSL index. Shared by
+isslScoreOfftargets and the libissl shared library.
+
+*/
+
+#ifndef ISSL_SCORING_H
+#define ISSL_SCORING_H
+
+#include "cfdPenalties.h"
+#include "isslIndex.h"
+#include "isslScan.h"
+
+#include <cstdint>
+#include <cstring>
+#include <cctype>
+#include <climits>
+#include <vector>
+#include <string>
+#include <utility>
+#include <algorithm>
+#include <omp.h>
+
+/** Scoring methods. To exit early:
+ *      - only CFD must drop below `threshold`
+ *      - only MIT must drop below `threshold`
+ *      - both CFD and MIT must drop below `threshold`
+ *      - CFD or MIT must drop below `threshold`
+ *      - the average of the sums of the local CFD and MIT scores must pass
+ *        that of `threshold`, so their harmonic mean drops below `threshold`
+ */
+inline bool isScoreMethod(const std::string &scoreMethod)
+{
+    return (!scoreMethod.compare("mit") || !scoreMethod.compare("cfd") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+}
+
+/**
+ * Whether every off-target within `maxDist` mismatches of a query is found in `index`
+ *
+ *      An off-target is found only when it matches the query in at least one
+ *      slice, which is certain for fewer mismatches than there are slices, and
+ *      the MIT scores of the index are precalculated to as many.
+ */
+inline bool supportsMaxDist(const IsslIndex &index, int maxDist)
+{
+    return maxDist >= 0 && (size_t)maxDist < index.sliceCount;
+}
+
+/** How many entries ahead of the scan to load the off-targets of */
+const size_t ISSL_PREFETCH_DISTANCE = 64;
+
+/** The slice lists are filtered this many entries at a time, see `nearEntries` */
+const size_t ISSL_SCAN_BLOCK = 64;
+
+/** The number of positions scored by CFD, see `cfdPosPenalties` */
+const size_t CFD_POSITIONS = 20;
+
+/**
+ * The CFD penalty of a PAM
+ *
+ * @param[in] pam the PAM, e.g. NGG. Only the last two nucleotides are scored
+ * @param[out] penalty the penalty from `cfdPamPenalties`
+ * @return false if the PAM is not valid
+ */
+inline bool cfdPamPenalty(const std::string &pam, double &penalty)
+{
+    if (pam.size() < 2) {
+        return false;
+    }
+
+    size_t pamIndex = 0;
+    for (size_t i = pam.size() - 2; i < pam.size(); i++) {
+        const char *nucleotide = strchr("ACGT", toupper(pam[i]));
+        if (pam[i] == '\0' || nucleotide == NULL) {
+            return false;
+        }
+        pamIndex = (pamIndex << 2) | (nucleotide - "ACGT");
+    }
+
+    penalty = cfdPamPenalties[pamIndex];
+    return true;
+}
+
+/**
+ * The CFD penalty of each possible mismatch with a query
+ *
+ *      `penalties[pos * 4 + n]` is the penalty when the off-target has the
+ *      nucleotide `n` at `pos` (and the query does not), looked up once per
+ *      query rather than once per off-target
+ *
+ * @param[in] searchSignature the binary encoded query
+ * @param[out] penalties the penalties, CFD_POSITIONS * 4 of them
+ */
+inline void cfdQueryPenalties(uint64_t searchSignature, double *penalties)
+{
+    for (size_t pos = 0; pos < CFD_POSITIONS; pos++) {
+        // The position-identity mask, as per the Python implementation
+        //  mask = pos << 4
+        //  mask |= c2b[sgRNA[pos]] << 2
+        //  mask |= c2b[revcom(offTarget[pos])]
+        uint64_t searchSigIdentityPos = (searchSignature >> (pos * 2)) & 3UL;
+        for (uint64_t offtargetIdentityPos = 0; offtargetIdentityPos < 4; offtargetIdentityPos++) {
+            size_t mask = (pos << 4) | (searchSigIdentityPos << 2) | (offtargetIdentityPos ^ 3UL);
+            penalties[pos * 4 + offtargetIdentityPos] = cfdPosPenalties[mask];
+        }
+    }
+}
+
+/**
+ * Adds the local scores of off-targets to the global scores of a query
+ *
+ *      Shared by `scoreQueries` and `scoreQueriesGrouped`, so that both score,
+ *      and exit early, alike
+ */
+struct OfftargetScorer
+{
+    /** Which scores should be calcled? */
+    bool calcMit, calcCfd;
+    bool exitOnAnd, exitOnOr, exitOnAvg, exitOnMit, exitOnCfd;
+
+    int maxDist;
+
+    /** The off-targets within this distance are found in the neighbour table
+     *      by `addNeighbours`, rather than by scanning, -1 if there is none
+     */
+    int neighbourDist;
+
+    double maximum_sum;
+    double pamPenalty;
+    const MismatchRanking &mitRanking;
+    const double *mitTable;
+
+    OfftargetScorer(const IsslIndex &index, int maxDist, double threshold, const std::string &scoreMethod, double pamPenalty) :
+        maxDist(maxDist), pamPenalty(pamPenalty), mitRanking(index.mitRanking), mitTable(index.mitTable)
+    {
+        neighbourDist = index.neighbours != nullptr ? std::min(maxDist, 1) : -1;
+
+        calcMit = (!scoreMethod.compare("mit") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+        calcCfd = (!scoreMethod.compare("cfd") || !scoreMethod.compare("and") || !scoreMethod.compare("or") || !scoreMethod.compare("avg"));
+
+        exitOnAnd = !scoreMethod.compare("and");
+        exitOnOr = !scoreMethod.compare("or");
+        exitOnAvg = !scoreMethod.compare("avg");
+        exitOnMit = !scoreMethod.compare("mit");
+        exitOnCfd = !scoreMethod.compare("cfd");
+
+        maximum_sum = (10000.0 - threshold*100) / threshold;
+    }
+
+    /**
+     * Add the local scores of an off-target, within `maxDist`, to the global scores
+     *
+     * @param[in,out] totScoreMit the global MIT score of the query
+     * @param[in,out] totScoreCfd the global CFD score of the query
+     * @param[in] cfdPenalties the CFD penalties of the query, see `cfdQueryPenalties`
+     * @return true if the global score can stop being calculated early
+     */
+    bool add(double &totScoreMit, double &totScoreCfd, const double *cfdPenalties, uint64_t offtarget, uint64_t mismatches, int dist, uint64_t occurrences) const
+    {
+        // Begin calculating MIT score
+        if (calcMit) {
+            if (dist > 0 && dist <= maxDist && (size_t)dist <= mitRanking.maxMismatches) {
+                totScoreMit += mitTable[mitRanking.rank(mismatches)] * (double)occurrences;
+            }
+        }
+
+        // Begin calculating CFD score
+        if (calcCfd) {
+            /** "In other words, for the CFD score, a value of 0
+             *      indicates no predicted off-target activity whereas
+             *      a value of 1 indicates a perfect match"
+             *      John Doench, 2016.
+             *      https://www.nature.com/articles/nbt.3437
+            */
+            double cfdScore = 0;
+            if (dist == 0) {
+                cfdScore = 1;
+            }
+            else if (dist > 0 && dist <= maxDist) {
+                cfdScore = pamPenalty;
+
+                // Only the mismatched positions are penalised, visit
+                // each set bit of `mismatches`, lowest position first
+                uint64_t cfdMismatches = mismatches & ((1ULL << (CFD_POSITIONS * 2)) - 1);
+                while (cfdMismatches) {
+                    size_t bit = __builtin_ctzll(cfdMismatches);
+                    cfdScore *= cfdPenalties[(bit >> 1) * 4 + ((offtarget >> bit) & 3UL)];
+                    cfdMismatches &= cfdMismatches - 1;
+                }
+            }
+            totScoreCfd += cfdScore * (double)occurrences;
+        }
+
+        return canExitEarly(totScoreMit, totScoreCfd);
+    }
+
+    /**
+     * Add the local scores of the off-targets within `neighbourDist` of a query
+     *
+     *      These contribute the most to the global scores, and are looked up in
+     *      the neighbour table, the query first then each of its neighbours,
+     *      lowest position first. A query that does not exit early then scans
+     *      its slice lists for the off-targets further away.
+     *
+     * @param[out] offtargetsScored if given, incremented for each off-target found
+     * @return true if the global score can stop being calculated early
+     */
+    bool addNeighbours(const IsslIndex &index, double &totScoreMit, double &totScoreCfd, const double *cfdPenalties, uint64_t searchSignature, uint64_t *offtargetsScored = nullptr) const
+    {
+        if (neighbourDist < 0) {
+            return false;
+        }
+
+        uint64_t occurrences = index.neighbourOccurrences(searchSignature);
+        if (occurrences > 0 && offtargetsScored != nullptr) {
+            (*offtargetsScored)++;
+        }
+        if (occurrences > 0 && add(totScoreMit, totScoreCfd, cfdPenalties, searchSignature, 0, 0, occurrences)) {
+            return true;
+        }
+        if (neighbourDist < 1) {
+            return false;
+        }
+
+        for (size_t pos = 0; pos < index.seqLength; pos++) {
+            uint64_t mismatches = 1ULL << (pos * 2);
+            for (uint64_t nucleotide = 1; nucleotide < 4; nucleotide++) {
+                uint64_t offtarget = searchSignature ^ (nucleotide << (pos * 2));
+                occurrences = index.neighbourOccurrences(offtarget);
+                if (occurrences > 0 && offtargetsScored != nullptr) {
+                    (*offtargetsScored)++;
+                }
+                if (occurrences > 0 && add(totScoreMit, totScoreCfd, cfdPenalties, offtarget, mismatches, 1, occurrences)) {
+                    return true;
+                }
+            }
+        }
+        return false;
+    }
+
+    /// Whether the global scores are such that they can stop being calculated
+    bool canExitEarly(double totScoreMit, double totScoreCfd) const
+    {
+        /** Stop calculating global score early if possible */
+        if (exitOnAnd) {
+            if (totScoreMit > maximum_sum && totScoreCfd > maximum_sum) {
+                return true;
+            }
+        }
+        if (exitOnOr) {
+            if (totScoreMit > maximum_sum || totScoreCfd > maximum_sum) {
+                return true;
+            }
+        }
+        if (exitOnAvg) {
+            if (((totScoreMit + totScoreCfd) / 2.0) > maximum_sum) {
+                return true;
+            }
+        }
+        if (exitOnMit) {
+            if (totScoreMit > maximum_sum) {
+                return true;
+            }
+        }
+        if (exitOnCfd) {
+            if (totScoreCfd > maximum_sum) {
+                return true;
+            }
+        }
+        return false;
+    }
+};
+
+/** The order in which the slices of a query are scanned, see `sliceVisitOrder` */
+enum SliceOrder
+{
+    /// the slices in order
+    SLICE_ORDER_FIXED = 0,
+    /// the largest slice lists first
+    SLICE_ORDER_LARGEST = 1,
+    /// the slice lists with the most near-matches in a sample of their entries first
+    SLICE_ORDER_SAMPLED = 2
+};
+
+/// The slice order named `name`, or false if there is none
+inline bool parseSliceOrder(const std::string &name, SliceOrder &sliceOrder)
+{
+    if (!name.compare("fixed")) {
+        sliceOrder = SLICE_ORDER_FIXED;
+    }
+    else if (!name.compare("largest")) {
+        sliceOrder = SLICE_ORDER_LARGEST;
+    }
+    else if (!name.compare("sampled")) {
+        sliceOrder = SLICE_ORDER_SAMPLED;
+    }
+    else {
+        return false;
+    }
+    return true;
+}
+
+/** The number of entries of each slice list sampled by `SLICE_ORDER_SAMPLED` */
+const size_t ISSL_SLICE_ORDER_SAMPLES = 16;
+
+/**
+ * The order in which to scan the slices of a query
+ *
+ *      A query that will not pass the threshold often has its close off-targets
+ *      concentrated in a few slice lists. Scanning those first reaches the
+ *      threshold, and exits early, sooner. A query that passes scans every
+ *      slice list whatever the order.
+ *
+ *      The largest slice lists are those most enriched with repeats. Sampling
+ *      estimates the proportion of each slice list within `maxDist` of the
+ *      query, from a few entries spread across it. A compact slice list can not
+ *      be sampled without decoding it, so it is ordered by size alone.
+ *
+ * @param[in] index the ISSL index
+ * @param[in] searchSignature the binary encoded query
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] sliceOrder the policy
+ * @param[out] order the slices, in the order to scan them
+ */
+inline void sliceVisitOrder(const IsslIndex &index, uint64_t searchSignature, int maxDist, SliceOrder sliceOrder, size_t *order)
+{
+    size_t sliceCount = index.sliceCount;
+    for (size_t i = 0; i < sliceCount; i++) {
+        order[i] = i;
+    }
+    if (sliceOrder == SLICE_ORDER_FIXED) {
+        return;
+    }
+
+    size_t sizes[64];
+    double nearMatches[64];
+    for (size_t i = 0; i < sliceCount; i++) {
+        uint64_t searchSlice = index.sliceValue(searchSignature, i);
+        sizes[i] = index.sliceListSize(i, searchSlice);
+        nearMatches[i] = 0.0;
+
+        if (sliceOrder != SLICE_ORDER_SAMPLED || index.layout == ISSL_LAYOUT_COMPACT || sizes[i] == 0) {
+            continue;
+        }
+
+        const uint64_t *sliceOffset = index.sliceList(i, searchSlice);
+        size_t samples = std::min(ISSL_SLICE_ORDER_SAMPLES, sizes[i]);
+        size_t near = 0;
+        for (size_t sample = 0; sample < samples; sample++) {
+            uint64_t entry = sliceOffset[sample * sizes[i] / samples];
+            uint64_t offtarget = index.layout == ISSL_LAYOUT_INLINE ? entry & index.inlineEncoding.signatureMask : index.offtargets[entry & 0xFFFFFFFFull];
+            uint64_t xoredSignatures = searchSignature ^ offtarget;
+            uint64_t mismatches = ((xoredSignatures & 0xAAAAAAAAAAAAAAAAull) >> 1) | (xoredSignatures & 0x5555555555555555ull);
+            near += __builtin_popcountll(mismatches) <= maxDist;
+        }
+        nearMatches[i] = (double)near / samples;
+    }
+
+    std::stable_sort(order, order + sliceCount, [&](size_t a, size_t b) {
+        return nearMatches[a] > nearMatches[b] || (nearMatches[a] == nearMatches[b] && sizes[a] > sizes[b]);
+    });
+}
+
+/**
+ * The global MIT and CFD scores of each query, from the sums of their local scores
+ */
+inline void globalScores(
+    const std::vector<double> &totScoresMit,
+    const std::vector<double> &totScoresCfd,
+    std::vector<double> &querySignatureMitScores,
+    std::vector<double> &querySignatureCfdScores
+) {
+    querySignatureMitScores.resize(totScoresMit.size());
+    querySignatureCfdScores.resize(totScoresCfd.size());
+    for (size_t searchIdx = 0; searchIdx < totScoresMit.size(); searchIdx++) {
+        querySignatureMitScores[searchIdx] = 10000.0 / (100.0 + totScoresMit[searchIdx]);
+        querySignatureCfdScores[searchIdx] = 10000.0 / (100.0 + totScoresCfd[searchIdx]);
+    }
+}
+
+/** What scoring a query cost */
+struct QueryStats
+{
+    /// the slice list entries scanned
+    uint64_t entriesScanned = 0;
+
+    /// the entries scanned within `maxDist` of the query, including those seen in an earlier slice
+    uint64_t entriesNear = 0;
+
+    /// the off-targets whose local scores were added, from the neighbour table or the slice lists
+    uint64_t offtargetsScored = 0;
+
+    /** The slices scanned, in part, when the query exited early: zero if it
+     *      exited on the neighbour table alone, -1 if it did not exit early
+     */
+    int32_t exitSlice = -1;
+
+    /// the time spent scoring the query, zero when scored in a group
+    double seconds = 0.0;
+};
+
+/** What scoring a set of queries cost */
+struct ScoringStats
+{
+    /// the time each thread spent scoring
+    std::vector<double> threadBusySeconds;
+
+    /// the slice list entries scanned, over every query
+    size_t entriesScanned = 0;
+
+    /// the sum of each of the other counters of `queries`, see `summarise`
+    size_t entriesNear = 0;
+    size_t offtargetsScored = 0;
+
+    /// the queries that exited early, in total and by `QueryStats::exitSlice`
+    size_t earlyExits = 0;
+    std::vector<size_t> exitsBySlice;
+
+    /// the counters of each query, in the order of the queries
+    std::vector<QueryStats> queries;
+
+    /** Reset the counters for scoring `queryCount` queries with `threads` threads */
+    void reset(size_t queryCount, int threads, size_t sliceCount)
+    {
+        threadBusySeconds.assign(threads, 0.0);
+        entriesScanned = 0;
+        queries.assign(queryCount, QueryStats());
+        exitsBySlice.assign(sliceCount + 1, 0);
+    }
+
+    /** Sum the counters of each query, once they have been scored */
+    void summarise()
+    {
+        entriesNear = 0;
+        offtargetsScored = 0;
+        earlyExits = 0;
+        std::fill(exitsBySlice.begin(), exitsBySlice.end(), 0);
+        for (const QueryStats &query : queries) {
+            entriesNear += query.entriesNear;
+            offtargetsScored += query.offtargetsScored;
+            if (query.exitSlice >= 0) {
+                earlyExits++;
+                exitsBySlice[query.exitSlice]++;
+            }
+        }
+    }
+
+    /**
+     * Add the counters of scoring the same queries against another index
+     *
+     * @param[in] other the counters of the other index
+     * @param[in] sliceOffset the slices of the indexes scanned before it, so
+     *      that `exitSlice` counts the slices of every index scanned
+     */
+    void combine(const ScoringStats &other, size_t sliceOffset)
+    {
+        if (threadBusySeconds.size() < other.threadBusySeconds.size()) {
+            threadBusySeconds.resize(other.threadBusySeconds.size(), 0.0);
+        }
+        for (size_t i = 0; i < other.threadBusySeconds.size(); i++) {
+            threadBusySeconds[i] += other.threadBusySeconds[i];
+        }
+        entriesScanned += other.entriesScanned;
+
+        queries.resize(other.queries.size());
+        for (size_t i = 0; i < other.queries.size(); i++) {
+            const QueryStats &query = other.queries[i];
+            queries[i].entriesScanned += query.entriesScanned;
+            queries[i].entriesNear += query.entriesNear;
+            queries[i].offtargetsScored += query.offtargetsScored;
+            queries[i].seconds += query.seconds;
+            if (query.exitSlice >= 0) {
+                queries[i].exitSlice = sliceOffset + query.exitSlice;
+            }
+        }
+        exitsBySlice.resize(std::max(exitsBySlice.size(), sliceOffset + other.exitsBySlice.size()), 0);
+        summarise();
+    }
+
+    /** Add the counters of `other`, scored after these, as when scoring in chunks */
+    void append(const ScoringStats &other)
+    {
+        if (threadBusySeconds.size() < other.threadBusySeconds.size()) {
+            threadBusySeconds.resize(other.threadBusySeconds.size(), 0.0);
+        }
+        for (size_t i = 0; i < other.threadBusySeconds.size(); i++) {
+            threadBusySeconds[i] += other.threadBusySeconds[i];
+        }
+        if (exitsBySlice.size() < other.exitsBySlice.size()) {
+            exitsBySlice.resize(other.exitsBySlice.size(), 0);
+        }
+        for (size_t i = 0; i < other.exitsBySlice.size(); i++) {
+            exitsBySlice[i] += other.exitsBySlice[i];
+        }
+        entriesScanned += other.entriesScanned;
+        entriesNear += other.entriesNear;
+        offtargetsScored += other.offtargetsScored;
+        earlyExits += other.earlyExits;
+        queries.insert(queries.end(), other.queries.begin(), other.queries.end());
+    }
+};
+
+/**
+ * Add the local scores of the off-targets in the index to the global scores of
+ * each query yet to exit early
+ *
+ *      The global scores carry over from one index to the next, so that the
+ *      queries are scored against several indexes as if they were one, see
+ *      `scoreQueries` for a single index.
+ *
+ * @param[in] index the ISSL index
+ * @param[in] querySignatures the binary encoded candidate guides
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ * @param[in] pamPenalty the CFD penalty of the PAM, see `cfdPamPenalty`
+ * @param[in,out] totScoresMit the sum of the local MIT scores of each query
+ * @param[in,out] totScoresCfd the sum of the local CFD scores of each query
+ * @param[in,out] exited whether each query has exited early, it is not scored if so
+ * @param[in] threads the number of threads to score with, or zero for the OpenMP default
+ * @param[out] stats if given, what scoring the queries cost
+ * @param[in] sliceOrder the order in which to scan the slices of each query, see `sliceVisitOrder`
+ */
+inline void addQueryScores(
+    const IsslIndex &index,
+    const std::vector<uint64_t> &querySignatures,
+    int maxDist,
+    double threshold,
+    const std::string &scoreMethod,
+    double pamPenalty,
+    std::vector<double> &totScoresMit,
+    std::vector<double> &totScoresCfd,
+    std::vector<char> &exited,
+    int threads = 0,
+    ScoringStats *stats = nullptr,
+    SliceOrder sliceOrder = SLICE_ORDER_FIXED
+) {
+    const OfftargetScorer scorer(index, maxDist, threshold, scoreMethod, pamPenalty);
+
+    size_t sliceCount = index.sliceCount;
+    const uint64_t *sliceMasks = index.sliceMasks.data();
+    const uint64_t *offtargets = index.offtargets;
+    bool inlineLayout = index.layout == ISSL_LAYOUT_INLINE;
+    bool compactLayout = index.layout == ISSL_LAYOUT_COMPACT;
+    uint64_t inlineSignatureMask = index.inlineEncoding.signatureMask;
+    ScanKernel kernel = scanKernel();
+
+    /** Prevent assessing an off-target site for multiple slices
+     *
+     *      Create enough 1-bit "seen" flags for the off-targets
+     *      We only want to score a candidate guide against an off-target once.
+     *      The least-significant bit represents the first off-target
+     *      0 0 0 1   0 1 0 0   would indicate that the 3rd and 5th off-target have been seen.
+     *      The CHAR_BIT macro tells us how many bits are in a byte (C++ >= 8 bits per byte)
+     *
+     *      The inline layout has no off-target ids, an off-target has been seen
+     *      if it matches the query in an earlier slice instead.
+     *
+     *      The words that a query sets are noted as they are first set, and only
+     *      they are cleared once it is scored, rather than every word.
+     */
+    uint64_t numOfftargetToggles = inlineLayout ? 1 : (index.offtargetsCount / ((size_t)sizeof(uint64_t) * (size_t)CHAR_BIT)) + 1;
+
+    /** The cost of a query varies by orders of magnitude, with the sizes of
+     *      the slice lists it scans. Estimate it from their sizes, and hand out
+     *      the costliest queries first, one at a time, so that no thread is
+     *      left scoring a costly query once the others have finished
+     */
+    std::vector<std::pair<size_t, size_t>> queryCosts(querySignatures.size());
+    for (size_t searchIdx = 0; searchIdx < querySignatures.size(); searchIdx++) {
+        size_t cost = 0;
+        for (size_t i = 0; i < sliceCount; i++) {
+            cost += index.sliceListSize(i, index.sliceValue(querySignatures[searchIdx], i));
+        }
+        queryCosts[searchIdx] = std::make_pair(cost, searchIdx);
+    }
+    std::sort(queryCosts.begin(), queryCosts.end(), [](const std::pair<size_t, size_t> &a, const std::pair<size_t, size_t> &b) {
+        return a.first > b.first || (a.first == b.first && a.second < b.second);
+    });
+
+    if (threads <= 0) {
+        threads = omp_get_max_threads();
+    }
+    if (stats != nullptr) {
+        stats->reset(querySignatures.size(), threads, sliceCount);
+    }
+
+    /** Begin scoring */
+    #pragma omp parallel num_threads(threads)
+    {
+        std::vector<uint64_t> offtargetToggles(numOfftargetToggles);
+        std::vector<uint64_t *> setOfftargetToggles;
+
+        uint64_t * offtargetTogglesTail = offtargetToggles.data() + numOfftargetToggles - 1;
+
+        /** The ids of the compact slice list being scanned, decoded ahead of the scan */
+        std::vector<uint32_t> compactIds;
+
+        /** The CFD penalty of each mismatch with the current query */
+        double cfdPenalties[CFD_POSITIONS * 4];
+
+        /** The slices of the current query, in the order to scan them */
+        size_t order[64];
+
+        /** The entries of the block being scanned within `maxDist` of the query */
+        uint32_t near[ISSL_SCAN_BLOCK];
+
+        double busySeconds = 0.0;
+        size_t entriesScanned = 0;
+
+        /** For each candidate guide, costliest first */
+        #pragma omp for schedule(dynamic)
+        for (size_t costIdx = 0; costIdx < queryCosts.size(); costIdx++) {
+
+            double queryStart = omp_get_wtime();
+            size_t searchIdx = queryCosts[costIdx].second;
+            auto searchSignature = querySignatures[searchIdx];
+
+            if (exited[searchIdx]) {
+                continue;
+            }
+
+            if (scorer.calcCfd) {
+                cfdQueryPenalties(searchSignature, cfdPenalties);
+            }
+
+            /** Global scores */
+            double totScoreMit = totScoresMit[searchIdx];
+            double totScoreCfd = totScoresCfd[searchIdx];
+
+            /** The counters of the query, see `QueryStats` */
+            QueryStats queryStats;
+
+            bool checkNextSlice = !scorer.addNeighbours(index, totScoreMit, totScoreCfd, cfdPenalties, searchSignature, &queryStats.offtargetsScored);
+            if (!checkNextSlice) {
+                queryStats.exitSlice = 0;
+            }
+
+            if (checkNextSlice) {
+                sliceVisitOrder(index, searchSignature, maxDist, sliceOrder, order);
+            }
+
+            /** For each ISSL slice */
+            for (size_t visit = 0; visit < sliceCount && checkNextSlice; visit++) {
+                size_t i = order[visit];
+                uint64_t searchSlice = index.sliceValue(searchSignature, i);
+
+                size_t signaturesInSlice = index.sliceListSize(i, searchSlice);
+                const uint64_t *sliceOffset = compactLayout ? nullptr : index.sliceList(i, searchSlice);
+
+                /** The next slice list is elsewhere in the index, begin loading it now */
+                if (visit + 1 < sliceCount) {
+                    size_t next = order[visit + 1];
+                    uint64_t nextSlice = index.sliceValue(searchSignature, next);
+                    if (compactLayout) {
+                        __builtin_prefetch(index.compactSliceList(next, nextSlice));
+                    }
+                    else {
+                        __builtin_prefetch(index.sliceList(next, nextSlice));
+                    }
+                }
+
+                const uint8_t *compactBytes = nullptr;
+                uint32_t compactPrevious = 0;
+                size_t compactDecoded = 0;
+                if (compactLayout) {
+                    compactBytes = index.compactSliceList(i, searchSlice);
+                    if (compactIds.size() < signaturesInSlice + 4) {
+                        compactIds.resize(signaturesInSlice + 4);
+                    }
+                }
+
+                ScanEntries scan;
+                scan.entries = compactLayout ? (const void *)compactIds.data() : (const void *)sliceOffset;
+                scan.source = compactLayout ? SCAN_SOURCE_COMPACT_IDS : inlineLayout ? SCAN_SOURCE_SIGNATURES : SCAN_SOURCE_ENTRY_IDS;
+                scan.offtargets = offtargets;
+                scan.signatureMask = inlineSignatureMask;
+
+                /** For each block of the slice list */
+                size_t j = 0;
+                for (size_t block = 0; block < signaturesInSlice && checkNextSlice; block += ISSL_SCAN_BLOCK) {
+                    size_t blockEnd = std::min(block + ISSL_SCAN_BLOCK, signaturesInSlice);
+                    size_t prefetchEnd = std::min(blockEnd + ISSL_PREFETCH_DISTANCE, signaturesInSlice);
+
+                    /** The off-targets are read at random, load those of the upcoming entries early */
+                    if (compactLayout) {
+                        /** Decode the ids of the block, and far enough ahead to load their off-targets early */
+                        while (compactDecoded < prefetchEnd) {
+                            size_t decode = std::min(ISSL_COMPACT_BLOCK, signaturesInSlice - compactDecoded);
+                            decode = (decode + 3) & ~(size_t)3;
+                            compactBytes = decodeCompactIds(compactBytes, decode, compactPrevious, compactIds.data() + compactDecoded);
+                            compactDecoded += decode;
+                        }
+                        for (size_t k = blockEnd; k < prefetchEnd; k++) {
+                            __builtin_prefetch(&offtargets[compactIds[k]]);
+                        }
+                    }
+                    else if (!inlineLayout) {
+                        for (size_t k = blockEnd; k < prefetchEnd; k++) {
+                            __builtin_prefetch(&offtargets[sliceOffset[k] & 0xFFFFFFFFull]);
+                        }
+                    }
+
+                    /** The off-target signatures of the block within `maxDist`, in order */
+                    size_t nearCount = nearEntries(kernel, scan, block, blockEnd, searchSignature, maxDist, near);
+
+                    for (size_t n = 0; n < nearCount; n++) {
+                        j = near[n];
+                        queryStats.entriesNear++;
+                        uint64_t signatureWithOccurrencesAndId = compactLayout ? compactIds[j] : sliceOffset[j];
+                        uint64_t offtarget = scan.offtarget(j);
+
+                        /** Find the positions of mismatches
+                         *
+                         *  Search signature (SS):    A  A  T  T    G  C  A  T
+                         *                           00 00 11 11   10 01 00 11
+                         *
+                         *        Off-target (OT):    A  T  A  T    C  G  A  T
+                         *                           00 11 00 11   01 10 00 11
+                         *
+                         *                SS ^ OT:   00 00 11 11   10 01 00 11
+                         *                         ^ 00 11 00 11   01 10 00 11
+                         *                  (XORd) = 00 11 11 00   11 11 00 00
+                         *
+                         *        XORd & evenBits:   00 11 11 00   11 11 00 00
+                         *                         & 10 10 10 10   10 10 10 10
+                         *                   (eX)  = 00 10 10 00   10 10 00 00
+                         *
+                         *         XORd & oddBits:   00 11 11 00   11 11 00 00
+                         *                         & 01 01 01 01   01 01 01 01
+                         *                   (oX)  = 00 01 01 00   01 01 00 00
+                         *
+                         *         (eX >> 1) | oX:   00 01 01 00   01 01 00 00 (>>1)
+                         *                         | 00 01 01 00   01 01 00 00
+                         *            mismatches   = 00 01 01 00   01 01 00 00
+                         *
+                         *   popcount(mismatches):   4
+                         */
+                        uint64_t xoredSignatures = searchSignature ^ offtarget;
+                        uint64_t evenBits = xoredSignatures & 0xAAAAAAAAAAAAAAAAull;
+                        uint64_t oddBits = xoredSignatures & 0x5555555555555555ull;
+                        uint64_t mismatches = (evenBits >> 1) | oddBits;
+                        int dist = __builtin_popcountll(mismatches);
+
+                        if (dist <= scorer.neighbourDist) {
+                            continue;
+                        }
+
+                        /** Prevent assessing the same off-target for multiple slices */
+                        uint64_t occurrences;
+                        if (inlineLayout) {
+                            bool seenOfftargetAlready = false;
+                            for (size_t k = 0; k < visit && !seenOfftargetAlready; k++) {
+                                seenOfftargetAlready = (xoredSignatures & sliceMasks[order[k]]) == 0;
+                            }
+                            if (seenOfftargetAlready) {
+                                continue;
+                            }
+                            occurrences = index.inlineOccurrences(signatureWithOccurrencesAndId);
+                        }
+                        else {
+                            auto signatureId = signatureWithOccurrencesAndId & 0xFFFFFFFFull;
+                            uint64_t * ptrOfftargetFlag = (offtargetTogglesTail - (signatureId / 64));
+                            if ((*ptrOfftargetFlag >> (signatureId % 64)) & 1ULL) {
+                                continue;
+                            }
+                            if (*ptrOfftargetFlag == 0) {
+                                setOfftargetToggles.push_back(ptrOfftargetFlag);
+                            }
+                            *ptrOfftargetFlag |= (1ULL << (signatureId % 64));
+                            occurrences = compactLayout ? index.compactOccurrences(signatureId) : signatureWithOccurrencesAndId >> 32;
+                        }
+
+                        queryStats.offtargetsScored++;
+                        if (scorer.add(totScoreMit, totScoreCfd, cfdPenalties, offtarget, mismatches, dist, occurrences)) {
+                            checkNextSlice = false;
+                            queryStats.exitSlice = visit + 1;
+                            break;
+                        }
+                    }
+                }
+
+                queryStats.entriesScanned += checkNextSlice ? signaturesInSlice : j + 1;
+
+                if (!checkNextSlice)
+                    break;
+            }
+
+            totScoresMit[searchIdx] = totScoreMit;
+            totScoresCfd[searchIdx] = totScoreCfd;
+            exited[searchIdx] = !checkNextSlice;
+
+            for (uint64_t *ptrOfftargetFlag : setOfftargetToggles) {
+                *ptrOfftargetFlag = 0;
+            }
+            setOfftargetToggles.clear();
+
+            queryStats.seconds = omp_get_wtime() - queryStart;
+            busySeconds += queryStats.seconds;
+            entriesScanned += queryStats.entriesScanned;
+            if (stats != nullptr) {
+                stats->queries[searchIdx] = queryStats;
+            }
+        }
+
+        if (stats != nullptr) {
+            stats->threadBusySeconds[omp_get_thread_num()] = busySeconds;
+            #pragma omp atomic
+            stats->entriesScanned += entriesScanned;
+        }
+    }
+
+    if (stats != nullptr) {
+        stats->summarise();
+    }
+}
+
+/**
+ * Score each query against the off-targets in the index
+ *
+ * @param[in] index the ISSL index
+ * @param[in] querySignatures the binary encoded candidate guides
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ * @param[in] pamPenalty the CFD penalty of the PAM, see `cfdPamPenalty`
+ * @param[out] querySignatureMitScores the global MIT score of each query
+ * @param[out] querySignatureCfdScores the global CFD score of each query
+ * @param[in] threads the number of threads to score with, or zero for the OpenMP default
+ * @param[out] stats if given, what scoring the queries cost
+ * @param[in] sliceOrder the order in which to scan the slices of each query, see `sliceVisitOrder`
+ */
+inline void scoreQueries(
+    const IsslIndex &index,
+    const std::vector<uint64_t> &querySignatures,
+    int maxDist,
+    double threshold,
+    const std::string &scoreMethod,
+    double pamPenalty,
+    std::vector<double> &querySignatureMitScores,
+    std::vector<double> &querySignatureCfdScores,
+    int threads = 0,
+    ScoringStats *stats = nullptr,
+    SliceOrder sliceOrder = SLICE_ORDER_FIXED
+) {
+    std::vector<double> totScoresMit(querySignatures.size(), 0.0);
+    std::vector<double> totScoresCfd(querySignatures.size(), 0.0);
+    std::vector<char> exited(querySignatures.size(), 0);
+
+    addQueryScores(index, querySignatures, maxDist, threshold, scoreMethod, pamPenalty, totScoresMit, totScoresCfd, exited, threads, stats, sliceOrder);
+
+    globalScores(totScoresMit, totScoresCfd, querySignatureMitScores, querySignatureCfdScores);
+}
+
+/**
+ * Add the local scores of the off-targets in the index to the global scores of
+ * each query yet to exit early, grouping the queries that share a slice list
+ *
+ *      `scoreQueries` reads the slice lists of each query in turn, so a slice
+ *      list shared by many queries is read from memory once for each of them.
+ *      Instead, each slice list is read once per slice, and each entry is
+ *      compared with every query of the group whilst it is in the cache.
+ *
+ *      The slices are scored in order, and the entries of a slice list in
+ *      order, so that each query adds the same local scores, in the same order,
+ *      as `scoreQueries`, and exits early at the same off-target. A query that
+ *      exits early leaves its group. An off-target has been seen if it matches
+ *      the query in an earlier slice, as for the inline layout. The off-targets
+ *      in the neighbour table are looked up first, as by `scoreQueries`.
+ *
+ *      Worthwhile when there are many more queries than slice lists in a slice.
+ *      The slices are always scanned in order, see `SLICE_ORDER_FIXED`.
+ *
+ * @param[in] index the ISSL index
+ * @param[in] querySignatures the binary encoded candidate guides
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ * @param[in] pamPenalty the CFD penalty of the PAM, see `cfdPamPenalty`
+ * @param[in,out] totScoresMit the sum of the local MIT scores of each query
+ * @param[in,out] totScoresCfd the sum of the local CFD scores of each query
+ * @param[in,out] exited whether each query has exited early, it is not scored if so
+ * @param[in] threads the number of threads to score with, or zero for the OpenMP default
+ * @param[out] stats if given, what scoring the queries cost
+ */
+inline void addQueryScoresGrouped(
+    const IsslIndex &index,
+    const std::vector<uint64_t> &querySignatures,
+    int maxDist,
+    double threshold,
+    const std::string &scoreMethod,
+    double pamPenalty,
+    std::vector<double> &totScoresMit,
+    std::vector<double> &totScoresCfd,
+    std::vector<char> &exited,
+    int threads = 0,
+    ScoringStats *stats = nullptr
+) {
+    const OfftargetScorer scorer(index, maxDist, threshold, scoreMethod, pamPenalty);
+
+    size_t sliceLimit = index.sliceLimit;
+    size_t sliceCount = index.sliceCount;
+    const uint64_t *sliceMasks = index.sliceMasks.data();
+    size_t queryCount = querySignatures.size();
+
+    /** The queries of each slice value, the queries of `value` begin at `groupOffsets[value]` */
+    std::vector<size_t> groupOffsets(sliceLimit + 1);
+    std::vector<size_t> groupQueries(queryCount);
+
+    /** The slice values with queries, costliest first */
+    std::vector<std::pair<size_t, uint64_t>> groupCosts;
+
+    if (threads <= 0) {
+        threads = omp_get_max_threads();
+    }
+    if (stats != nullptr) {
+        stats->reset(queryCount, threads, sliceCount);
+    }
+
+    /** The counters of each query, see `QueryStats`, if they are collected */
+    QueryStats *queryStats = stats != nullptr ? stats->queries.data() : nullptr;
+
+    #pragma omp parallel num_threads(threads)
+    {
+        std::vector<uint64_t> signatures, entries;
+
+        /** The queries of the group yet to exit early, by their position in the group */
+        std::vector<size_t> active;
+        std::vector<uint64_t> activeSignatures;
+
+        /** The CFD penalties of each query of the group */
+        std::vector<double> cfdPenalties;
+
+        double busySeconds = 0.0;
+        size_t entriesScanned = 0;
+
+        /** The off-targets in the neighbour table are looked up for each query, before any are grouped */
+        if (scorer.neighbourDist >= 0) {
+            double queryCfdPenalties[CFD_POSITIONS * 4];
+
+            #pragma omp for schedule(dynamic, 64)
+            for (size_t searchIdx = 0; searchIdx < queryCount; searchIdx++) {
+                if (exited[searchIdx]) {
+                    continue;
+                }
+                double queryStart = omp_get_wtime();
+                if (scorer.calcCfd) {
+                    cfdQueryPenalties(querySignatures[searchIdx], queryCfdPenalties);
+                }
+                exited[searchIdx] = scorer.addNeighbours(index, totScoresMit[searchIdx], totScoresCfd[searchIdx], queryCfdPenalties, querySignatures[searchIdx], queryStats != nullptr ? &queryStats[searchIdx].offtargetsScored : nullptr);
+                if (queryStats != nullptr && exited[searchIdx]) {
+                    queryStats[searchIdx].exitSlice = 0;
+                }
+                busySeconds += omp_get_wtime() - queryStart;
+            }
+        }
+
+        /** For each ISSL slice, in order */
+        for (size_t i = 0; i < sliceCount; i++) {
+
+            /** Group the queries yet to exit early by their slice value */
+            #pragma omp single
+            {
+                std::fill(groupOffsets.begin(), groupOffsets.end(), 0);
+                for (size_t searchIdx = 0; searchIdx < queryCount; searchIdx++) {
+                    if (!exited[searchIdx]) {
+                        groupOffsets[index.sliceValue(querySignatures[searchIdx], i) + 1]++;
+                    }
+                }
+                groupCosts.clear();
+                for (uint64_t value = 0; value < index.sliceValues(i); value++) {
+                    if (groupOffsets[value + 1] > 0) {
+                        groupCosts.push_back(std::make_pair(groupOffsets[value + 1] * index.sliceListSize(i, value), value));
+                    }
+                    groupOffsets[value + 1] += groupOffsets[value];
+                }
+                std::vector<size_t> groupEnds(groupOffsets.begin(), groupOffsets.end() - 1);
+                for (size_t searchIdx = 0; searchIdx < queryCount; searchIdx++) {
+                    if (!exited[searchIdx]) {
+                        groupQueries[groupEnds[index.sliceValue(querySignatures[searchIdx], i)]++] = searchIdx;
+                    }
+                }
+                std::sort(groupCosts.begin(), groupCosts.end(), [](const std::pair<size_t, uint64_t> &a, const std::pair<size_t, uint64_t> &b) {
+                    return a.first > b.first || (a.first == b.first && a.second < b.second);
+                });
+            }
+
+            /** For each slice list with queries, costliest first */
+            #pragma omp for schedule(dynamic)
+            for (size_t groupIdx = 0; groupIdx < groupCosts.size(); groupIdx++) {
+
+                double groupStart = omp_get_wtime();
+                uint64_t searchSlice = groupCosts[groupIdx].second;
+                const size_t *group = groupQueries.data() + groupOffsets[searchSlice];
+                size_t groupSize = groupOffsets[searchSlice + 1] - groupOffsets[searchSlice];
+
+                active.clear();
+                activeSignatures.clear();
+                if (scorer.calcCfd) {
+                    cfdPenalties.resize(groupSize * CFD_POSITIONS * 4);
+                }
+                for (size_t g = 0; g < groupSize; g++) {
+                    active.push_back(g);
+                    activeSignatures.push_back(querySignatures[group[g]]);
+                    if (scorer.calcCfd) {
+                        cfdQueryPenalties(querySignatures[group[g]], &cfdPenalties[g * CFD_POSITIONS * 4]);
+                    }
+                }
+
+                index.readSliceList(i, searchSlice, signatures, entries);
+
+                /** For each off-target signature in slice, then each query yet to exit early */
+                for (size_t j = 0; j < signatures.size() && !active.empty(); j++) {
+                    uint64_t offtarget = signatures[j];
+                    entriesScanned += active.size();
+
+                    for (size_t k = 0; k < active.size(); k++) {
+                        /** Find the positions of mismatches, see `scoreQueries` */
+                        uint64_t xoredSignatures = activeSignatures[k] ^ offtarget;
+                        uint64_t evenBits = xoredSignatures & 0xAAAAAAAAAAAAAAAAull;
+                        uint64_t oddBits = xoredSignatures & 0x5555555555555555ull;
+                        uint64_t mismatches = (evenBits >> 1) | oddBits;
+                        int dist = __builtin_popcountll(mismatches);
+
+                        if (dist > maxDist) {
+                            continue;
+                        }
+                        if (queryStats != nullptr) {
+                            queryStats[group[active[k]]].entriesNear++;
+                        }
+                        if (dist <= scorer.neighbourDist) {
+                            continue;
+                        }
+
+                        /** Prevent assessing the same off-target for multiple slices */
+                        bool seenOfftargetAlready = false;
+                        for (size_t s = 0; s < i && !seenOfftargetAlready; s++) {
+                            seenOfftargetAlready = (xoredSignatures & sliceMasks[s]) == 0;
+                        }
+                        if (seenOfftargetAlready) {
+                            continue;
+                        }
+
+                        size_t g = active[k];
+                        size_t searchIdx = group[g];
+                        const double *queryCfdPenalties = scorer.calcCfd ? cfdPenalties.data() + g * CFD_POSITIONS * 4 : nullptr;
+                        if (queryStats != nullptr) {
+                            queryStats[searchIdx].offtargetsScored++;
+                        }
+                        if (scorer.add(totScoresMit[searchIdx], totScoresCfd[searchIdx], queryCfdPenalties, offtarget, mismatches, dist, index.entryOccurrences(entries[j]))) {
+                            /** The query leaves the group */
+                            exited[searchIdx] = 1;
+                            if (queryStats != nullptr) {
+                                queryStats[searchIdx].entriesScanned += j + 1;
+                                queryStats[searchIdx].exitSlice = i + 1;
+                            }
+                            active[k] = active.back();
+                            activeSignatures[k] = activeSignatures.back();
+                            active.pop_back();
+                            activeSignatures.pop_back();
+                            k--;
+                        }
+                    }
+                }
+
+                if (queryStats != nullptr) {
+                    for (size_t g : active) {
+                        queryStats[group[g]].entriesScanned += signatures.size();
+                    }
+                }
+
+                busySeconds += omp_get_wtime() - groupStart;
+            }
+        }
+
+        if (stats != nullptr) {
+            stats->threadBusySeconds[omp_get_thread_num()] = busySeconds;
+            #pragma omp atomic
+            stats->entriesScanned += entriesScanned;
+        }
+    }
+
+    if (stats != nullptr) {
+        stats->summarise();
+    }
+}
+
+/**
+ * Score each query against the off-targets in the index, grouping the queries
+ * that share a slice list, see `addQueryScoresGrouped`
+ *
+ *      The parameters are as per `scoreQueries`.
+ */
+inline void scoreQueriesGrouped(
+    const IsslIndex &index,
+    const std::vector<uint64_t> &querySignatures,
+    int maxDist,
+    double threshold,
+    const std::string &scoreMethod,
+    double pamPenalty,
+    std::vector<double> &querySignatureMitScores,
+    std::vector<double> &querySignatureCfdScores,
+    int threads = 0,
+    ScoringStats *stats = nullptr
+) {
+    std::vector<double> totScoresMit(querySignatures.size(), 0.0);
+    std::vector<double> totScoresCfd(querySignatures.size(), 0.0);
+    std::vector<char> exited(querySignatures.size(), 0);
+
+    addQueryScoresGrouped(index, querySignatures, maxDist, threshold, scoreMethod, pamPenalty, totScoresMit, totScoresCfd, exited, threads, stats);
+
+    globalScores(totScoresMit, totScoresCfd, querySignatureMitScores, querySignatureCfdScores);
+}
+
+#endif
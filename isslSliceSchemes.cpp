@@ -0,0 +1,466 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+Report what slicing schemes would cost for the off-targets of an ISSL index,
+without building an index with each (see `parseSliceScheme` in isslIndex.h).
+
+For each scheme, the slice list entries that a query scans are counted from
+the number of off-targets with each slice value. A random query falls in a
+slice list of average size. A query drawn from the genome, as a candidate
+guide is, more likely falls in a large one: on average, the sum of the
+squared slice list sizes over the number of off-targets.
+
+With no scheme given, the scheme of the index is reported.
+
+An off-target is found only if it matches a query in at least one slice, so a
+scheme of n slices finds every off-target within n - 1 mismatches, and its
+index has MIT scores to as many. The scorer, daemon and library refuse a max
+distance of n or more against such an index, so the schemes reported or tried
+must have more slices than the max distance to be scored at it.
+
+
+./isslSliceSchemes stats [issltable]
+
+Report the sizes of the slice lists of each slice of an index, the largest slice
+lists over every slice, and the size of each section of the index. The largest
+slice lists are those of repeats, which every query falling in them scans.
+
+
+./isslSliceSchemes tune [issltable] [guides file] [max distance] [score-threshold] [score-method] [off-target sample (1 in n, default 1)] [scheme...]
+
+Build an index of the off-targets of `issltable` with each scheme, in memory,
+score the guides against it, and recommend the scheme that scored them fastest.
+With no scheme given, the scheme of the index is tried, and the schemes of
+slices of balanced widths, contiguous or interleaved, that find every off-target
+within the maximum distance. To tune quickly, give a sample of the guides and
+score against one in every n off-targets; the scores are then not those of the
+full index, but the relative cost of each scheme is much the same.
+
+
+To compile:
+
+g++ -o isslSliceSchemes isslSliceSchemes.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap
+
+*/
+
+#include "isslIndex.h"
+#include "isslScoring.h"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <vector>
+#include <string>
+#include <algorithm>
+#include <phmap.h>
+#include <omp.h>
+
+using namespace std;
+
+/** Slices of up to this many bits are counted in an array, wider slices in a hash map */
+const size_t DENSE_SLICE_BITS = 24;
+
+/** The number of the largest slice lists reported by `stats` */
+const size_t HEAVY_SLICE_LISTS = 10;
+
+/** The most slices, beyond those needed for the maximum distance, tried by `tune` */
+const size_t TUNE_EXTRA_SLICES = 3;
+
+/** The cost of a slicing scheme for the off-targets of an index */
+struct SchemeCost
+{
+    /// the maximum mismatches within which every off-target is found
+    size_t guaranteedDist = 0;
+
+    /// the slice lists, over every slice
+    size_t sliceLists = 0;
+
+    /// the slice list entries expected to be scanned per query
+    double randomEntries = 0.0;
+    double genomeEntries = 0.0;
+};
+
+/**
+ * The sum of the squares of the number of off-targets with each slice value
+ *
+ * @param[in] index the ISSL index
+ * @param[in] sliceMask the signature bits of the slice
+ */
+double sumSquaredSliceListSizes(const IsslIndex &index, uint64_t sliceMask)
+{
+    double sum = 0.0;
+    if ((size_t)__builtin_popcountll(sliceMask) <= DENSE_SLICE_BITS) {
+        vector<uint32_t> counts(sliceValueCount(sliceMask));
+        for (size_t id = 0; id < index.offtargetsCount; id++) {
+            counts[extractSliceValue(index.offtargets[id], sliceMask)]++;
+        }
+        for (uint32_t count : counts) {
+            sum += (double)count * count;
+        }
+    }
+    else {
+        phmap::flat_hash_map<uint64_t, uint32_t> counts;
+        for (size_t id = 0; id < index.offtargetsCount; id++) {
+            counts[extractSliceValue(index.offtargets[id], sliceMask)]++;
+        }
+        for (auto const &x : counts) {
+            sum += (double)x.second * x.second;
+        }
+    }
+    return sum;
+}
+
+/**
+ * The cost of the slicing scheme `sliceMasks` for the off-targets of `index`
+ */
+SchemeCost schemeCost(const IsslIndex &index, const vector<uint64_t> &sliceMasks)
+{
+    SchemeCost cost;
+    double offtargets = (double)index.offtargetsCount;
+
+    /** A mismatch changes every slice that holds a bit of its position */
+    size_t slicesPerPosition = 1;
+    for (size_t pos = 0; pos < index.seqLength; pos++) {
+        size_t slices = 0;
+        for (uint64_t sliceMask : sliceMasks) {
+            slices += ((sliceMask >> (pos * 2)) & 3) != 0;
+        }
+        slicesPerPosition = max(slicesPerPosition, slices);
+    }
+    cost.guaranteedDist = (sliceMasks.size() + slicesPerPosition - 1) / slicesPerPosition - 1;
+
+    vector<double> sumSquares(sliceMasks.size());
+    #pragma omp parallel for schedule(dynamic)
+    for (size_t i = 0; i < sliceMasks.size(); i++) {
+        sumSquares[i] = sumSquaredSliceListSizes(index, sliceMasks[i]);
+    }
+
+    for (size_t i = 0; i < sliceMasks.size(); i++) {
+        size_t values = sliceValueCount(sliceMasks[i]);
+        cost.sliceLists += values;
+        cost.randomEntries += offtargets / values;
+        cost.genomeEntries += offtargets > 0 ? sumSquares[i] / offtargets : 0.0;
+    }
+    return cost;
+}
+
+/**
+ * The slice value `value` of the slice `sliceMask`, as the nucleotides at its positions
+ *
+ *      Each position outside the slice is `.`
+ */
+string sliceValueSequence(uint64_t sliceMask, uint64_t value, size_t seqLength)
+{
+    const char nucleotides[] = "ACGT";
+    string sequence(seqLength, '.');
+    for (size_t pos = 0; pos < seqLength; pos++) {
+        if (((sliceMask >> (pos * 2)) & 3) == 0) {
+            continue;
+        }
+        sequence[pos] = nucleotides[value & 3];
+        value >>= 2;
+    }
+    return sequence;
+}
+
+/**
+ * Report the sizes of the slice lists of `index`, the largest slice lists, and the size of each section
+ */
+int reportIndexStats(const IsslIndex &index)
+{
+    const char *layoutNames[] = {"standard", "inline", "compact"};
+    printf("Off-targets:         %zu\n", index.offtargetsCount);
+    printf("Off-target sites:    %zu\n", index.seqCount);
+    printf("Sequence length:     %zu\n", index.seqLength);
+    printf("Slices:              %s\n", sliceSchemeName(index.sliceMasks).c_str());
+    printf("Layout:              %s\n", index.layout < 3 ? layoutNames[index.layout] : "unknown");
+
+    /** The slice list sizes of each slice, and the largest over every slice as (size, slice list) */
+    vector<pair<size_t, size_t>> heaviest;
+    printf("\nSlice list sizes\n");
+    printf("  %-5s %10s %8s %10s %10s %10s %10s %10s\n", "slice", "lists", "empty", "mean", "median", "99%", "max", "max/mean");
+    for (size_t i = 0; i < index.sliceCount; i++) {
+        size_t values = index.sliceValues(i);
+        vector<size_t> sizes(values);
+        size_t empty = 0;
+        for (uint64_t value = 0; value < values; value++) {
+            sizes[value] = index.sliceListSize(i, value);
+            empty += sizes[value] == 0;
+            heaviest.push_back(make_pair(sizes[value], index.sliceListBases[i] + value));
+            if (heaviest.size() > HEAVY_SLICE_LISTS * 4) {
+                nth_element(heaviest.begin(), heaviest.begin() + HEAVY_SLICE_LISTS, heaviest.end(), greater<pair<size_t, size_t>>());
+                heaviest.resize(HEAVY_SLICE_LISTS);
+            }
+        }
+        sort(sizes.begin(), sizes.end());
+        double mean = (double)index.offtargetsCount / values;
+        printf("  %-5zu %10zu %8zu %10.1f %10zu %10zu %10zu %10.1f\n",
+            i, values, empty, mean, sizes[values / 2], sizes[min(values - 1, values * 99 / 100)], sizes.back(), mean > 0 ? sizes.back() / mean : 0.0);
+    }
+
+    sort(heaviest.begin(), heaviest.end(), greater<pair<size_t, size_t>>());
+    heaviest.resize(min(heaviest.size(), HEAVY_SLICE_LISTS));
+    printf("\nLargest slice lists\n");
+    for (const pair<size_t, size_t> &list : heaviest) {
+        size_t i = upper_bound(index.sliceListBases.begin(), index.sliceListBases.end(), list.second) - index.sliceListBases.begin() - 1;
+        uint64_t value = list.second - index.sliceListBases[i];
+        printf("  slice %-3zu %s %10zu (%.2f%% of the slice)\n", i, sliceValueSequence(index.sliceMasks[i], value, index.seqLength).c_str(),
+            list.first, index.offtargetsCount > 0 ? 100.0 * list.first / index.offtargetsCount : 0.0);
+    }
+
+    printf("\nSize (MB)\n");
+    if (index.header != nullptr) {
+        const char *sectionNames[] = {
+            "score masks", "scores", "off-targets", "slice offsets", "slice contents", "MIT table",
+            "occurrence overflow", "occurrences", "slice byte offsets", "neighbours", "slice masks"
+        };
+        for (size_t id = 0; id < sizeof(sectionNames) / sizeof(sectionNames[0]); id++) {
+            if (index.header->sectionSizes[id] > 0) {
+                printf("  %-20s %10.1f\n", sectionNames[id], index.header->sectionSizes[id] / 1e6);
+            }
+        }
+        printf("  %-20s %10.1f\n", "total", index.mappedSize / 1e6);
+    }
+    else {
+        printf("  %-20s %10.1f\n", "off-targets", index.offtargetsCount * sizeof(uint64_t) / 1e6);
+        printf("  %-20s %10.1f\n", "slice offsets", (index.sliceListCount() + 1) * sizeof(uint64_t) / 1e6);
+        printf("  %-20s %10.1f\n", "slice contents", index.offtargetsCount * index.sliceCount * sizeof(uint64_t) / 1e6);
+    }
+
+    return 0;
+}
+
+/**
+ * Build an index of the standard layout, in memory, of the off-targets of `source` sliced by `sliceMasks`
+ *
+ * @param[in] source the ISSL index, of any layout
+ * @param[in] sliceMasks the signature bits of each slice
+ * @param[in] sampleStride keep one in every `sampleStride` off-targets
+ * @param[out] index the new index, which shares nothing with `source`
+ */
+void resliceIndex(const IsslIndex &source, const vector<uint64_t> &sliceMasks, size_t sampleStride, IsslIndex &index)
+{
+    /** Every off-target is in exactly one slice list of each slice */
+    vector<pair<uint64_t, uint64_t>> offtargets;
+    size_t seen = 0;
+    for (uint64_t value = 0; value < source.sliceValues(0); value++) {
+        source.scanSliceList(0, value, [&](uint64_t signature, uint64_t occurrences, uint64_t) {
+            if (seen++ % sampleStride == 0) {
+                offtargets.push_back(make_pair(signature, occurrences));
+            }
+            return false;
+        });
+    }
+    sort(offtargets.begin(), offtargets.end());
+
+    buildIsslIndex(offtargets, source.seqLength, 0, sliceMasks, index);
+
+    index.precalculatedScores = source.precalculatedScores;
+    index.scoresCount = source.scoresCount;
+    index.mitRanking = source.mitRanking;
+    index.mitTableStorage.assign(source.mitTable, source.mitTable + source.mitRanking.size());
+    index.mitTable = index.mitTableStorage.data();
+}
+
+/**
+ * The scheme of `sliceCount` slices, of as near equal widths as possible
+ *
+ * @param[in] interleaved the slices take every `sliceCount`th position,
+ *      rather than contiguous positions
+ */
+string balancedSliceScheme(size_t seqLength, size_t sliceCount, bool interleaved)
+{
+    string scheme;
+    size_t pos = 0;
+    for (size_t i = 0; i < sliceCount; i++) {
+        scheme += i > 0 ? "," : "";
+        if (interleaved) {
+            for (size_t p = i; p < seqLength; p += sliceCount) {
+                scheme += (p > i ? "+" : "") + to_string(p);
+            }
+            continue;
+        }
+        size_t positions = seqLength / sliceCount + (i < seqLength % sliceCount ? 1 : 0);
+        scheme += to_string(pos) + (positions > 1 ? "-" + to_string(pos + positions - 1) : "");
+        pos += positions;
+    }
+    return scheme;
+}
+
+/**
+ * Score `guidesPath` against an index built with each scheme, and recommend the fastest
+ */
+int tuneSliceSchemes(const IsslIndex &source, const char *guidesPath, int maxDist, double threshold, const string &scoreMethod, size_t sampleStride, vector<string> schemes)
+{
+    if (!isScoreMethod(scoreMethod)) {
+        fprintf(stderr, "Error: unknown score method: %s\n", scoreMethod.c_str());
+        return 1;
+    }
+    if (sampleStride == 0) {
+        fprintf(stderr, "Error: the off-target sample must be 1 in 1 or more\n");
+        return 1;
+    }
+
+    FILE *fp = fopen(guidesPath, "rb");
+    if (fp == NULL) {
+        fprintf(stderr, "Failed to open guides file: %s\n", guidesPath);
+        return 1;
+    }
+    SignatureEncoding encoding;
+    vector<uint64_t> guides;
+    char line[256];
+    while (fgets(line, sizeof(line), fp) != NULL) {
+        size_t len = strcspn(line, "\r\n");
+        if (len == 0) {
+            continue;
+        }
+        if (len != source.seqLength) {
+            fprintf(stderr, "Error: guide %.*s is not of the expected length (%zu)\n", (int)len, line, source.seqLength);
+            fclose(fp);
+            return 1;
+        }
+        guides.push_back(encoding.sequenceToSignature(line, source.seqLength));
+    }
+    fclose(fp);
+
+    if (schemes.empty()) {
+        schemes.push_back(sliceSchemeName(source.sliceMasks));
+        for (size_t sliceCount = maxDist + 1; sliceCount <= maxDist + 1 + TUNE_EXTRA_SLICES && sliceCount <= source.seqLength; sliceCount++) {
+            for (bool interleaved : {false, true}) {
+                string scheme = balancedSliceScheme(source.seqLength, sliceCount, interleaved);
+                if (find(schemes.begin(), schemes.end(), scheme) == schemes.end()) {
+                    schemes.push_back(scheme);
+                }
+            }
+        }
+    }
+
+    printf("Off-targets:         %zu (1 in %zu of %zu)\n", (source.offtargetsCount + sampleStride - 1) / sampleStride, sampleStride, source.offtargetsCount);
+    printf("Guides:              %zu\n", guides.size());
+    printf("Threads:             %d\n", omp_get_max_threads());
+
+    string fastest;
+    double fastestSec = 0.0;
+    for (const string &scheme : schemes) {
+        vector<uint64_t> sliceMasks;
+        size_t sliceWidth;
+        if (!parseSliceScheme(scheme, source.seqLength, sliceMasks, sliceWidth) || sliceMasks.empty()) {
+            fprintf(stderr, "Invalid slice width or scheme: %s\n", scheme.c_str());
+            return 1;
+        }
+
+        printf("\n%s\n", scheme.c_str());
+
+        IsslIndex index;
+        double buildStart = omp_get_wtime();
+        resliceIndex(source, sliceMasks, sampleStride, index);
+        double buildSec = omp_get_wtime() - buildStart;
+
+        SchemeCost cost = schemeCost(index, sliceMasks);
+        if ((size_t)maxDist > cost.guaranteedDist) {
+            printf("  Skipped: off-targets with more than %zu mismatches may be missed\n", cost.guaranteedDist);
+            continue;
+        }
+
+        vector<double> mitScores, cfdScores;
+        ScoringStats stats;
+        double scoreStart = omp_get_wtime();
+        scoreQueries(index, guides, maxDist, threshold, scoreMethod, cfdPamPenalties[0b1010], mitScores, cfdScores, 0, &stats);
+        double scoreSec = omp_get_wtime() - scoreStart;
+
+        size_t bytes = (index.sliceListCount() + 1 + index.allSignaturesStorage.size() + index.offtargetsCount) * sizeof(uint64_t);
+        printf("  Build:                      %.3f s\n", buildSec);
+        printf("  Size:                       %.1f MB\n", bytes / 1e6);
+        printf("  Entries per genome query:   %.1f\n", cost.genomeEntries);
+        printf("  Entries scanned per guide:  %.1f\n", guides.empty() ? 0.0 : (double)stats.entriesScanned / guides.size());
+        printf("  Early exits:                %zu\n", stats.earlyExits);
+        printf("  Score:                      %.3f s\n", scoreSec);
+
+        if (fastest.empty() || scoreSec < fastestSec) {
+            fastest = scheme;
+            fastestSec = scoreSec;
+        }
+    }
+
+    if (fastest.empty()) {
+        fprintf(stderr, "Error: no scheme finds every off-target within %d mismatches\n", maxDist);
+        return 1;
+    }
+    printf("\nFastest:             %s\n", fastest.c_str());
+
+    return 0;
+}
+
+int main(int argc, char **argv)
+{
+    if (argc >= 3 && !strcmp(argv[1], "stats")) {
+        IsslIndex index;
+        if (!loadIsslIndex(argv[2], index)) {
+            return 1;
+        }
+        return reportIndexStats(index);
+    }
+
+    if (argc >= 7 && !strcmp(argv[1], "tune")) {
+        IsslIndex index;
+        if (!loadIsslIndex(argv[2], index)) {
+            return 1;
+        }
+        size_t sampleStride = argc > 7 ? strtoull(argv[7], NULL, 10) : 1;
+        vector<string> schemes(argv + min(argc, 8), argv + argc);
+        return tuneSliceSchemes(index, argv[3], atoi(argv[4]), atof(argv[5]), argv[6], sampleStride, schemes);
+    }
+
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s [issltable] [max distance] [slice width (bits) or scheme...]\n", argv[0]);
+        fprintf(stderr, "       %s stats [issltable]\n", argv[0]);
+        fprintf(stderr, "       %s tune [issltable] [guides file] [max distance] [score-threshold] [score-method] [off-target sample (1 in n, default 1)] [slice width (bits) or scheme...]\n", argv[0]);
+        exit(1);
+    }
+
+    IsslIndex index;
+    if (!loadIsslIndex(argv[1], index)) {
+        return 1;
+    }
+    size_t maxDist = atoi(argv[2]);
+
+    vector<string> schemes;
+    for (int arg = 3; arg < argc; arg++) {
+        schemes.push_back(argv[arg]);
+    }
+    if (schemes.empty()) {
+        schemes.push_back(index.sliceWidth > 0 ? to_string(index.sliceWidth) : sliceSchemeName(index.sliceMasks));
+    }
+
+    printf("Off-targets:         %zu\n", index.offtargetsCount);
+    printf("Sequence length:     %zu\n", index.seqLength);
+
+    for (const string &scheme : schemes) {
+        vector<uint64_t> sliceMasks;
+        size_t sliceWidth;
+        if (!parseSliceScheme(scheme, index.seqLength, sliceMasks, sliceWidth) || sliceMasks.empty()) {
+            fprintf(stderr, "Invalid slice width or scheme: %s\n", scheme.c_str());
+            return 1;
+        }
+
+        SchemeCost cost = schemeCost(index, sliceMasks);
+
+        printf("\n%s\n", scheme.c_str());
+        printf("  Slices:                     %zu\n", sliceMasks.size());
+        printf("  Slice lists:                %zu (%.1f MB of offsets)\n", cost.sliceLists, cost.sliceLists * sizeof(uint64_t) / 1e6);
+        printf("  Slice list entries:         %zu\n", index.offtargetsCount * sliceMasks.size());
+        printf("  Complete up to:             %zu mismatches\n", cost.guaranteedDist);
+        printf("  Entries per random query:   %.1f\n", cost.randomEntries);
+        printf("  Entries per genome query:   %.1f\n", cost.genomeEntries);
+        if (maxDist > cost.guaranteedDist) {
+            printf("  Warning: off-targets with more than %zu mismatches may be missed\n", cost.guaranteedDist);
+        }
+    }
+
+    return 0;
+}
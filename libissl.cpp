@@ -0,0 +1,118 @@
+/*
+
+Faster and better CRISPR guide RNA design with the Crackling method.
+Jacob Bradford, Timothy Chappell, Dimitri Perrin
+bioRxiv 2020.02.14.950261; doi: https://doi.org/10.1101/2020.02.14.950261
+
+
+A shared library exposing the ISSL scorer to other processes, such as Python
+via ctypes (see IsslLibrary.py). The index is loaded once and the candidate
+guides are scored in-process, without files or text in between.
+
+Queries are passed as binary encoded signatures, two bits per nucleotide with
+the first nucleotide in the least significant bits (A: 0, C: 1, G: 2, T: 3).
+The scores are written to caller-owned arrays, in the same order as the
+queries. Scores that the score method does not calculate are set to -1.
+
+
+To compile:
+
+g++ -o libissl.so libissl.cpp -O3 -std=c++11 -fopenmp -mpopcnt -Iparallel_hashmap -shared -fPIC
+
+*/
+
+#include "isslIndex.h"
+#include "isslScoring.h"
+
+#include <cstdint>
+#include <vector>
+#include <string>
+#include <algorithm>
+
+using namespace std;
+
+extern "C" {
+
+/**
+ * Load an ISSL index
+ *
+ * @param[in] path the ISSL index, either version
+ * @return a handle to the index, or NULL if it could not be loaded
+ */
+void *issl_load_index(const char *path)
+{
+    IsslIndex *index = new IsslIndex();
+    if (!loadIsslIndex(path, *index)) {
+        delete index;
+        return NULL;
+    }
+    return index;
+}
+
+/** Release an index loaded by `issl_load_index` */
+void issl_free_index(void *index)
+{
+    delete (IsslIndex *)index;
+}
+
+/** The length of the sequences in the index */
+size_t issl_seq_length(const void *index)
+{
+    return ((const IsslIndex *)index)->seqLength;
+}
+
+/**
+ * Score each query against the off-targets in the index
+ *
+ * @param[in] index a handle returned by `issl_load_index`
+ * @param[in] querySignatures the binary encoded candidate guides
+ * @param[in] queryCount the number of candidate guides
+ * @param[in] maxDist the maximum number of mismatches
+ * @param[in] threshold the threshold used to exit scoring early
+ * @param[in] scoreMethod the scores to calculate, and how to exit early
+ * @param[in] pam the PAM that CFD penalises for the off-targets, of which only the last two nucleotides are scored, e.g. NGG
+ * @param[out] mitScores the global MIT score of each query
+ * @param[out] cfdScores the global CFD score of each query
+ * @param[in] threads the number of threads to score with, or zero for all
+ * @return 0 on success, otherwise 1 if the score method or PAM is invalid, or 2 if
+ *      `maxDist` is not less than the slices of the index, see `supportsMaxDist`
+ */
+int issl_score(
+    const void *index,
+    const uint64_t *querySignatures,
+    size_t queryCount,
+    int maxDist,
+    double threshold,
+    const char *scoreMethod,
+    const char *pam,
+    double *mitScores,
+    double *cfdScores,
+    int threads
+) {
+    string method = scoreMethod;
+    double pamPenalty = 0.0;
+    if (!isScoreMethod(method) || !cfdPamPenalty(pam, pamPenalty)) {
+        return 1;
+    }
+    if (!supportsMaxDist(*(const IsslIndex *)index, maxDist)) {
+        return 2;
+    }
+
+    bool calcMit = method.compare("cfd") != 0;
+    bool calcCfd = method.compare("mit") != 0;
+
+    vector<uint64_t> signatures(querySignatures, querySignatures + queryCount);
+    vector<double> querySignatureMitScores;
+    vector<double> querySignatureCfdScores;
+
+    scoreQueries(*(const IsslIndex *)index, signatures, maxDist, threshold, method, pamPenalty, querySignatureMitScores, querySignatureCfdScores, threads);
+
+    for (size_t i = 0; i < queryCount; i++) {
+        mitScores[i] = calcMit ? querySignatureMitScores[i] : -1.0;
+        cfdScores[i] = calcCfd ? querySignatureCfdScores[i] : -1.0;
+    }
+
+    return 0;
+}
+
+}
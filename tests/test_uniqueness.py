@@ -0,0 +1,115 @@
+'''
+Checks that a guide is unique in the genome when `uniqueness = issl`, including
+a guide that is not in the ISSL index, such as one with a leading T
+
+Requires isslCreateIndex, isslExactMatches and isslScoreOfftargets (see `make`).
+Run from the repository: python -m unittest discover tests
+'''
+
+import configparser, csv, os, random, shutil, subprocess, sys, tempfile, unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A leading-T guide, which extractOfftargets.py does not keep, so it is not in
+# the ISSL index. It appears twice in the genome
+LEADING_T_GUIDE = 'TACGGATCCTAGCTTAGCAGAGG'
+
+# A guide that appears once in the genome
+UNIQUE_GUIDE = 'CATGCAGTTCGATCACGTAGTGG'
+
+
+def randomSequence(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+class TestIsslUniqueness(unittest.TestCase):
+    def setUp(self):
+        for binary in ['isslCreateIndex', 'isslExactMatches', 'isslScoreOfftargets']:
+            if not os.path.isfile(os.path.join(REPO, binary)):
+                self.skipTest(f'{binary} is not built')
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        rng = random.Random(0)
+        genome = (
+            randomSequence(rng, 500) + LEADING_T_GUIDE +
+            randomSequence(rng, 500) + LEADING_T_GUIDE +
+            randomSequence(rng, 500) + UNIQUE_GUIDE +
+            randomSequence(rng, 500)
+        )
+        self.genome = os.path.join(self.dir, 'genome.fa')
+        with open(self.genome, 'w') as f:
+            f.write(f'>chr1\n{genome}\n')
+
+        self.exons = os.path.join(self.dir, 'exons.fa')
+        with open(self.exons, 'w') as f:
+            f.write(f'>exon1\nAAAA{LEADING_T_GUIDE}AAAA\n>exon2\nAAAA{UNIQUE_GUIDE}AAAA\n')
+
+        offtargets = os.path.join(self.dir, 'offtargets.txt')
+        self.index = os.path.join(self.dir, 'offtargets.issl')
+        subprocess.run([sys.executable, 'extractOfftargets.py', offtargets, self.genome], cwd=REPO, check=True, capture_output=True)
+        subprocess.run(['./isslCreateIndex', offtargets, '20', '8', self.index], cwd=REPO, check=True, capture_output=True)
+
+    def runCrackling(self, bowtie2Index='', bowtie2Binary='bowtie2'):
+        config = configparser.ConfigParser(interpolation=None)
+        config.read_dict({
+            'general': {'name': 'test', 'optimisation': 'high'},
+            'consensus': {'n': '1', 'mm10db': 'False', 'sgrnascorer2': 'False', 'chopchop': 'True'},
+            'input': {
+                'exon-sequences': self.exons,
+                'offtarget-sites': self.index,
+                'gff-annotation': '',
+                'bowtie2-index': bowtie2Index,
+                'batch-size': '5000000',
+            },
+            'output': {'dir': self.dir, 'filename': 'guides.txt', 'delimiter': ','},
+            'offtargetscore': {
+                'enabled': 'True',
+                'binary': os.path.join(REPO, 'isslScoreOfftargets'),
+                'uniqueness': 'issl',
+                'exact-binary': os.path.join(REPO, 'isslExactMatches'),
+                'method': 'and',
+                'threads': '1',
+                'page-length': '0',
+                'score-threshold': '0',
+                'max-distance': '4',
+            },
+            'sgrnascorer2': {'model': 'model-py3.txt', 'score-threshold': '0'},
+            'bowtie2': {'binary': bowtie2Binary, 'threads': '1', 'page-length': '0'},
+            'rnafold': {
+                'binary': shutil.which('true'),
+                'threads': '1',
+                'page-length': '0',
+                'low_energy_threshold': '-30',
+                'high_energy_threshold': '-18',
+            },
+        })
+        configPath = os.path.join(self.dir, 'config.ini')
+        with open(configPath, 'w') as f:
+            config.write(f)
+
+        subprocess.run([sys.executable, 'Crackling.py', '-c', configPath], cwd=REPO, check=True, capture_output=True)
+
+        with open(os.path.join(self.dir, 'test-guides.txt')) as f:
+            return {row['seq']: row for row in csv.DictReader(f)}
+
+    def test_leading_t_duplicate_is_rejected_without_bowtie2(self):
+        guides = self.runCrackling()
+        self.assertEqual(guides[LEADING_T_GUIDE]['passedBowtie'], '0')
+        self.assertEqual(guides[UNIQUE_GUIDE]['passedBowtie'], '1')
+
+    def test_leading_t_duplicate_is_rejected_by_bowtie2(self):
+        if not (shutil.which('bowtie2') and shutil.which('bowtie2-build')):
+            self.skipTest('Bowtie2 is not installed')
+
+        bowtie2Index = os.path.join(self.dir, 'genome')
+        subprocess.run(['bowtie2-build', self.genome, bowtie2Index], check=True, capture_output=True)
+
+        guides = self.runCrackling(bowtie2Index)
+        self.assertEqual(guides[LEADING_T_GUIDE]['passedBowtie'], '0')
+        self.assertEqual(guides[UNIQUE_GUIDE]['passedBowtie'], '1')
+
+
+if __name__ == '__main__':
+    unittest.main()